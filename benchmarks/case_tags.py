@@ -0,0 +1,154 @@
+"""Latency of tag filters and tag counts over cases: case_tags index vs JSON scan.
+
+Seeds cases spread over many patients, each with a few tags drawn from a
+skewed vocabulary, then pages through the cases carrying a common and a rare
+tag and counts cases per tag, through ``case_tags`` (``tagged_with`` and
+``count_tags``) and by reading ``Case.tags`` of every case, which is what the
+JSON column required before.
+
+Usage:
+    python benchmarks/case_tags.py [--cases 1000000] [--patients 10000]
+
+Uses a temporary SQLite file unless DATABASE_URL is set.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault(
+    "DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/case_tags.sqlite"
+)
+os.environ.setdefault("LOGFIRE_TOKEN", "bench")
+
+from sqlalchemy import insert, select  # noqa: E402
+
+from controllers.tags import case_tag_rows, count_tags, tagged_with  # noqa: E402
+from database.database import Base, SessionLocal, engine  # noqa: E402
+from database.migrations import run_migrations  # noqa: E402
+from models import analytics, attachment, import_job, token, user  # noqa: E402,F401
+from models.cases import Case, CaseTag  # noqa: E402
+from models.patients import Patient  # noqa: E402
+from models.session import ChatSession  # noqa: E402,F401
+from models.session_message import SessionMessages  # noqa: E402,F401
+from utils.pagination import keyset_page  # noqa: E402
+
+VOCABULARY = [f"tag{i}" for i in range(500)]
+WEIGHTS = [1 / (rank + 1) for rank in range(len(VOCABULARY))]
+COMMON, RARE = VOCABULARY[0], VOCABULARY[-1]
+BATCH = 10000
+
+
+async def seed(cases: int, patients: int) -> str:
+    rng = random.Random(0)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await run_migrations(conn)
+    suffix = uuid.uuid4().hex[:8]
+    ids = [f"bench_{suffix}_{i}" for i in range(patients)]
+    async with SessionLocal() as db:
+        for offset in range(0, patients, BATCH):
+            await db.execute(
+                insert(Patient),
+                [
+                    {"patient_id": i, "name": "Benchmark"}
+                    for i in ids[offset : offset + BATCH]
+                ],
+            )
+        for offset in range(0, cases, BATCH):
+            rows, tags = [], []
+            for n in range(offset, min(offset + BATCH, cases)):
+                case_id, patient_id = f"{suffix}_case_{n}", ids[n % patients]
+                case_tags = rng.choices(VOCABULARY, WEIGHTS, k=rng.randint(1, 4))
+                rows.append(
+                    {
+                        "case_id": case_id,
+                        "patient_id": patient_id,
+                        "case_name": "B",
+                        "description": "B",
+                        "tags": case_tags,
+                    }
+                )
+                tags += case_tag_rows(case_id, patient_id, case_tags)
+            await db.execute(insert(Case), rows)
+            await db.execute(insert(CaseTag), tags)
+            await db.commit()
+    return ids[0]
+
+
+async def scan_filter(tag: str, db) -> list:
+    rows = await db.execute(
+        select(Case.case_id, Case.tags)
+        .where(Case.deleted_at.is_(None))
+        .order_by(Case.case_id)
+    )
+    return [case_id for case_id, tags in rows if tag in (tags or [])][:100]
+
+
+async def indexed_filter(tag: str, db) -> list:
+    key, filters = tagged_with([tag])
+    cases, _ = await keyset_page(
+        db,
+        [Case.case_id],
+        key=key,
+        filters=[*filters, Case.deleted_at.is_(None)],
+        limit=100,
+    )
+    return cases
+
+
+async def scan_counts(patient_id: str, db) -> list:
+    query = select(Case.tags).where(Case.deleted_at.is_(None))
+    if patient_id:
+        query = query.where(Case.patient_id == patient_id)
+    counts = Counter(tag for tags in await db.scalars(query) for tag in set(tags or []))
+    return counts.most_common(50)
+
+
+async def indexed_counts(patient_id: str, db) -> list:
+    return await count_tags(db, patient_id=patient_id)
+
+
+async def measure(run, arg, repeat: int) -> tuple:
+    total = 0.0
+    for _ in range(repeat):
+        async with SessionLocal() as db:
+            start = time.perf_counter()
+            found = await run(arg, db)
+            total += time.perf_counter() - start
+    return total / repeat * 1000, len(found)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", type=int, default=1_000_000)
+    parser.add_argument("--patients", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    patient_id = await seed(args.cases, args.patients)
+    print(
+        f"{engine.dialect.name}: {args.cases} cases over {args.patients} "
+        f"patients, seeded in {time.perf_counter() - start:.0f}s"
+    )
+    for tag in (COMMON, RARE):
+        for name, run in (("scan", scan_filter), ("index", indexed_filter)):
+            ms, found = await measure(run, tag, args.repeat)
+            print(f"  filter {tag:<8} {name:<6} {ms:9.2f}ms  cases={found}")
+    for scope, owner in (("patient", patient_id), ("all", None)):
+        for name, run in (("scan", scan_counts), ("index", indexed_counts)):
+            ms, found = await measure(run, owner, args.repeat)
+            print(f"  counts {scope:<8} {name:<6} {ms:9.2f}ms  tags={found}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
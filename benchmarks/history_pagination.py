@@ -0,0 +1,121 @@
+"""Latency of loading a long chat session: full history vs keyset pages.
+
+Usage:
+    python benchmarks/history_pagination.py [--messages 5000] [--limit 50] [--repeat 20]
+
+Uses a temporary SQLite file unless DATABASE_URL is set.
+"""
+
+import argparse
+import asyncio
+import datetime
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault(
+    "DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/history_pagination.sqlite"
+)
+os.environ.setdefault("LOGFIRE_TOKEN", "bench")
+
+from controllers.message import get_chat_history  # noqa: E402
+from database.database import Base, SessionLocal, engine  # noqa: E402
+from database.migrations import run_migrations  # noqa: E402
+from models import analytics, attachment, token, user  # noqa: E402,F401
+from models.cases import Case  # noqa: E402
+from models.patients import Patient  # noqa: E402
+from models.session import ChatSession  # noqa: E402
+from models.session_message import SessionMessages  # noqa: E402
+
+
+def message_content(i: int) -> list:
+    text = f"Follow-up question {i} about the patient's symptoms. " * 8
+    return [
+        {"role": "user", "content": [{"type": "text", "text": text}]},
+        {"role": "assistant", "content": [{"type": "text", "text": text * 3}]},
+    ]
+
+
+async def seed(messages: int) -> str:
+    suffix = uuid.uuid4().hex[:8]
+    session_id = f"bench_s_{suffix}"
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await run_migrations(conn)
+    async with SessionLocal() as db:
+        db.add(Patient(patient_id=f"bench_p_{suffix}", name="Benchmark"))
+        db.add(
+            Case(
+                case_id=f"bench_c_{suffix}",
+                patient_id=f"bench_p_{suffix}",
+                case_name="Benchmark",
+                description="Benchmark",
+            )
+        )
+        db.add(
+            ChatSession(
+                session_id=session_id,
+                case_id=f"bench_c_{suffix}",
+                patient_id=f"bench_p_{suffix}",
+            )
+        )
+        start = datetime.datetime(2025, 1, 1, tzinfo=datetime.UTC)
+        db.add_all(
+            SessionMessages(
+                message_id=str(uuid.uuid4()),
+                session_id=session_id,
+                case_id=f"bench_c_{suffix}",
+                patient_id=f"bench_p_{suffix}",
+                content=message_content(i),
+                safety={},
+                timestamp=start + datetime.timedelta(seconds=i),
+            )
+            for i in range(messages)
+        )
+        await db.commit()
+    return session_id
+
+
+async def measure(repeat: int, **kwargs) -> tuple:
+    async with SessionLocal() as db:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            history = await get_chat_history(db=db, **kwargs)
+        elapsed = (time.perf_counter() - start) / repeat
+    return elapsed * 1000, history
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    session_id = await seed(args.messages)
+    print(f"{engine.dialect.name}: {args.messages} messages in one session")
+
+    full_ms, history = await measure(args.repeat, session_id=session_id)
+    print(f"  full history              {full_ms:8.2f} ms  ({len(history)} messages)")
+    latest_ms, page = await measure(
+        args.repeat, session_id=session_id, limit=args.limit, newest_first=True
+    )
+    label = f"latest page (limit={args.limit})"
+    print(f"  {label:<26}{latest_ms:8.2f} ms")
+    middle = history[len(history) // 2]["message_id"]
+    deep_ms, _ = await measure(
+        args.repeat,
+        session_id=session_id,
+        limit=args.limit,
+        before=middle,
+        newest_first=True,
+    )
+    print(f"  page before the midpoint  {deep_ms:8.2f} ms")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+"""Bytes and encode time of the legacy 768x768 PNG+base64 path vs encoding policies.
+
+Usage:
+    python benchmarks/image_encoding.py [path/to/image ...] [--repeat 10]
+
+Without arguments it uses assets/database.png and a synthetic radiograph-like image.
+"""
+
+import argparse
+import base64
+import os
+import sys
+import time
+from io import BytesIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("LOGFIRE_TOKEN", "bench")
+
+from PIL import Image, ImageFilter  # noqa: E402
+
+from utils.file_processor import ImageEncodingPolicy, encode_image_bytes  # noqa: E402
+
+
+def synthetic_xray() -> bytes:
+    """A smooth grayscale 2048x1536 image with sensor noise, stored as PNG."""
+    noise = Image.effect_noise((2048, 1536), 40).filter(ImageFilter.GaussianBlur(2))
+    gradient = Image.linear_gradient("L").resize((2048, 1536))
+    image = Image.blend(noise, gradient, 0.6)
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def legacy(data: bytes) -> bytes:
+    image = Image.open(BytesIO(data)).resize((768, 768), Image.LANCZOS)
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue())
+
+
+def measure(fn, data: bytes, repeat: int):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        out = fn(data)
+    return len(out), (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("images", nargs="*")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    samples = [(path, open(path, "rb").read()) for path in args.images] or [
+        ("assets/database.png", open(os.path.join(ROOT, "assets/database.png"), "rb").read()),
+        ("synthetic x-ray", synthetic_xray()),
+    ]
+    policies = [
+        ImageEncodingPolicy("PNG", max_side=768),
+        ImageEncodingPolicy("JPEG", quality=85, max_side=768),
+        ImageEncodingPolicy("WEBP", quality=80, max_side=768),
+    ]
+    for name, data in samples:
+        size, ms = measure(legacy, data, args.repeat)
+        print(f"{name} ({len(data) / 1024:.0f} KiB input)")
+        print(f"  {'legacy png+base64':<20} {size / 1024:8.1f} KiB {ms:8.1f} ms")
+        for policy in policies:
+            size_p, ms_p = measure(
+                lambda d: encode_image_bytes(d, policy), data, args.repeat
+            )
+            print(
+                f"  {policy.fingerprint:<20} {size_p / 1024:8.1f} KiB {ms_p:8.1f} ms"
+                f"  ({100 * (1 - size_p / size):.0f}% smaller)"
+            )
+
+
+if __name__ == "__main__":
+    main()
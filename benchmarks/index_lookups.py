@@ -0,0 +1,135 @@
+"""Hot-lookup latency as tables grow, with and without the migration-1 indexes.
+
+Usage:
+    python benchmarks/index_lookups.py [--sizes 10000 100000 1000000] [--lookups 200]
+
+Runs against a temporary SQLite file built from the models. The unindexed
+numbers use SQLite's ``NOT INDEXED`` clause on the same data, so both columns
+see identical tables.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault(
+    "DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/index_lookups.sqlite"
+)
+os.environ.setdefault("LOGFIRE_TOKEN", "bench")
+
+from database.database import Base, engine  # noqa: E402
+from database.migrations import run_migrations  # noqa: E402
+from models import analytics, attachment, cases, patients, session  # noqa: E402,F401
+from models import session_message, token, user  # noqa: E402,F401
+
+MESSAGES_PER_SESSION = 20
+
+LOOKUPS = {
+    "history (session_messages.session_id)": (
+        "SELECT message_id FROM session_messages {hint} WHERE session_id = ?",
+        lambda n: (f"s{random.randrange(n // MESSAGES_PER_SESSION)}",),
+    ),
+    "auth (tokens.user_id, access_token, status)": (
+        "SELECT token_id FROM tokens {hint} WHERE user_id = ? AND access_token = ? "
+        "AND status = 1 ORDER BY time_created DESC LIMIT 1",
+        lambda n: (lambda i: (f"u{i}", f"access-{i}"))(random.randrange(n)),
+    ),
+    "sessions (chat_session.case_id, patient_id)": (
+        "SELECT session_id FROM chat_session {hint} WHERE case_id = ? AND patient_id = ?",
+        lambda n: (lambda i: (f"c{i}", f"p{i}"))(
+            random.randrange(n // MESSAGES_PER_SESSION)
+        ),
+    ),
+    "login (users.email)": (
+        "SELECT user_id FROM users {hint} WHERE email = ?",
+        lambda n: (f"u{random.randrange(n)}@example.com",),
+    ),
+}
+
+
+def grow(cursor, start: int, end: int):
+    """Insert rows ``start..end`` into the four looked-up tables."""
+    cursor.executemany(
+        "INSERT INTO users (user_id, email, password, role) VALUES (?, ?, 'x', 'user')",
+        ((f"u{i}", f"u{i}@example.com") for i in range(start, end)),
+    )
+    cursor.executemany(
+        "INSERT INTO tokens (token_id, user_id, access_token, refresh_token, status, "
+        "time_created) VALUES (?, ?, ?, 'r', 1, '2025-01-01')",
+        ((f"t{i}", f"u{i}", f"access-{i}") for i in range(start, end)),
+    )
+    sessions = range(start // MESSAGES_PER_SESSION, end // MESSAGES_PER_SESSION)
+    cursor.executemany(
+        "INSERT INTO chat_session (session_id, case_id, patient_id) VALUES (?, ?, ?)",
+        ((f"s{i}", f"c{i}", f"p{i}") for i in sessions),
+    )
+    cursor.executemany(
+        "INSERT INTO session_messages (message_id, session_id, case_id, patient_id, "
+        "content, safety, timestamp) VALUES (?, ?, 'c', 'p', '[]', '{}', ?)",
+        (
+            (f"m{i}", f"s{i // MESSAGES_PER_SESSION}", f"2025-01-01T00:00:{i:09d}")
+            for i in range(start, end)
+        ),
+    )
+
+
+def time_lookups(cursor, sql: str, params, n: int, lookups: int) -> float:
+    start = time.perf_counter()
+    for _ in range(lookups):
+        cursor.execute(sql, params(n)).fetchall()
+    return (time.perf_counter() - start) / lookups * 1e6
+
+
+async def create_schema():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await run_migrations(conn)
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--lookups", type=int, default=200)
+    args = parser.parse_args()
+
+    asyncio.run(create_schema())
+    path = engine.url.database
+    connection = sqlite3.connect(path)
+    cursor = connection.cursor()
+    rows = 0
+    for size in sorted(args.sizes):
+        grow(cursor, rows, size)
+        connection.commit()
+        rows = size
+        cursor.execute("ANALYZE")
+        print(f"rows={size:,}")
+        for name, (sql, params) in LOOKUPS.items():
+            indexed = time_lookups(
+                cursor, sql.format(hint=""), params, size, args.lookups
+            )
+            # Full scans get slow quickly; fewer samples keep the run short.
+            scanned = time_lookups(
+                cursor,
+                sql.format(hint="NOT INDEXED"),
+                params,
+                size,
+                max(1, args.lookups // 20),
+            )
+            print(
+                f"  {name:<46} indexed={indexed:9.1f}us  "
+                f"unindexed={scanned:11.1f}us"
+            )
+    connection.close()
+
+
+if __name__ == "__main__":
+    main()
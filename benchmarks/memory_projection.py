@@ -0,0 +1,97 @@
+"""Per-turn CPU and allocations of building model memory for a long session.
+
+Compares the previous path (full ``SessionMessages`` ORM rows turned into
+history dicts, keeping only ``content``) with ``get_chat_memory``, which
+streams the ``content`` column alone.
+
+Usage:
+    python benchmarks/memory_projection.py [--messages 5000] [--repeat 10]
+
+Uses a temporary SQLite file unless DATABASE_URL is set.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault(
+    "DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/memory_projection.sqlite"
+)
+os.environ.setdefault("LOGFIRE_TOKEN", "bench")
+
+from sqlalchemy import select  # noqa: E402
+
+from controllers.message import get_chat_memory  # noqa: E402
+from database.database import SessionLocal, engine  # noqa: E402
+from history_pagination import seed  # noqa: E402
+from models.session_message import SessionMessages  # noqa: E402
+
+
+async def orm_memory(session_id: str, db) -> list:
+    messages = (
+        await db.scalars(
+            select(SessionMessages)
+            .where(SessionMessages.session_id == session_id)
+            .order_by(SessionMessages.timestamp, SessionMessages.message_id)
+        )
+    ).all()
+    history = [
+        {
+            "message_id": msg.message_id,
+            "case_id": msg.case_id,
+            "patient_id": msg.patient_id,
+            "session_id": msg.session_id,
+            "content": msg.content,
+            "safety": msg.safety,
+            "like": msg.like,
+            "feedback": msg.feedback,
+            "stars": msg.stars,
+            "timestamp": msg.timestamp,
+        }
+        for msg in messages
+    ]
+    return [content for msg in history for content in msg["content"]]
+
+
+async def measure(loader, session_id: str, repeat: int) -> tuple:
+    cpu = wall = peak = 0.0
+    for _ in range(repeat):
+        # A fresh session per turn, as each request gets its own.
+        async with SessionLocal() as db:
+            tracemalloc.start()
+            wall_start, cpu_start = time.perf_counter(), time.process_time()
+            memory = await loader(session_id, db)
+            cpu += time.process_time() - cpu_start
+            wall += time.perf_counter() - wall_start
+            peak += tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return cpu / repeat * 1000, wall / repeat * 1000, peak / repeat / 1e6, memory
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    session_id = await seed(args.messages)
+    print(f"{engine.dialect.name}: {args.messages} messages in one session")
+    results = {}
+    for name, loader in (("orm rows", orm_memory), ("projection", get_chat_memory)):
+        cpu, wall, peak, memory = await measure(loader, session_id, args.repeat)
+        results[name] = memory
+        print(
+            f"  {name:<11} cpu={cpu:8.1f}ms  wall={wall:8.1f}ms  "
+            f"peak_alloc={peak:7.1f}MB"
+        )
+    assert results["orm rows"] == results["projection"]
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,153 @@
+"""Latency of keyword search over session messages: full-text index vs scan.
+
+Seeds a corpus of messages spread over many patients, then searches one
+patient's messages for a common and a rare word, through ``search_messages``
+(FTS5 / tsvector index) and by loading the patient's history and scanning it,
+which is what clients had to do before.
+
+Usage:
+    python benchmarks/message_search.py [--messages 1000000] [--patients 1000]
+
+Uses a temporary SQLite file unless DATABASE_URL is set.
+"""
+
+import argparse
+import asyncio
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault(
+    "DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/message_search.sqlite"
+)
+os.environ.setdefault("LOGFIRE_TOKEN", "bench")
+
+from sqlalchemy import insert, select  # noqa: E402
+
+from controllers.message import message_search_text, search_messages  # noqa: E402
+from database.database import Base, SessionLocal, engine  # noqa: E402
+from database.migrations import run_migrations  # noqa: E402
+from models import analytics, attachment, token, user  # noqa: E402,F401
+from models.cases import Case  # noqa: E402
+from models.patients import Patient  # noqa: E402
+from models.session import ChatSession  # noqa: E402
+from models.session_message import SessionMessages  # noqa: E402
+
+VOCABULARY = [f"word{i}" for i in range(5000)]
+COMMON, RARE = "headache", "photophobia"
+BATCH = 10000
+
+
+def message_content(rng: random.Random) -> list:
+    words = rng.choices(VOCABULARY, k=40)
+    if rng.random() < 0.2:
+        words.append(COMMON)
+    if rng.random() < 0.002:
+        words.append(RARE)
+    text = " ".join(words)
+    return [
+        {"role": "user", "content": [{"type": "text", "text": text[:80]}]},
+        {"role": "assistant", "content": [{"type": "text", "text": text}]},
+    ]
+
+
+async def seed(messages: int, patients: int) -> str:
+    rng = random.Random(0)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await run_migrations(conn)
+    suffix = uuid.uuid4().hex[:8]
+    ids = [f"bench_{suffix}_{i}" for i in range(patients)]
+    async with SessionLocal() as db:
+        await db.execute(
+            insert(Patient), [{"patient_id": i, "name": "Benchmark"} for i in ids]
+        )
+        await db.execute(
+            insert(Case),
+            [
+                {"case_id": i, "patient_id": i, "case_name": "B", "description": "B"}
+                for i in ids
+            ],
+        )
+        await db.execute(
+            insert(ChatSession),
+            [{"session_id": i, "case_id": i, "patient_id": i} for i in ids],
+        )
+        start = datetime.datetime(2025, 1, 1, tzinfo=datetime.UTC)
+        for offset in range(0, messages, BATCH):
+            rows = []
+            for n in range(offset, min(offset + BATCH, messages)):
+                owner = ids[n % patients]
+                content = message_content(rng)
+                rows.append(
+                    {
+                        "message_id": str(uuid.uuid4()),
+                        "session_id": owner,
+                        "case_id": owner,
+                        "patient_id": owner,
+                        "content": content,
+                        "safety": {},
+                        "search_text": message_search_text(content),
+                        "timestamp": start + datetime.timedelta(seconds=n),
+                    }
+                )
+            await db.execute(insert(SessionMessages), rows)
+            await db.commit()
+    return ids[0]
+
+
+async def scan(word: str, patient_id: str, db) -> list:
+    rows = await db.execute(
+        select(SessionMessages.message_id, SessionMessages.content).where(
+            SessionMessages.patient_id == patient_id
+        )
+    )
+    return [
+        message_id
+        for message_id, content in rows
+        if word in message_search_text(content).split()
+    ]
+
+
+async def indexed(word: str, patient_id: str, db) -> list:
+    hits, _ = await search_messages(word, db, patient_id=patient_id, limit=20)
+    return [hit["message_id"] for hit in hits]
+
+
+async def measure(search, word: str, patient_id: str, repeat: int) -> tuple:
+    total = 0.0
+    for _ in range(repeat):
+        async with SessionLocal() as db:
+            start = time.perf_counter()
+            found = await search(word, patient_id, db)
+            total += time.perf_counter() - start
+    return total / repeat * 1000, len(found)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    patient_id = await seed(args.messages, args.patients)
+    print(
+        f"{engine.dialect.name}: {args.messages} messages over {args.patients} "
+        f"patients, seeded in {time.perf_counter() - start:.0f}s"
+    )
+    for word in (COMMON, RARE):
+        for name, search in (("scan", scan), ("index", indexed)):
+            ms, found = await measure(search, word, patient_id, args.repeat)
+            print(f"  {word:<12} {name:<6} {ms:8.2f}ms  hits={found}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,130 @@
+"""Latency of patient name search: normalized-name indexes vs LIKE scan.
+
+Seeds patients with generated first and last names, then searches a name
+prefix, a surname (word prefix), and a rare and a common substring,
+through ``search_patients`` and through a case-insensitive ``LIKE`` over
+``Patient.name`` ranked in Python, which is what a name search cost before.
+
+Usage:
+    python benchmarks/patient_search.py [--patients 1000000]
+
+Uses a temporary SQLite file unless DATABASE_URL is set.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault(
+    "DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/patient_search.sqlite"
+)
+os.environ.setdefault("LOGFIRE_TOKEN", "bench")
+
+from sqlalchemy import func, insert, select  # noqa: E402
+
+from controllers.patient_search import search_patients  # noqa: E402
+from database.database import Base, SessionLocal, engine  # noqa: E402
+from database.migrations import run_migrations  # noqa: E402
+from models import analytics, attachment, import_job, token, user  # noqa: E402,F401
+from models.cases import Case  # noqa: E402,F401
+from models.patients import Patient  # noqa: E402
+from models.session import ChatSession  # noqa: E402,F401
+from models.session_message import SessionMessages  # noqa: E402,F401
+from utils.names import normalize_name  # noqa: E402
+
+SYLLABLES = ["an", "be", "ca", "do", "el", "fi", "go", "ha", "is", "jo", "ka"]
+SYLLABLES += ["lu", "ma", "ne", "or", "pa", "ri", "sa", "to", "vi", "ze", "ño"]
+# "nbe" never starts a name but is inside about one in a hundred.
+QUERIES = {
+    "prefix": "Mar",
+    "word": "Lumanevi",
+    "substring": "zeñoanbe",
+    "common": "nbe",
+}
+BATCH = 10000
+
+
+def _name(rng: random.Random) -> str:
+    return " ".join(
+        "".join(rng.choices(SYLLABLES, k=rng.randint(2, 4))).capitalize()
+        for _ in range(2)
+    )
+
+
+async def seed(patients: int):
+    rng = random.Random(0)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await run_migrations(conn)
+    suffix = uuid.uuid4().hex[:8]
+    async with SessionLocal() as db:
+        for offset in range(0, patients, BATCH):
+            rows = []
+            for n in range(offset, min(offset + BATCH, patients)):
+                name = _name(rng)
+                rows.append(
+                    {
+                        "patient_id": f"bench_{suffix}_{n}",
+                        "name": name,
+                        "name_normalized": normalize_name(name),
+                    }
+                )
+            await db.execute(insert(Patient), rows)
+            await db.commit()
+
+
+async def scan_search(query: str, db) -> list:
+    rows = await db.execute(
+        select(Patient.patient_id, Patient.name).where(
+            func.lower(Patient.name).contains(query.lower(), autoescape=True),
+            Patient.deleted_at.is_(None),
+        )
+    )
+    query = query.lower()
+    return sorted(
+        rows,
+        key=lambda row: (not row.name.lower().startswith(query), row.name),
+    )[:20]
+
+
+async def indexed_search(query: str, db) -> list:
+    return await search_patients(query, db, [Patient.patient_id, Patient.name])
+
+
+async def measure(run, arg, repeat: int) -> tuple:
+    total = 0.0
+    for _ in range(repeat):
+        async with SessionLocal() as db:
+            start = time.perf_counter()
+            found = await run(arg, db)
+            total += time.perf_counter() - start
+    return total / repeat * 1000, len(found)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--patients", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    await seed(args.patients)
+    print(
+        f"{engine.dialect.name}: {args.patients} patients, "
+        f"seeded in {time.perf_counter() - start:.0f}s"
+    )
+    for kind, query in QUERIES.items():
+        for name, run in (("scan", scan_search), ("index", indexed_search)):
+            ms, found = await measure(run, query, args.repeat)
+            print(f"  {kind:<10} {query!r:<11} {name:<6} {ms:9.2f}ms  hits={found}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,117 @@
+"""Peak memory of concurrent PDF uploads: legacy read()/BytesIO path vs spooled ingestion.
+
+Usage:
+    python benchmarks/upload_memory.py [--concurrency 8] [--pages 6]
+
+Each mode runs in its own subprocess so ``ru_maxrss`` is not shared between them.
+"""
+
+import argparse
+import asyncio
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("LOGFIRE_TOKEN", "bench")
+os.environ.setdefault("ATTACHMENT_STORE_PATH", tempfile.mkdtemp())
+
+
+def make_pdf(pages: int) -> bytes:
+    """A born-digital report with an incompressible scan embedded on every page."""
+    import pymupdf
+    from io import BytesIO
+    from PIL import Image
+
+    doc = pymupdf.open()
+    for _ in range(pages):
+        page = doc.new_page()
+        page.insert_textbox(pymupdf.Rect(36, 36, 560, 400), "Findings. " * 200)
+        noise = BytesIO()
+        Image.frombytes("RGB", (1000, 1000), os.urandom(3_000_000)).save(noise, "PNG")
+        page.insert_image(pymupdf.Rect(36, 420, 300, 700), stream=noise.getvalue())
+    return doc.tobytes()
+
+
+def make_upload(data: bytes):
+    from fastapi import UploadFile
+
+    # Starlette spools multipart bodies the same way before the route sees them.
+    spool = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    spool.write(data)
+    spool.seek(0)
+    return UploadFile(file=spool, size=len(data), filename="report.pdf", headers=None)
+
+
+async def legacy(upload):
+    import pymupdf
+    from io import BytesIO
+
+    pdf_bytes = await upload.read()
+    buffer = BytesIO(pdf_bytes)
+    with pymupdf.open(stream=buffer.getvalue()) as pdf:
+        return sum(len(page.get_text("text")) for page in pdf)
+
+
+async def streaming(upload):
+    import pymupdf
+    from utils.attachment_store import get_attachment_store
+    from utils.upload import UploadBudget, hash_upload
+
+    store = get_attachment_store()
+    spool, key, _ = await hash_upload(upload, UploadBudget())
+    await store.put_file(key, spool, None)
+    async with store.open_buffer(key, None) as view:
+        with pymupdf.open(stream=view, filetype="pdf") as pdf:
+            return sum(len(page.get_text("text")) for page in pdf)
+
+
+async def run(mode: str, concurrency: int, pages: int):
+    data = make_pdf(pages)
+    uploads = [make_upload(data) for _ in range(concurrency)]
+    handler = legacy if mode == "legacy" else streaming
+    # Import application modules up front so they are not counted in the peak.
+    import utils.attachment_store  # noqa: F401
+    import utils.upload  # noqa: F401
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(handler(upload) for upload in uploads))
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(
+        f"{mode:>9}: pdf={len(data) / 1e6:.1f}MB concurrency={concurrency} "
+        f"python_peak={peak / 1e6:.1f}MB per_request={peak / concurrency / 1e6:.2f}MB "
+        f"max_rss={rss:.0f}MB elapsed={elapsed * 1000:.0f}ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["legacy", "streaming"])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--pages", type=int, default=6)
+    args = parser.parse_args()
+    if args.mode:
+        asyncio.run(run(args.mode, args.concurrency, args.pages))
+    else:
+        for mode in ("legacy", "streaming"):
+            subprocess.run(
+                [
+                    sys.executable,
+                    __file__,
+                    "--mode",
+                    mode,
+                    "--concurrency",
+                    str(args.concurrency),
+                    "--pages",
+                    str(args.pages),
+                ],
+                check=True,
+            )
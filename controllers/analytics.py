@@ -0,0 +1,213 @@
+from datetime import UTC, datetime
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.database import UPSERT_INSERTS
+from models.analytics import MessageRollup
+from models.session_message import SessionMessages
+
+ROLLUP_KEY = ("day", "model", "case_id", "safety_level")
+ROLLUP_TOTALS = (
+    "messages",
+    "score_sum",
+    "scored",
+    "stars_sum",
+    "rated",
+    "likes",
+    "dislikes",
+)
+# Dimensions the analytics endpoint can group by.
+ROLLUP_GROUPS = ("day", "model", "case_id")
+UNKNOWN = "unknown"
+
+# Values the like endpoint stores for a like and a dislike.
+LIKE_VALUES = {"true", "like", "1"}
+DISLIKE_VALUES = {"false", "dislike", "0"}
+
+
+def _day(timestamp: datetime) -> str:
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=UTC)
+    return timestamp.astimezone(UTC).date().isoformat()
+
+
+def _key(timestamp: datetime, model: str, case_id: str, safety: dict) -> tuple:
+    level = (safety or {}).get("safety_level")
+    return (_day(timestamp), model or UNKNOWN, case_id, str(level or UNKNOWN))
+
+
+def _score(safety: dict) -> dict:
+    score = (safety or {}).get("score")
+    if isinstance(score, (int, float)) and not isinstance(score, bool):
+        return {"score_sum": score, "scored": 1}
+    return {}
+
+
+def _feedback(like, stars) -> dict:
+    like = str(like).lower() if like is not None else None
+    return {
+        "stars_sum": stars or 0,
+        "rated": 1 if stars else 0,
+        "likes": 1 if like in LIKE_VALUES else 0,
+        "dislikes": 1 if like in DISLIKE_VALUES else 0,
+    }
+
+
+async def _add(db: AsyncSession, deltas: dict):
+    """Add ``{key: {total: delta}}`` to the rollups, creating missing rows."""
+    rows = []
+    for key, delta in deltas.items():
+        delta = {total: value for total, value in delta.items() if value}
+        if delta:
+            rows.append(
+                {
+                    **dict(zip(ROLLUP_KEY, key)),
+                    **dict.fromkeys(ROLLUP_TOTALS, 0),
+                    **delta,
+                }
+            )
+    if not rows:
+        return
+    upsert = UPSERT_INSERTS[db.bind.dialect.name](MessageRollup)
+    await db.execute(
+        upsert.on_conflict_do_update(
+            index_elements=list(ROLLUP_KEY),
+            set_={
+                total: getattr(MessageRollup, total) + getattr(upsert.excluded, total)
+                for total in ROLLUP_TOTALS
+            },
+        ),
+        rows,
+    )
+
+
+async def record_message(
+    db: AsyncSession, timestamp: datetime, model: str, case_id: str, safety: dict
+):
+    """Count a new AI message. Runs in the caller's transaction."""
+    await _add(
+        db, {_key(timestamp, model, case_id, safety): {"messages": 1, **_score(safety)}}
+    )
+
+
+async def record_feedback(db: AsyncSession, batch: dict):
+    """
+    Apply a batch of like and star updates to the rollups.
+
+    ``before_flush`` hook of ``message_updates``: runs in the flush's
+    transaction, before the messages are updated, so the previous values are
+    still in place and only the difference is added. The messages are
+    locked until the flush commits, which keeps concurrent flushes from
+    counting a change twice.
+    """
+    updates = {
+        message_id: values
+        for message_id, values in batch.items()
+        if "like" in values or "stars" in values
+    }
+    if not updates:
+        return
+    messages = await db.execute(
+        select(
+            SessionMessages.message_id,
+            SessionMessages.timestamp,
+            SessionMessages.model,
+            SessionMessages.case_id,
+            SessionMessages.safety,
+            SessionMessages.like,
+            SessionMessages.stars,
+        )
+        .where(SessionMessages.message_id.in_(updates))
+        .with_for_update()
+    )
+    deltas = {}
+    for message_id, timestamp, model, case_id, safety, like, stars in messages:
+        values = updates[message_id]
+        before = _feedback(like, stars)
+        after = _feedback(values.get("like", like), values.get("stars", stars))
+        delta = deltas.setdefault(_key(timestamp, model, case_id, safety), {})
+        for total in after:
+            delta[total] = delta.get(total, 0) + after[total] - before[total]
+    await _add(db, deltas)
+
+
+async def get_rollups(
+    db: AsyncSession,
+    group_by: list,
+    model: str = None,
+    case_id: str = None,
+    since: str = None,
+    until: str = None,
+) -> list:
+    """
+    Feedback and safety statistics from the rollups, grouped by ``group_by``
+    (any of ``ROLLUP_GROUPS``). ``since`` and ``until`` are inclusive
+    YYYY-MM-DD dates. Never reads ``session_messages``.
+
+    Rollups are append-only history: messages are counted when they are
+    generated and stay counted when their session, case or patient is
+    deleted. Feedback reaches them only while the message is in
+    ``session_messages`` (the like and feedback endpoints return 404 for
+    archived ones until reading the history restores the session).
+
+    Returns:
+        List[dict]: One entry per group with the message count, average
+        safety score and stars, like ratio and safety level distribution.
+    """
+    columns = [getattr(MessageRollup, group) for group in group_by]
+    filters = []
+    if model:
+        filters.append(MessageRollup.model == model)
+    if case_id:
+        filters.append(MessageRollup.case_id == case_id)
+    if since:
+        filters.append(MessageRollup.day >= since)
+    if until:
+        filters.append(MessageRollup.day <= until)
+    rows = await db.execute(
+        select(
+            *columns,
+            MessageRollup.safety_level,
+            *(func.sum(getattr(MessageRollup, total)) for total in ROLLUP_TOTALS),
+        )
+        .where(*filters)
+        .group_by(*columns, MessageRollup.safety_level)
+        .order_by(*columns, MessageRollup.safety_level)
+    )
+    groups = {}
+    for row in rows:
+        key, level, sums = (
+            row[: len(columns)],
+            row[len(columns)],
+            row[len(columns) + 1 :],
+        )
+        group = groups.setdefault(
+            tuple(key),
+            {"totals": dict.fromkeys(ROLLUP_TOTALS, 0), "safety_levels": {}},
+        )
+        for total, value in zip(ROLLUP_TOTALS, sums):
+            group["totals"][total] += value or 0
+        group["safety_levels"][level] = sums[0] or 0
+    results = []
+    for key, group in groups.items():
+        totals = group["totals"]
+        votes = totals["likes"] + totals["dislikes"]
+        results.append(
+            {
+                **dict(zip(group_by, key)),
+                "messages": totals["messages"],
+                "avg_safety_score": (
+                    totals["score_sum"] / totals["scored"] if totals["scored"] else None
+                ),
+                "safety_levels": group["safety_levels"],
+                "rated": totals["rated"],
+                "avg_stars": (
+                    totals["stars_sum"] / totals["rated"] if totals["rated"] else None
+                ),
+                "likes": totals["likes"],
+                "dislikes": totals["dislikes"],
+                "like_ratio": totals["likes"] / votes if votes else None,
+            }
+        )
+    return results
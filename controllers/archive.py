@@ -0,0 +1,194 @@
+import asyncio
+import datetime
+import json
+import os
+import zlib
+
+import logfire
+from sqlalchemy import delete, exists, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from database.database import UPSERT_INSERTS, SessionLocal
+from models.session import ChatSession, SessionArchive
+from models.session_message import SessionMessages
+from utils.state import State
+
+# Sessions without a new message for this many days are archived; 0 disables.
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+# Sessions archived per query/round of the archiver.
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "100"))
+ARCHIVE_COMPRESSION_LEVEL = 6
+
+SESSIONS_ARCHIVED = logfire.metric_counter(
+    "archive.sessions_archived", description="Idle sessions moved to the archive"
+)
+SESSIONS_RESTORED = logfire.metric_counter(
+    "archive.sessions_restored", description="Archived sessions restored on access"
+)
+ARCHIVED_BYTES = logfire.metric_counter(
+    "archive.compressed_bytes",
+    unit="By",
+    description="Compressed size of newly archived sessions",
+)
+
+# Every column of a message, as stored in an archive line.
+ARCHIVE_COLUMNS = tuple(SessionMessages.__table__.columns)
+
+
+def _encode(rows: list) -> tuple:
+    lines = []
+    for row in rows:
+        timestamp = row["timestamp"]
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=datetime.UTC)
+        lines.append(
+            json.dumps(
+                {**row, "timestamp": timestamp.isoformat()}, separators=(",", ":")
+            )
+        )
+    raw = "\n".join(lines).encode()
+    return zlib.compress(raw, ARCHIVE_COMPRESSION_LEVEL), len(raw)
+
+
+def decode_archive(data: bytes) -> list:
+    """Rows of a ``SessionArchive.data`` blob, oldest first."""
+    rows = []
+    for line in zlib.decompress(data).decode().splitlines():
+        row = json.loads(line)
+        row["timestamp"] = datetime.datetime.fromisoformat(row["timestamp"])
+        rows.append(row)
+    return rows
+
+
+async def _archive_session(db: AsyncSession, session_id: str, version: int) -> bool:
+    now = datetime.datetime.now(datetime.UTC).isoformat()
+    # Claims the session only if no message arrived since it was picked; a
+    # concurrent archiver or chat turn makes this a no-op.
+    claimed = await db.execute(
+        update(ChatSession)
+        .where(
+            ChatSession.session_id == session_id,
+            ChatSession.version == version,
+            ChatSession.archived_at.is_(None),
+        )
+        .values(archived_at=now)
+    )
+    if not claimed.rowcount:
+        await db.rollback()
+        return False
+    rows = (
+        await db.execute(
+            select(*ARCHIVE_COLUMNS)
+            .where(SessionMessages.session_id == session_id)
+            .order_by(SessionMessages.timestamp, SessionMessages.message_id)
+        )
+    ).all()
+    data, raw_size = await run_in_threadpool(_encode, [row._asdict() for row in rows])
+    db.add(
+        SessionArchive(
+            session_id=session_id,
+            data=data,
+            message_count=len(rows),
+            raw_size=raw_size,
+            archived_at=now,
+        )
+    )
+    await db.execute(
+        delete(SessionMessages).where(SessionMessages.session_id == session_id)
+    )
+    await db.commit()
+    SESSIONS_ARCHIVED.add(1)
+    ARCHIVED_BYTES.add(len(data))
+    return True
+
+
+async def archive_idle_sessions(days: int = None, batch_size: int = None) -> int:
+    """
+    Move the messages of sessions idle for more than ``days`` into
+    ``session_archives``, one compressed row per session.
+
+    Each session is archived in its own transaction. Soft-deleted and empty
+    sessions are skipped, and so is any session that gets a new message while
+    it is being archived.
+
+    Returns:
+        int: Number of sessions archived.
+    """
+    days = ARCHIVE_AFTER_DAYS if days is None else days
+    batch_size = batch_size or ARCHIVE_BATCH_SIZE
+    cutoff = (
+        datetime.datetime.now(datetime.UTC) - datetime.timedelta(days=days)
+    ).isoformat()
+    total = 0
+    try:
+        async with SessionLocal() as db:
+            while True:
+                candidates = (
+                    await db.execute(
+                        select(ChatSession.session_id, ChatSession.version)
+                        .where(
+                            ChatSession.time_updated < cutoff,
+                            ChatSession.archived_at.is_(None),
+                            ChatSession.deleted_at.is_(None),
+                            exists().where(
+                                SessionMessages.session_id == ChatSession.session_id
+                            ),
+                        )
+                        .order_by(ChatSession.time_updated)
+                        .limit(batch_size)
+                    )
+                ).all()
+                await db.commit()
+                archived = 0
+                for session_id, version in candidates:
+                    archived += await _archive_session(db, session_id, version)
+                total += archived
+                if len(candidates) < batch_size or not archived:
+                    break
+        if total:
+            State.logger.info(f"Archived {total} idle sessions")
+        return total
+    except Exception as e:
+        State.logger.error(f"An error occured while archiving sessions: {str(e)}")
+        return total
+
+
+async def restore_session(session_id: str, db: AsyncSession) -> int:
+    """
+    Move an archived session's messages back into ``session_messages``.
+
+    Safe to run concurrently: messages already present are left as they are.
+
+    Returns:
+        int: Number of messages restored.
+    """
+    archive = await db.get(SessionArchive, session_id)
+    rows = await run_in_threadpool(decode_archive, archive.data) if archive else []
+    if rows:
+        await db.execute(
+            UPSERT_INSERTS[db.bind.dialect.name](
+                SessionMessages
+            ).on_conflict_do_nothing(index_elements=[SessionMessages.message_id]),
+            rows,
+        )
+    await db.execute(
+        delete(SessionArchive).where(SessionArchive.session_id == session_id)
+    )
+    await db.execute(
+        update(ChatSession)
+        .where(ChatSession.session_id == session_id)
+        .values(archived_at=None)
+    )
+    await db.commit()
+    SESSIONS_RESTORED.add(1)
+    State.logger.info(f"Restored {len(rows)} archived messages of session {session_id}")
+    return len(rows)
+
+
+async def run_archiver(interval: float = None):
+    """Archive idle sessions every ``interval`` seconds until cancelled."""
+    while True:
+        await asyncio.sleep(interval or ARCHIVE_INTERVAL_SECONDS)
+        await archive_idle_sessions()
@@ -0,0 +1,176 @@
+import datetime
+import json
+
+from fastapi import HTTPException, UploadFile
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from database.database import UPSERT_INSERTS, SessionLocal
+from models.attachment import Attachment, CaseAttachment
+from utils.attachment_store import get_attachment_store
+from utils.file_processor import (
+    IMAGE_ENCODING_POLICY,
+    ImageEncodingPolicy,
+    encode_image_bytes,
+    pdf_bytes_to_content,
+)
+from utils.state import State
+from utils.upload import UploadBudget, hash_upload
+
+# Bump when the preprocessing output changes so stale cache entries are ignored.
+PROCESSED_VERSION = "v3"
+ALLOWED_CONTENT_TYPES = ["image/jpeg", "image/png", "application/pdf"]
+
+
+def processed_key(attachment_id: str, policy: ImageEncodingPolicy) -> str:
+    return f"{attachment_id}.processed.{PROCESSED_VERSION}.{policy.fingerprint}"
+
+
+async def ingest_attachment(
+    file: UploadFile, db: AsyncSession, budget: UploadBudget = None
+) -> Attachment:
+    """
+    Hash an uploaded file and store it once in the content-addressed store.
+
+    The upload is hashed and copied from Starlette's spooled temporary file,
+    so the raw bytes are never held in memory in full. ``budget`` enforces the
+    per-file and per-request size limits (HTTP 413 when exceeded), the per-file
+    one lowered to the store's ``max_blob_bytes``. Concurrent uploads of
+    the same content race safely: the row insert skips on conflict.
+
+    Returns:
+        Attachment: The (possibly pre-existing) attachment row for the upload.
+    """
+    budget = budget or UploadBudget()
+    store = get_attachment_store()
+    if store.max_blob_bytes:
+        budget.max_file_bytes = min(budget.max_file_bytes, store.max_blob_bytes)
+    spool, attachment_id, size = await hash_upload(file, budget)
+    if not await store.exists(attachment_id, db):
+        await store.put_file(attachment_id, spool, db)
+    await db.execute(
+        UPSERT_INSERTS[db.bind.dialect.name](Attachment)
+        .values(
+            attachment_id=attachment_id,
+            filename=file.filename,
+            content_type=file.content_type,
+            size=size,
+            time_created=datetime.datetime.now(datetime.UTC).isoformat(),
+        )
+        .on_conflict_do_nothing(index_elements=[Attachment.attachment_id])
+    )
+    await db.commit()
+    return await db.get(Attachment, attachment_id)
+
+
+async def get_processed_attachment(
+    attachment: Attachment, db: AsyncSession, policy: ImageEncodingPolicy = None
+) -> dict:
+    """
+    Return the preprocessed model input for an attachment, computing it only on
+    the first request for that content hash and encoding policy.
+
+    Decoding and encoding run in the threadpool so they do not block the event
+    loop. Encoded images are stored as raw bytes in the attachment store; the
+    returned manifest only references them (see ``load_processed_image``).
+    The caller commits, which makes cache entries in the ``database`` store
+    durable.
+
+    Returns:
+        dict: ``images`` (list of ``{"key", "mime_type", "size"}``), ``text``
+        (list of page texts) and ``pages`` (per-page decision records for PDFs).
+    """
+    policy = policy or IMAGE_ENCODING_POLICY
+    store = get_attachment_store()
+    key = processed_key(attachment.attachment_id, policy)
+    cached = await store.get(key, db)
+    if cached is not None:
+        return json.loads(cached)
+
+    async with store.open_buffer(attachment.attachment_id, db) as data:
+        if data is None:
+            raise FileNotFoundError(f"Attachment {attachment.attachment_id} not found")
+        if attachment.content_type == "application/pdf":
+            processed = await run_in_threadpool(
+                pdf_bytes_to_content, data, attachment.filename, policy
+            )
+        else:
+            processed = {
+                "images": [await run_in_threadpool(encode_image_bytes, data, policy)],
+                "text": [],
+                "pages": [],
+            }
+    images = []
+    for index, image in enumerate(processed["images"]):
+        image_key = f"{key}.{index}"
+        await store.put(image_key, image, db)
+        images.append(
+            {"key": image_key, "mime_type": policy.mime_type, "size": len(image)}
+        )
+    processed["images"] = images
+    await store.put(key, json.dumps(processed).encode("utf-8"), db)
+    State.logger.info(f"Cached preprocessed attachment {attachment.attachment_id}")
+    return processed
+
+
+async def process_case_attachment(case_id: str, attachment_id: str):
+    """
+    Preprocess a case library attachment outside the request path.
+
+    Runs as a background task, so it opens its own database session.
+    """
+    async with SessionLocal() as db:
+        entry = await db.get(CaseAttachment, (case_id, attachment_id))
+        if not entry:
+            return
+        try:
+            await get_processed_attachment(entry.attachment, db)
+            entry.status = "ready"
+            entry.error = None
+        except Exception as e:
+            State.logger.error(
+                f"An error occured while preprocessing attachment {attachment_id}: {str(e)}"
+            )
+            entry.status = "failed"
+            entry.error = str(e)
+        await db.commit()
+
+
+async def get_case_attachments(
+    case_id: str, attachment_ids: list, db: AsyncSession
+) -> list:
+    """
+    Load case library attachments by ID, preserving the requested order.
+
+    Returns:
+        List[CaseAttachment]: The matching library entries.
+    """
+    entries = (
+        await db.scalars(
+            select(CaseAttachment).where(
+                CaseAttachment.case_id == case_id,
+                CaseAttachment.attachment_id.in_(attachment_ids),
+            )
+        )
+    ).all()
+    by_id = {entry.attachment_id: entry for entry in entries}
+    missing = [
+        attachment_id for attachment_id in attachment_ids if attachment_id not in by_id
+    ]
+    if missing:
+        State.logger.error(f"Attachments {missing} not found for case {case_id}")
+        raise HTTPException(
+            status_code=404, detail=f"Attachments not found: {', '.join(missing)}"
+        )
+    return [by_id[attachment_id] for attachment_id in attachment_ids]
+
+
+async def load_processed_image(image: dict, db: AsyncSession) -> bytes:
+    """
+    Load the encoded bytes of an image listed in a processed-attachment manifest.
+    """
+    data = await get_attachment_store().get(image["key"], db)
+    if data is None:
+        raise FileNotFoundError(f"Processed image {image['key']} not found")
+    return data
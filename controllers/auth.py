@@ -7,7 +7,7 @@ import jwt
 from fastapi import HTTPException, Request, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from jose import jwt
-from sqlalchemy import desc
+from sqlalchemy import desc, select
 from utils.state import State
 from models.token import Token
 from utils.token import decodeJWT
@@ -83,14 +83,13 @@ def token_required(func):
     async def wrapper(*args, **kwargs):
         payload = decodeJWT(kwargs["dependencies"])
         user_id = payload["sub"]
-        data = (
-            kwargs["db"]
-            .query(Token)
+        data = await kwargs["db"].scalar(
+            select(Token)
             .filter_by(
                 user_id=user_id, access_token=kwargs["dependencies"], status=True
             )
             .order_by(desc(Token.time_created))
-            .first()
+            .limit(1)
         )
         if data:
             return await func(*args, **kwargs)
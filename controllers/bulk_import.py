@@ -0,0 +1,283 @@
+import csv
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import uuid
+from itertools import islice
+
+import logfire
+from fastapi import HTTPException, UploadFile
+from pydantic import ValidationError
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from controllers.tags import case_tag_rows, normalize_tags
+from database.database import SessionLocal
+from models.cases import Case, CaseTag
+from models.import_job import ImportJob
+from models.patients import Patient
+from schema.bulk_import import CaseRow, PatientRow
+from utils.names import normalize_name
+from utils.state import State
+
+# Rows validated and inserted per transaction.
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
+# Row errors kept on the job; later ones are only counted.
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+IMPORT_FORMATS = ("csv", "ndjson")
+
+IMPORTED_ROWS = logfire.metric_counter(
+    "import.rows_inserted", description="Rows inserted by bulk imports"
+)
+REJECTED_ROWS = logfire.metric_counter(
+    "import.rows_failed", description="Rows rejected by bulk imports"
+)
+
+# kind -> (row schema, model, primary key column)
+IMPORT_KINDS = {
+    "patients": (PatientRow, Patient, Patient.patient_id),
+    "cases": (CaseRow, Case, Case.case_id),
+}
+
+
+def import_job_dict(job: ImportJob) -> dict:
+    return {
+        column.key: getattr(job, column.key) for column in ImportJob.__table__.columns
+    }
+
+
+def _format_of(file: UploadFile, format: str | None) -> str:
+    if format is None:
+        name = (file.filename or "").lower()
+        format = "csv" if name.endswith(".csv") else "ndjson"
+        if file.content_type == "text/csv":
+            format = "csv"
+    if format not in IMPORT_FORMATS:
+        State.logger.error(f"Unsupported import format {format}")
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported format. Allowed formats are: {', '.join(IMPORT_FORMATS)}.",
+        )
+    return format
+
+
+def _spool(fileobj) -> str:
+    # The upload is closed with the request; the job reads its own copy.
+    fileobj.seek(0)
+    with tempfile.NamedTemporaryFile(suffix=".import", delete=False) as copy:
+        shutil.copyfileobj(fileobj, copy)
+    return copy.name
+
+
+async def start_import(
+    kind: str, file: UploadFile, format: str | None, db: AsyncSession
+) -> tuple:
+    """
+    Record an import job for an uploaded CSV or NDJSON file.
+
+    The format is taken from ``format`` or inferred from the upload. The
+    file is copied to a temporary file for ``run_import``, which the caller
+    schedules as a background task.
+
+    Returns:
+        tuple: ``(job, path)`` with the pending job and the copy's path.
+    """
+    format = _format_of(file, format)
+    path = await run_in_threadpool(_spool, file.file)
+    now = datetime.datetime.now(datetime.UTC).isoformat()
+    job = ImportJob(
+        job_id=str(uuid.uuid4()),
+        kind=kind,
+        format=format,
+        filename=file.filename,
+        status="pending",
+        rows_processed=0,
+        rows_inserted=0,
+        rows_failed=0,
+        errors=[],
+        time_created=now,
+        time_updated=now,
+    )
+    db.add(job)
+    await db.commit()
+    return job, path
+
+
+def _read_rows(path: str, format: str):
+    """Yield ``(row_number, raw)`` pairs: CSV records or NDJSON lines."""
+    with open(path, newline="", encoding="utf-8-sig") as source:
+        if format == "csv":
+            for number, row in enumerate(csv.DictReader(source), start=1):
+                # Empty cells mean "not given", as omitted query params do.
+                yield number, {
+                    k: v for k, v in row.items() if k and v not in ("", None)
+                }
+        else:
+            for number, line in enumerate(source, start=1):
+                if line.strip():
+                    yield number, line
+
+
+def _validate(schema, chunk: list) -> tuple:
+    valid, errors = [], []
+    for number, raw in chunk:
+        try:
+            data = json.loads(raw) if isinstance(raw, str) else raw
+            if not isinstance(data, dict):
+                raise ValueError("Expected a JSON object")
+            valid.append((number, schema.model_validate(data).model_dump()))
+        except ValidationError as e:
+            message = "; ".join(
+                f"{'.'.join(map(str, error['loc']))}: {error['msg']}"
+                for error in e.errors()
+            )
+            errors.append({"row": number, "error": message})
+        except ValueError as e:
+            errors.append({"row": number, "error": str(e)})
+    return valid, errors
+
+
+async def _check(db: AsyncSession, kind: str, key_column, valid: list) -> tuple:
+    """Reject rows whose key is taken (or repeated) or whose patient is missing."""
+    keys = [row[key_column.key] for _, row in valid]
+    taken = set(await db.scalars(select(key_column).where(key_column.in_(keys))))
+    patients = None
+    if kind == "cases":
+        patient_ids = {row["patient_id"] for _, row in valid}
+        patients = set(
+            await db.scalars(
+                select(Patient.patient_id).where(
+                    Patient.patient_id.in_(patient_ids), Patient.deleted_at.is_(None)
+                )
+            )
+        )
+    rows, errors = [], []
+    for number, row in valid:
+        key = row[key_column.key]
+        if key in taken:
+            errors.append(
+                {"row": number, "error": f"{key_column.key} {key} already exists"}
+            )
+        elif patients is not None and row["patient_id"] not in patients:
+            errors.append(
+                {"row": number, "error": f"Patient {row['patient_id']} not found"}
+            )
+        else:
+            taken.add(key)
+            rows.append((number, row))
+    return rows, errors
+
+
+async def _insert_values(db: AsyncSession, model, values: list):
+    await db.execute(insert(model), values)
+    if model is Case:
+        tags = [
+            row
+            for value in values
+            for row in case_tag_rows(
+                value["case_id"], value["patient_id"], value["tags"]
+            )
+        ]
+        if tags:
+            await db.execute(insert(CaseTag), tags)
+
+
+async def _insert(db: AsyncSession, model, rows: list) -> list:
+    """Insert ``rows`` in one executemany; if that fails, insert them one by one."""
+    now = datetime.datetime.now(datetime.UTC).isoformat()
+    values = [{**row, "time_created": now, "time_updated": now} for _, row in rows]
+    for value in values:
+        if model is Case:
+            value["tags"] = normalize_tags(value["tags"])
+        elif model is Patient:
+            value["name_normalized"] = normalize_name(value["name"])
+    try:
+        # Committed with the job's progress.
+        await _insert_values(db, model, values)
+        return []
+    except Exception:
+        await db.rollback()
+    errors = []
+    for (number, _), value in zip(rows, values):
+        try:
+            await _insert_values(db, model, [value])
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            errors.append({"row": number, "error": str(e).splitlines()[0]})
+    return errors
+
+
+async def run_import(job_id: str, path: str, chunk_size: int = None):
+    """
+    Validate and insert the rows of an import job, chunk by chunk.
+
+    Runs as a background task with its own database session. Every chunk of
+    ``chunk_size`` rows is validated, checked against the database with one
+    query per lookup, inserted with a single executemany and committed, then
+    the job's progress is saved, so ``GET /api/v1/imports/{job_id}`` follows
+    the import while it runs. Invalid rows are recorded on the job and
+    skipped; they never abort the rest of the import.
+    """
+    chunk_size = chunk_size or IMPORT_CHUNK_SIZE
+    progress = {"rows_processed": 0, "rows_inserted": 0, "rows_failed": 0, "errors": []}
+
+    async def _save(db: AsyncSession, **values):
+        await db.execute(
+            update(ImportJob)
+            .where(ImportJob.job_id == job_id)
+            .values(
+                **progress,
+                **values,
+                time_updated=datetime.datetime.now(datetime.UTC).isoformat(),
+            )
+        )
+        await db.commit()
+
+    try:
+        async with SessionLocal() as db:
+            kind, format = (
+                await db.execute(
+                    select(ImportJob.kind, ImportJob.format).where(
+                        ImportJob.job_id == job_id
+                    )
+                )
+            ).one()
+            schema, model, key_column = IMPORT_KINDS[kind]
+            await _save(db, status="running")
+            try:
+                rows = _read_rows(path, format)
+                while chunk := await run_in_threadpool(
+                    lambda: list(islice(rows, chunk_size))
+                ):
+                    valid, errors = await run_in_threadpool(_validate, schema, chunk)
+                    valid, rejected = await _check(db, kind, key_column, valid)
+                    failed = await _insert(db, model, valid) if valid else []
+                    errors = sorted(errors + rejected + failed, key=lambda e: e["row"])
+                    inserted = len(valid) - len(failed)
+                    progress["rows_processed"] += len(chunk)
+                    progress["rows_inserted"] += inserted
+                    progress["rows_failed"] += len(errors)
+                    room = IMPORT_MAX_ERRORS - len(progress["errors"])
+                    progress["errors"] += errors[: max(room, 0)]
+                    await _save(db)
+                    IMPORTED_ROWS.add(inserted)
+                    REJECTED_ROWS.add(len(errors))
+                await _save(db, status="done")
+            except Exception as e:
+                await db.rollback()
+                State.logger.error(
+                    f"An error occured while importing {kind} (job {job_id}): {str(e)}"
+                )
+                await _save(db, status="failed", error=str(e))
+        State.logger.info(
+            f"Import {job_id}: {progress['rows_inserted']} inserted, "
+            f"{progress['rows_failed']} failed"
+        )
+    except Exception as e:
+        State.logger.error(f"An error occured while running import {job_id}: {str(e)}")
+    finally:
+        os.remove(path)
@@ -0,0 +1,192 @@
+import datetime
+import os
+
+import logfire
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.database import SessionLocal
+from models.cases import Case, CaseTag
+from models.patients import Patient
+from models.session import ChatSession
+from models.session_message import SessionMessages
+from utils.state import State
+
+# Deletes reaching this many messages are soft-deleted and purged in the
+# background instead of cascading inside the request.
+SOFT_DELETE_MIN_MESSAGES = int(os.getenv("SOFT_DELETE_MIN_MESSAGES", "10000"))
+# Rows removed per purge transaction.
+PURGE_CHUNK_SIZE = int(os.getenv("PURGE_CHUNK_SIZE", "1000"))
+
+PURGED_ROWS = logfire.metric_counter(
+    "purge.deleted_rows", description="Rows removed by the soft-delete purge job"
+)
+
+_purging = False
+
+
+async def _delete(
+    db: AsyncSession,
+    model,
+    key_column,
+    key: str,
+    messages,
+    dependents: list,
+    detached: list = (),
+) -> str | None:
+    """
+    Delete one patient, case or session.
+
+    Small deletes are a single DELETE; ``ON DELETE CASCADE`` removes the
+    children without loading them. When ``messages`` (a filter on
+    ``SessionMessages``) matches at least ``SOFT_DELETE_MIN_MESSAGES`` rows,
+    the row and its ``dependents`` (``(model, column)`` pairs) are only marked
+    ``deleted_at`` and left for ``purge_deleted``; rows of ``detached``
+    (``(model, column)`` pairs that only index the deleted rows) are removed
+    right away so they stop counting.
+
+    Returns:
+        str: ``"deleted"``, ``"scheduled"`` (soft-deleted), or ``None`` when
+        there is no such row.
+    """
+    live = (key_column == key, model.deleted_at.is_(None))
+    sample = select(SessionMessages.message_id).where(messages)
+    count = await db.scalar(
+        select(func.count()).select_from(
+            sample.limit(SOFT_DELETE_MIN_MESSAGES).subquery()
+        )
+    )
+    if count < SOFT_DELETE_MIN_MESSAGES:
+        result = await db.execute(delete(model).where(*live))
+        await db.commit()
+        return "deleted" if result.rowcount else None
+
+    now = datetime.datetime.now(datetime.UTC).isoformat()
+    result = await db.execute(update(model).where(*live).values(deleted_at=now))
+    if not result.rowcount:
+        await db.rollback()
+        return None
+    for dependent, column in dependents:
+        await db.execute(
+            update(dependent)
+            .where(column == key, dependent.deleted_at.is_(None))
+            .values(deleted_at=now)
+        )
+    for detached_model, column in detached:
+        await db.execute(delete(detached_model).where(column == key))
+    await db.commit()
+    State.logger.info(f"Soft-deleted {model.__tablename__} {key}; purge scheduled")
+    return "scheduled"
+
+
+async def delete_patient_rows(patient_id: str, db: AsyncSession) -> str | None:
+    """Delete a patient with its cases, sessions and messages (see ``_delete``)."""
+    return await _delete(
+        db,
+        Patient,
+        Patient.patient_id,
+        patient_id,
+        SessionMessages.patient_id == patient_id,
+        [(Case, Case.patient_id), (ChatSession, ChatSession.patient_id)],
+        [(CaseTag, CaseTag.patient_id)],
+    )
+
+
+async def delete_case_rows(case_id: str, db: AsyncSession) -> str | None:
+    """Delete a case with its sessions and messages (see ``_delete``)."""
+    return await _delete(
+        db,
+        Case,
+        Case.case_id,
+        case_id,
+        SessionMessages.case_id == case_id,
+        [(ChatSession, ChatSession.case_id)],
+        [(CaseTag, CaseTag.case_id)],
+    )
+
+
+async def delete_session_rows(session_id: str, db: AsyncSession) -> str | None:
+    """Delete a session with its messages (see ``_delete``)."""
+    return await _delete(
+        db,
+        ChatSession,
+        ChatSession.session_id,
+        session_id,
+        SessionMessages.session_id == session_id,
+        [],
+    )
+
+
+async def _delete_chunk(db: AsyncSession, model, key_column, where, chunk_size: int):
+    keys = select(key_column).where(where).limit(chunk_size)
+    result = await db.execute(delete(model).where(key_column.in_(keys)))
+    await db.commit()
+    PURGED_ROWS.add(result.rowcount)
+    return result.rowcount
+
+
+async def _purge(db: AsyncSession, model, key_column, children: list, chunk_size):
+    """Remove soft-deleted ``model`` rows, draining ``children`` chunk by chunk."""
+    total = 0
+    while True:
+        keys = (
+            await db.scalars(
+                select(key_column)
+                .where(model.deleted_at.is_not(None))
+                .limit(chunk_size)
+            )
+        ).all()
+        if not keys:
+            return total
+        for key in keys:
+            for child, child_key, child_column in children:
+                while (
+                    await _delete_chunk(
+                        db, child, child_key, child_column == key, chunk_size
+                    )
+                    == chunk_size
+                ):
+                    pass
+        total += await _delete_chunk(
+            db, model, key_column, key_column.in_(keys), chunk_size
+        )
+
+
+async def purge_deleted(chunk_size: int = None) -> int:
+    """
+    Permanently remove soft-deleted sessions, cases and patients.
+
+    Messages are deleted in chunks of ``chunk_size`` rows, each in its own
+    transaction, so no single statement holds locks or memory for a whole
+    patient. Runs as a background task with its own database session, and
+    only one purge runs at a time per process.
+
+    Returns:
+        int: Number of sessions, cases and patients removed.
+    """
+    global _purging
+    if _purging:
+        return 0
+    _purging = True
+    chunk_size = chunk_size or PURGE_CHUNK_SIZE
+    messages = (SessionMessages, SessionMessages.message_id)
+    try:
+        async with SessionLocal() as db:
+            total = await _purge(
+                db,
+                ChatSession,
+                ChatSession.session_id,
+                [(*messages, SessionMessages.session_id)],
+                chunk_size,
+            )
+            # Sessions of deleted cases and patients were marked with them.
+            total += await _purge(db, Case, Case.case_id, [], chunk_size)
+            total += await _purge(db, Patient, Patient.patient_id, [], chunk_size)
+        if total:
+            State.logger.info(f"Purged {total} soft-deleted rows")
+        return total
+    except Exception as e:
+        State.logger.error(f"An error occured while purging deleted rows: {str(e)}")
+        return 0
+    finally:
+        _purging = False
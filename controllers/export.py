@@ -0,0 +1,157 @@
+import datetime
+import json
+import os
+import zlib
+from typing import AsyncIterator, Awaitable, Callable
+
+import logfire
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from controllers.archive import decode_archive
+from models.cases import Case
+from models.patients import Patient
+from models.session import ChatSession, SessionArchive
+from models.session_message import SessionMessages
+from utils.state import State
+
+# Rows fetched per round trip and written per chunk of the response.
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+
+EXPORTED_ROWS = logfire.metric_counter(
+    "export.rows", description="Rows written to patient exports"
+)
+
+# search_text and name_normalized are derived and only feed search indexes.
+MESSAGE_COLUMNS = tuple(
+    column
+    for column in SessionMessages.__table__.columns
+    if column.key != "search_text"
+)
+PATIENT_COLUMNS = tuple(
+    column for column in Patient.__table__.columns if column.key != "name_normalized"
+)
+
+
+def _default(value):
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=datetime.UTC)
+        return value.isoformat()
+    return str(value)
+
+
+def _lines(kind: str, rows: list) -> bytes:
+    EXPORTED_ROWS.add(len(rows))
+    return b"".join(
+        json.dumps(
+            {"type": kind, "data": row}, default=_default, separators=(",", ":")
+        ).encode()
+        + b"\n"
+        for row in rows
+    )
+
+
+async def _stream(db: AsyncSession, kind: str, query) -> AsyncIterator[bytes]:
+    result = await db.stream(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+    async for rows in result.partitions():
+        yield _lines(kind, [row._asdict() for row in rows])
+
+
+async def _archived_messages(db: AsyncSession, session_id: str):
+    data = await db.scalar(
+        select(SessionArchive.data).where(SessionArchive.session_id == session_id)
+    )
+    rows = await run_in_threadpool(decode_archive, data) if data else []
+    # Exported as stored; reading an export does not restore the session.
+    for start in range(0, len(rows), EXPORT_BATCH_SIZE):
+        batch = rows[start : start + EXPORT_BATCH_SIZE]
+        for row in batch:
+            row.pop("search_text", None)
+        yield _lines("message", batch)
+
+
+async def export_patient(
+    patient_id: str,
+    db: AsyncSession,
+    is_disconnected: Callable[[], Awaitable[bool]] = None,
+) -> AsyncIterator[bytes]:
+    """
+    Stream a patient, its cases, sessions and messages as NDJSON.
+
+    Every line is ``{"type": "patient" | "case" | "session" | "message",
+    "data": {...}}``; messages follow their sessions, oldest first, and
+    archived sessions are read from the archive. Rows are fetched through
+    server-side cursors ``EXPORT_BATCH_SIZE`` at a time and each batch is
+    yielded as one chunk, so memory does not grow with the history. The
+    export stops at the next batch once ``is_disconnected`` returns true.
+    """
+
+    async def _gone() -> bool:
+        if is_disconnected is not None and await is_disconnected():
+            State.logger.info(f"Export of patient {patient_id} cancelled by client")
+            return True
+        return False
+
+    yield _lines(
+        "patient",
+        [
+            row._asdict()
+            for row in await db.execute(
+                select(*PATIENT_COLUMNS).where(Patient.patient_id == patient_id)
+            )
+        ],
+    )
+    async for chunk in _stream(
+        db,
+        "case",
+        select(*Case.__table__.columns)
+        .where(Case.patient_id == patient_id, Case.deleted_at.is_(None))
+        .order_by(Case.case_id),
+    ):
+        yield chunk
+        if await _gone():
+            return
+
+    # Only ids and flags are kept, a few bytes per session.
+    sessions = []
+    result = await db.stream(
+        select(*ChatSession.__table__.columns)
+        .where(ChatSession.patient_id == patient_id, ChatSession.deleted_at.is_(None))
+        .order_by(ChatSession.session_id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    async for rows in result.partitions():
+        batch = [row._asdict() for row in rows]
+        sessions.extend((row["session_id"], row["archived_at"]) for row in batch)
+        yield _lines("session", batch)
+        if await _gone():
+            return
+
+    for session_id, archived_at in sessions:
+        messages = (
+            _archived_messages(db, session_id)
+            if archived_at
+            else _stream(
+                db,
+                "message",
+                select(*MESSAGE_COLUMNS)
+                .where(SessionMessages.session_id == session_id)
+                .order_by(SessionMessages.timestamp, SessionMessages.message_id),
+            )
+        )
+        async for chunk in messages:
+            yield chunk
+            if await _gone():
+                return
+
+
+async def gzip_chunks(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Compress a byte stream into a single gzip member, chunk by chunk."""
+    compressor = zlib.compressobj(wbits=31)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
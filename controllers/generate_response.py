@@ -15,7 +15,7 @@ Try to be assistive and detailed in your responses and respond to queries and fo
 
 
 def generate_response(
-    images: Optional[List[str]],
+    images: Optional[List[dict]],
     prompt: str,
     temperature: float,
     top_p: float,
@@ -30,7 +30,7 @@ def generate_response(
     Generate a response based on the provided image and prompt.
 
     Args:
-        image (str): Path to the image file.
+        images (List[dict]): Attachment references (``attachment_id``, ``index``).
         prompt (str): Text prompt for the model.
         temperature (float): Sampling temperature.
         top_p (float): Top-p sampling parameter.
@@ -120,10 +120,7 @@ def generate_response(
                 {
                     "role": "user",
                     "content": [
-                        *[
-                            {"type": "image", "image": f"data:image;base64,{image}"}
-                            for image in images
-                        ],
+                        *[{"type": "image", **image} for image in images],
                         {"type": "text", "text": prompt},
                     ],
                 }
@@ -1,15 +1,39 @@
+import os
+import re
 import uuid
 
-from fastapi import HTTPException
-from sqlalchemy.orm import Session
+from fastapi import BackgroundTasks, HTTPException
+from sqlalchemy import column, func, insert, literal_column, select, table, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 from utils.state import State
-from datetime import datetime, timedelta
+from datetime import UTC, datetime
 from models.session_message import SessionMessages
 from models.session import ChatSession
-
-
-def create_session(
-    session_id: str, title: str, case_id: str, patient_id: str, db: Session
+from controllers.analytics import record_feedback, record_message
+from controllers.archive import restore_session
+from controllers.deletion import delete_session_rows, purge_deleted
+from database.database import UPSERT_INSERTS, SessionLocal
+from utils.history_cache import HistoryCache
+from utils.write_behind import WriteBehindQueue
+
+# Likes and feedback are written behind the request; main.py starts and drains
+# the worker in the app lifespan.
+message_updates = WriteBehindQueue(
+    SessionMessages,
+    "message_id",
+    SessionLocal,
+    max_batch=int(os.getenv("WRITE_BEHIND_MAX_BATCH", "100")),
+    flush_interval=float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "0.5")),
+    before_flush=record_feedback,
+)
+# Chat memory of recently used sessions, checked against ChatSession.version.
+history_cache = HistoryCache(
+    int(os.getenv("HISTORY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+)
+
+
+async def create_session(
+    session_id: str, title: str, case_id: str, patient_id: str, db: AsyncSession
 ) -> str:
     """
     Create a new chat session.
@@ -18,8 +42,8 @@ def create_session(
         str: Unique identifier for the chat session.
     """
     try:
-        session = (
-            db.query(ChatSession).filter(ChatSession.session_id == session_id).first()
+        session = await db.scalar(
+            select(ChatSession).where(ChatSession.session_id == session_id)
         )
         if not session:
             session = ChatSession(
@@ -27,12 +51,12 @@ def create_session(
                 title=title,
                 case_id=case_id,
                 patient_id=patient_id,
-                time_created=datetime.utcnow(),
-                time_updated=datetime.utcnow(),
+                time_created=datetime.now(UTC).isoformat(),
+                time_updated=datetime.now(UTC).isoformat(),
             )
             db.add(session)
-            db.commit()
-            db.refresh(session)
+            await db.commit()
+            await db.refresh(session)
         return session.session_id
     except Exception as e:
         State.logger.error(f"An error occured while creating session: {str(e)}")
@@ -42,7 +66,7 @@ def create_session(
         )
 
 
-def edit_session(session_id: str, title: str, db: Session) -> str:
+async def edit_session(session_id: str, title: str, db: AsyncSession) -> str:
     """
     Edit an existing chat session.
 
@@ -50,14 +74,16 @@ def edit_session(session_id: str, title: str, db: Session) -> str:
         str: Unique identifier for the chat session.
     """
     try:
-        session = (
-            db.query(ChatSession).filter(ChatSession.session_id == session_id).first()
+        session = await db.scalar(
+            select(ChatSession).where(
+                ChatSession.session_id == session_id, ChatSession.deleted_at.is_(None)
+            )
         )
         if session:
             session.title = title
-            session.time_updated = datetime.utcnow()
-            db.commit()
-            db.refresh(session)
+            session.time_updated = datetime.now(UTC).isoformat()
+            await db.commit()
+            await db.refresh(session)
         return session.session_id if session else None
     except Exception as e:
         State.logger.error(f"An error occured while editing session: {str(e)}")
@@ -67,22 +93,89 @@ def edit_session(session_id: str, title: str, db: Session) -> str:
         )
 
 
-def list_sessions_for_case(case_id: str, patient_id: str, db: Session):
+# Characters of the last reply shown in session listings.
+SESSION_PREVIEW_CHARS = 200
+SESSION_ORDER = (ChatSession.time_updated, ChatSession.session_id)
+
+
+LAST_MESSAGE_COLUMNS = (
+    SessionMessages.content.label("last_content"),
+    SessionMessages.timestamp.label("last_timestamp"),
+)
+
+
+def _preview(content: list) -> str | None:
+    # The last turn of a message is the model's reply.
+    text = message_search_text((content or [])[-1:])
+    return text[:SESSION_PREVIEW_CHARS] if text else None
+
+
+def _session_summary(session: dict) -> dict:
+    """Replace the ``LAST_MESSAGE_COLUMNS`` of a session row by ``last_message``."""
+    content = session.pop("last_content")
+    timestamp = session.pop("last_timestamp")
+    session["last_message"] = (
+        {
+            "message_id": session["last_message_id"],
+            "preview": _preview(content),
+            "timestamp": _as_utc(timestamp),
+        }
+        # Archived sessions keep their counts but not the message.
+        if timestamp is not None
+        else None
+    )
+    return session
+
+
+async def list_sessions_for_case(
+    case_id: str,
+    patient_id: str,
+    db: AsyncSession,
+    limit: int = None,
+    before: str = None,
+) -> list:
     """
-    List all chat sessions for a specific case and patient.
+    List the chat sessions of a case and patient, most recently updated first.
+
+    Each session carries its message count, latest safety level and a
+    preview of its last message. The counts are kept on ``ChatSession`` by
+    ``add_ai_response`` and the last message is joined by primary key, so a
+    page is one query whatever the number of messages. ``before`` (a session
+    ID) continues from that session.
 
     Returns:
-        List[ChatSession]: List of all chat sessions for the case and patient.
+        List[dict]: The sessions, each with a ``last_message`` dict or ``None``.
     """
     try:
-        sessions = (
-            db.query(ChatSession)
-            .filter(
-                ChatSession.case_id == case_id, ChatSession.patient_id == patient_id
+        filters = [
+            ChatSession.case_id == case_id,
+            ChatSession.patient_id == patient_id,
+            ChatSession.deleted_at.is_(None),
+        ]
+        if before:
+            cursor = (
+                await db.execute(
+                    select(*SESSION_ORDER).where(ChatSession.session_id == before)
+                )
+            ).first()
+            if not cursor:
+                raise HTTPException(
+                    status_code=404, detail=f"Session {before} not found"
+                )
+            filters.append(tuple_(*SESSION_ORDER) < tuple_(*cursor))
+        rows = await db.execute(
+            select(*ChatSession.__table__.columns, *LAST_MESSAGE_COLUMNS)
+            .outerjoin(
+                SessionMessages,
+                SessionMessages.message_id == ChatSession.last_message_id,
             )
-            .all()
+            .where(*filters)
+            .order_by(*(column.desc() for column in SESSION_ORDER))
+            .limit(limit)
         )
-        return sessions
+        return [_session_summary(row._asdict()) for row in rows]
+    except HTTPException:
+        raise
     except Exception as e:
         State.logger.error(f"An error occured while listing sessions: {str(e)}")
         raise HTTPException(
@@ -91,85 +184,188 @@ def list_sessions_for_case(case_id: str, patient_id: str, db: Session):
         )
 
 
-def delete_session(session_id: str, db: Session):
+async def recent_sessions_by_case(patient_id: str, db: AsyncSession, per_case: int):
+    """
+    The ``per_case`` most recently updated sessions of each of a patient's
+    cases, summarised as by ``list_sessions_for_case``, in a single query.
+
+    Returns:
+        dict: ``{case_id: (sessions, total)}`` where ``total`` counts all the
+        case's sessions.
+    """
+    try:
+        ranked = (
+            select(
+                *ChatSession.__table__.columns,
+                func.row_number()
+                .over(
+                    partition_by=ChatSession.case_id,
+                    order_by=[column.desc() for column in SESSION_ORDER],
+                )
+                .label("rank"),
+                func.count().over(partition_by=ChatSession.case_id).label("total"),
+            )
+            .where(
+                ChatSession.patient_id == patient_id,
+                ChatSession.deleted_at.is_(None),
+            )
+            .subquery()
+        )
+        rows = await db.execute(
+            select(ranked, *LAST_MESSAGE_COLUMNS)
+            .outerjoin(
+                SessionMessages,
+                SessionMessages.message_id == ranked.c.last_message_id,
+            )
+            .where(ranked.c.rank <= per_case)
+            .order_by(ranked.c.case_id, ranked.c.rank)
+        )
+        by_case = {}
+        for row in rows:
+            session = row._asdict()
+            del session["rank"]
+            total = session.pop("total")
+            by_case.setdefault(session["case_id"], ([], total))[0].append(
+                _session_summary(session)
+            )
+        return by_case
+    except Exception as e:
+        State.logger.error(f"An error occured while listing sessions: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occured while listing sessions: {str(e)}",
+        )
+
+
+async def delete_session(
+    session_id: str, db: AsyncSession, background_tasks: BackgroundTasks = None
+):
     """
     Delete a chat session and its associated messages.
 
+    The messages go with the session through ``ON DELETE CASCADE``; very long
+    sessions are soft-deleted and purged in ``background_tasks``.
+
     Args:
         session_id (str): Unique identifier for the chat session.
     """
     try:
-        session = (
-            db.query(ChatSession).filter(ChatSession.session_id == session_id).first()
-        )
+        deleted = await delete_session_rows(session_id, db)
 
-        if not session:
+        if not deleted:
             raise HTTPException(
                 status_code=404, detail=f"Session {session_id} not found"
             )
-
-        db.delete(session)
-        db.commit()
+        if deleted == "scheduled" and background_tasks is not None:
+            background_tasks.add_task(purge_deleted)
+        history_cache.discard(session_id)
 
         return {
             "detail": f"Session {session_id} and all its messages deleted successfully"
         }
+    except HTTPException:
+        raise
     except Exception as e:
         State.logger.error(f"An error occured while deleting session: {str(e)}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=500, detail=f"An error occured while deleting session: {str(e)}"
         )
 
 
-def add_ai_response(
+async def add_ai_response(
     case_id: str,
     patient_id: str,
     session_id: str,
     content: dict,
     safety: dict,
     history: list = [],
-    db: Session = None,
+    db: AsyncSession = None,
+    model: str = None,
 ):
     """
     Add an AI response to the chat history.
 
+    The session upsert (which also bumps ``time_updated``, ``version`` and
+    the message summary read by session listings) and the message insert run
+    as two statements in a single transaction, and the new message comes back
+    through ``RETURNING`` rather than a separate refresh. The message is counted in the analytics rollups in the same
+    transaction, and the new turns are written through to ``history_cache``.
+
     Args:
         session_id (str): Unique identifier for the chat session.
         content (dict): Content of the AI response.
         safety (dict): Safety evaluation of the AI response.
+        model (str): Model that generated the response.
     """
     try:
         if db:
-            session = (
-                db.query(ChatSession)
-                .filter(ChatSession.session_id == session_id)
-                .first()
+            now = datetime.now(UTC)
+            message_id = str(uuid.uuid4())
+            safety_level = (safety or {}).get("safety_level")
+            upsert = UPSERT_INSERTS[db.bind.dialect.name](ChatSession).values(
+                session_id=session_id,
+                title="New Session",
+                case_id=case_id,
+                patient_id=patient_id,
+                time_created=now.isoformat(),
+                time_updated=now.isoformat(),
+                version=1,
+                message_count=1,
+                last_message_id=message_id,
+                last_safety_level=str(safety_level) if safety_level else None,
             )
-            if not session:
-                new_session = ChatSession(
+            stamp = (
+                await db.execute(
+                    upsert.on_conflict_do_update(
+                        index_elements=[ChatSession.session_id],
+                        set_={
+                            "time_updated": upsert.excluded.time_updated,
+                            "version": ChatSession.version + 1,
+                            "message_count": ChatSession.message_count + 1,
+                            "last_message_id": upsert.excluded.last_message_id,
+                            "last_safety_level": upsert.excluded.last_safety_level,
+                        },
+                        # A soft-deleted session returns no row.
+                        where=ChatSession.deleted_at.is_(None),
+                    ).returning(
+                        ChatSession.time_created,
+                        ChatSession.version,
+                        ChatSession.archived_at,
+                    )
+                )
+            ).first()
+            if stamp is None:
+                raise HTTPException(
+                    status_code=404, detail=f"Session {session_id} not found"
+                )
+            time_created, version, archived_at = stamp
+            new_message = await db.scalar(
+                insert(SessionMessages)
+                .values(
+                    message_id=message_id,
                     session_id=session_id,
-                    title="New Session",
                     case_id=case_id,
                     patient_id=patient_id,
-                    time_created=datetime.utcnow(),
-                    time_updated=datetime.utcnow(),
+                    content=content,
+                    safety=safety,
+                    search_text=message_search_text(content),
+                    model=model,
+                    timestamp=now,
                 )
-                db.add(new_session)
-                db.commit()
-                db.refresh(new_session)
-            new_message = SessionMessages(
-                message_id=str(uuid.uuid4()),
-                session_id=session_id,
-                case_id=case_id,
-                patient_id=patient_id,
-                content=content,
-                safety=safety,
-                timestamp=datetime.utcnow(),
+                .returning(SessionMessages)
+            )
+            await record_message(db, now, model, case_id, safety)
+            await db.commit()
+            if archived_at:
+                # Archived after the memory was read; bring the rest back.
+                await restore_session(session_id, db)
+            history_cache.append(
+                session_id,
+                (time_created, version - 1),
+                (time_created, version),
+                content,
             )
-            db.add(new_message)
-            db.commit()
-            db.refresh(new_message)
         history.append(
             {
                 "session_id": session_id,
@@ -178,6 +374,8 @@ def add_ai_response(
             }
         )
         return new_message
+    except HTTPException:
+        raise
     except Exception as e:
         State.logger.error(f"An error occured while adding AI response: {str(e)}")
         raise HTTPException(
@@ -186,43 +384,117 @@ def add_ai_response(
         )
 
 
-def get_chat_history(session_id: str, db: Session):
+def _as_utc(timestamp: datetime) -> datetime:
+    # SQLite hands back naive datetimes; every stored timestamp is UTC.
+    return timestamp if timestamp.tzinfo else timestamp.replace(tzinfo=UTC)
+
+
+def message_search_text(content: list) -> str:
+    """The text parts of a message's turns, as indexed for full-text search."""
+    return " ".join(
+        part["text"]
+        for turn in content or []
+        if isinstance(turn, dict) and isinstance(turn.get("content"), list)
+        for part in turn["content"]
+        if isinstance(part, dict) and part.get("type") == "text" and part.get("text")
+    )
+
+
+# Columns returned by the history API.
+HISTORY_COLUMNS = (
+    SessionMessages.message_id,
+    SessionMessages.case_id,
+    SessionMessages.patient_id,
+    SessionMessages.session_id,
+    SessionMessages.content,
+    SessionMessages.safety,
+    SessionMessages.like,
+    SessionMessages.feedback,
+    SessionMessages.stars,
+    SessionMessages.timestamp,
+)
+HISTORY_ORDER = (SessionMessages.timestamp, SessionMessages.message_id)
+# Identifies one state of a session's messages for history_cache.
+SESSION_STAMP = (ChatSession.time_created, ChatSession.version)
+# Rows fetched per round trip when streaming a session's memory.
+MEMORY_STREAM_BATCH = 500
+
+
+async def get_chat_history(
+    session_id: str,
+    db: AsyncSession,
+    limit: int = None,
+    before: str = None,
+    newest_first: bool = False,
+):
     """
-    Retrieve the chat history for a given session.
+    Retrieve the chat history for a given session, ordered by timestamp.
+
+    With ``limit``, only the ``limit`` most recent messages are returned, and
+    ``before`` (a message ID) pages further back from that message. The page
+    is chronological unless ``newest_first`` is set. Only the history columns
+    are selected, so no ORM objects are built.
 
     Args:
         session_id (str): Unique identifier for the chat session.
+        limit (int): Maximum number of messages to return.
+        before (str): Only return messages older than this message.
+        newest_first (bool): Return the newest message first.
 
     Returns:
-        List[SessionMessages]: List of chat messages for the session.
+        List[dict]: List of chat messages for the session.
     """
     try:
         if db:
-            history = (
-                db.query(SessionMessages)
-                .filter(
+            query = (
+                select(*HISTORY_COLUMNS)
+                .join(ChatSession, ChatSession.session_id == SessionMessages.session_id)
+                .where(
                     SessionMessages.session_id == session_id,
+                    ChatSession.deleted_at.is_(None),
                 )
-                .all()
             )
-            history = [
-                {
-                    "message_id": msg.message_id,
-                    "case_id": msg.case_id,
-                    "patient_id": msg.patient_id,
-                    "session_id": msg.session_id,
-                    "content": msg.content,
-                    "safety": msg.safety,
-                    "like": msg.like,
-                    "feedback": msg.feedback,
-                    "stars": msg.stars,
-                    "timestamp": msg.timestamp,
-                }
-                for msg in history
-            ]
+            if before:
+                cursor = (
+                    await db.execute(
+                        select(*HISTORY_ORDER).where(
+                            SessionMessages.message_id == before,
+                            SessionMessages.session_id == session_id,
+                        )
+                    )
+                ).first()
+                if not cursor:
+                    if await _restore_if_archived(session_id, db):
+                        return await _history_from_primary(
+                            session_id, limit, before, newest_first
+                        )
+                    raise HTTPException(
+                        status_code=404, detail=f"Message {before} not found"
+                    )
+                query = query.where(tuple_(*HISTORY_ORDER) < tuple_(*cursor))
+            if limit or newest_first:
+                query = query.order_by(*(column.desc() for column in HISTORY_ORDER))
+            else:
+                query = query.order_by(*HISTORY_ORDER)
+            rows = (await db.execute(query.limit(limit))).all()
+            # An archived session has no messages in the hot table.
+            if not rows and await _restore_if_archived(session_id, db):
+                return await _history_from_primary(
+                    session_id, limit, before, newest_first
+                )
+            if limit and not newest_first:
+                rows = rows[::-1]
+            history = []
+            for row in rows:
+                message = row._asdict()
+                message["timestamp"] = _as_utc(message["timestamp"])
+                message.update(message_updates.pending_values(row.message_id))
+                history.append(message)
             return history
         session_history = [msg for msg in history if msg["session_id"] == session_id]
         return session_history
+    except HTTPException:
+        raise
     except Exception as e:
         State.logger.error(f"An error occured while getting chat history: {str(e)}")
         raise HTTPException(
@@ -231,29 +503,224 @@ def get_chat_history(session_id: str, db: Session):
         )
 
 
-def like_ai_message(message_id: str, like: str, db: Session):
+async def _restore_if_archived(session_id: str, db: AsyncSession) -> bool:
+    archived_at = await db.scalar(
+        select(ChatSession.archived_at).where(ChatSession.session_id == session_id)
+    )
+    if not archived_at:
+        return False
+    # ``db`` may be a replica session, so restore on the primary.
+    async with SessionLocal() as primary:
+        await restore_session(session_id, primary)
+    return True
+
+
+async def _history_from_primary(session_id, limit, before, newest_first) -> list:
+    # Restored rows may not have reached a replica yet.
+    async with SessionLocal() as primary:
+        return await get_chat_history(
+            session_id, primary, limit=limit, before=before, newest_first=newest_first
+        )
+
+
+async def get_chat_memory(session_id: str, db: AsyncSession) -> list:
+    """
+    Build the model memory for a session: the turns of every message in order.
+
+    A cheap lookup of the session's ``version`` decides whether the copy in
+    ``history_cache`` is still current, so other workers' writes are seen.
+    On a miss only the ``content`` column is read, streamed in batches of
+    ``MEMORY_STREAM_BATCH`` rows, so long sessions never load full rows. An
+    archived session is restored first.
+
+    Returns:
+        List[dict]: The conversation turns of the session, oldest first.
+    """
+    try:
+        session = (
+            await db.execute(
+                select(
+                    *SESSION_STAMP,
+                    ChatSession.case_id,
+                    ChatSession.patient_id,
+                    ChatSession.archived_at,
+                ).where(
+                    ChatSession.session_id == session_id,
+                    ChatSession.deleted_at.is_(None),
+                )
+            )
+        ).first()
+        if session is None:
+            return []
+        stamp = tuple(session[:2])
+        memory = history_cache.get(session_id, stamp)
+        if memory is not None:
+            return memory
+        if session.archived_at:
+            await restore_session(session_id, db)
+            return await get_chat_memory(session_id, db)
+        memory = []
+        # The stamp is read with the rows, so it matches exactly what they hold.
+        result = await db.stream(
+            select(SessionMessages.content, *SESSION_STAMP)
+            .join(ChatSession, ChatSession.session_id == SessionMessages.session_id)
+            .where(SessionMessages.session_id == session_id)
+            .order_by(*HISTORY_ORDER)
+            .execution_options(yield_per=MEMORY_STREAM_BATCH)
+        )
+        async for content, *row_stamp in result:
+            memory.extend(content)
+            stamp = tuple(row_stamp)
+        history_cache.put(session_id, stamp, memory, tuple(session[2:4]))
+        return memory
+    except Exception as e:
+        State.logger.error(f"An error occured while getting chat memory: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occured while getting chat memory: {str(e)}",
+        )
+
+
+# Columns returned for each search hit.
+SEARCH_COLUMNS = (
+    SessionMessages.message_id,
+    SessionMessages.session_id,
+    SessionMessages.case_id,
+    SessionMessages.patient_id,
+    SessionMessages.timestamp,
+)
+SEARCH_WORD = re.compile(r"\w+")
+SESSION_MESSAGES_FTS = table("session_messages_fts", column("rowid"))
+
+
+def _fts_phrase(value: str) -> str:
+    return '"' + value.replace('"', '""') + '"'
+
+
+def _search_query(query: str, patient_id: str, case_id: str, dialect_name: str):
+    """Ranked search statement for ``dialect_name``, or ``None`` for no terms."""
+    if dialect_name == "postgresql":
+        english = literal_column("'english'")
+        tsquery = func.websearch_to_tsquery(english, query)
+        vector = literal_column("session_messages.search_vector")
+        return select(
+            *SEARCH_COLUMNS,
+            func.ts_rank_cd(vector, tsquery).label("rank"),
+            func.ts_headline(
+                english,
+                func.coalesce(SessionMessages.search_text, ""),
+                tsquery,
+                "MaxFragments=1, MinWords=5, MaxWords=20",
+            ).label("snippet"),
+        ).where(vector.op("@@")(tsquery))
+    words = SEARCH_WORD.findall(query)
+    if not words:
+        return None
+    # Quoted terms, so user input is never parsed as FTS5 query syntax.
+    match = "search_text : (" + " ".join(_fts_phrase(w) for w in words) + ")"
+    if patient_id:
+        match += f" AND patient_id : {_fts_phrase(patient_id)}"
+    if case_id:
+        match += f" AND case_id : {_fts_phrase(case_id)}"
+    fts = literal_column("session_messages_fts")
+    return (
+        select(
+            *SEARCH_COLUMNS,
+            # bm25 is lower-is-better; the id columns carry no weight.
+            (-func.bm25(fts, 1.0, 0.0, 0.0)).label("rank"),
+            func.snippet(fts, 0, "[", "]", "...", 20).label("snippet"),
+        )
+        .select_from(SESSION_MESSAGES_FTS)
+        .join(
+            SessionMessages,
+            literal_column("session_messages.rowid") == SESSION_MESSAGES_FTS.c.rowid,
+        )
+        .where(text("session_messages_fts MATCH :match").bindparams(match=match))
+    )
+
+
+async def search_messages(
+    query: str,
+    db: AsyncSession,
+    patient_id: str = None,
+    case_id: str = None,
+    limit: int = 20,
+    offset: int = 0,
+):
+    """
+    Full-text search over session messages of a patient and/or case.
+
+    Uses the FTS5 index on SQLite and the ``search_vector`` GIN index on
+    Postgres (migration 5). Hits are ranked best first, with a highlighted
+    snippet; one row past ``limit`` is read to know whether more exist.
+
+    Returns:
+        tuple: ``(hits, next_offset)``; ``next_offset`` is ``None`` on the last page.
+    """
+    try:
+        statement = _search_query(query, patient_id, case_id, db.bind.dialect.name)
+        if statement is None:
+            return [], None
+        scope = [ChatSession.deleted_at.is_(None)]
+        if patient_id:
+            scope.append(SessionMessages.patient_id == patient_id)
+        if case_id:
+            scope.append(SessionMessages.case_id == case_id)
+        rows = (
+            await db.execute(
+                statement.join(
+                    ChatSession, ChatSession.session_id == SessionMessages.session_id
+                )
+                .where(*scope)
+                .order_by(literal_column("rank").desc(), SessionMessages.message_id)
+                .limit(limit + 1)
+                .offset(offset)
+            )
+        ).all()
+        hits = []
+        for row in rows[:limit]:
+            hit = row._asdict()
+            hit["timestamp"] = _as_utc(hit["timestamp"])
+            hits.append(hit)
+        return hits, offset + limit if len(rows) > limit else None
+    except Exception as e:
+        State.logger.error(f"An error occured while searching messages: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occured while searching messages: {str(e)}",
+        )
+
+
+async def _require_message(message_id: str, db: AsyncSession):
+    """Raise 404 unless the message exists; a primary key lookup."""
+    found = await db.scalar(
+        select(SessionMessages.message_id).where(
+            SessionMessages.message_id == message_id
+        )
+    )
+    if found is None:
+        raise HTTPException(status_code=404, detail=f"Message {message_id} not found")
+
+
+async def like_ai_message(message_id: str, like: str, db: AsyncSession):
     """
     Like or dislike an AI message.
 
+    The message must exist (404 otherwise); the update is queued on
+    ``message_updates`` and written in the background.
+
     Args:
         message_id (str): Unique identifier for the message.
         like (str): "like" or "dislike".
     """
     try:
         if db:
-            message = (
-                db.query(SessionMessages)
-                .filter(SessionMessages.message_id == message_id)
-                .first()
-            )
-            if message:
-                message.like = like
-                db.commit()
-                db.refresh(message)
-            else:
-                raise HTTPException(status_code=404, detail="Message not found")
+            await _require_message(message_id, db)
+            message_updates.submit(message_id, like=like)
             return {"detail": "Liked message."}
         return None
+    except HTTPException:
+        raise
     except Exception as e:
         State.logger.error(f"An error occured while liking message: {str(e)}")
         raise HTTPException(
@@ -262,10 +729,23 @@ def like_ai_message(message_id: str, like: str, db: Session):
         )
 
 
-def submit_feedback(message_id: str, feedback: str, stars: int, db: Session):
+def _queue_feedback(message_id: str, feedback: str, stars: int):
+    values = {}
+    if feedback:
+        values["feedback"] = feedback
+    if stars:
+        values["stars"] = stars
+    if values:
+        message_updates.submit(message_id, **values)
+
+
+async def submit_feedback(message_id: str, feedback: str, stars: int, db: AsyncSession):
     """
     Submit feedback for an AI message.
 
+    The message must exist (404 otherwise); the update is queued on
+    ``message_updates`` and written in the background.
+
     Args:
         message_id (str): Unique identifier for the message.
         feedback (str): Feedback text.
@@ -273,18 +753,12 @@ def submit_feedback(message_id: str, feedback: str, stars: int, db: Session):
     """
     try:
         if db:
-            message = (
-                db.query(SessionMessages)
-                .filter(SessionMessages.message_id == message_id)
-                .first()
-            )
-            if message:
-                message.feedback = feedback if feedback else message.feedback
-                message.stars = stars if stars else message.stars
-                db.commit()
-                db.refresh(message)
+            await _require_message(message_id, db)
+            _queue_feedback(message_id, feedback, stars)
             return {"detail": "Feedback submitted."}
         return None
+    except HTTPException:
+        raise
     except Exception as e:
         State.logger.error(f"An error occured while submitting feedback: {str(e)}")
         raise HTTPException(
@@ -293,10 +767,13 @@ def submit_feedback(message_id: str, feedback: str, stars: int, db: Session):
         )
 
 
-def edit_feedback(message_id: str, feedback: str, stars: int, db: Session):
+async def edit_feedback(message_id: str, feedback: str, stars: int, db: AsyncSession):
     """
     Edit feedback for an AI message.
 
+    The message must exist (404 otherwise); the update is queued on
+    ``message_updates`` and written in the background.
+
     Args:
         message_id (str): Unique identifier for the message.
         feedback (str): Feedback text.
@@ -304,18 +781,12 @@ def edit_feedback(message_id: str, feedback: str, stars: int, db: Session):
     """
     try:
         if db:
-            message = (
-                db.query(SessionMessages)
-                .filter(SessionMessages.message_id == message_id)
-                .first()
-            )
-            if message:
-                message.feedback = feedback if feedback else message.feedback
-                message.stars = stars if stars else message.stars
-                db.commit()
-                db.refresh(message)
+            await _require_message(message_id, db)
+            _queue_feedback(message_id, feedback, stars)
             return {"detail": "Feedback submitted."}
         return None
+    except HTTPException:
+        raise
     except Exception as e:
         State.logger.error(f"An error occured while editing feedback: {str(e)}")
         raise HTTPException(
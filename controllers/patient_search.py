@@ -0,0 +1,162 @@
+import os
+import time
+
+from sqlalchemy import case, column, literal_column, select, table, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.patients import Patient
+from utils.names import normalize_name
+from utils.state import State
+
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+# Trigram indexes cannot narrow shorter queries.
+MIN_SUBSTRING_QUERY = 3
+
+# Match kinds, best first.
+MATCHES = ("exact", "prefix", "word", "substring")
+
+PATIENTS_NAME_FTS = table("patients_name_fts", column("rowid"))
+
+# Per database URL: whether the Postgres trigram index exists (migration 10)
+# and when that was checked. Rechecked after this many seconds, so an index
+# created while the app runs is picked up without a restart.
+TRIGRAM_CHECK_SECONDS = float(os.getenv("TRIGRAM_CHECK_SECONDS", "60"))
+_trigram_index = {}
+
+
+def _match(name: str, query: str) -> int:
+    if name == query:
+        return 0
+    if name.startswith(query):
+        return 1
+    if f" {query}" in f" {name}":
+        return 2
+    return 3
+
+
+async def _has_trigram_index(db: AsyncSession) -> bool:
+    if db.bind.dialect.name != "postgresql":
+        return True
+    url = str(db.bind.url)
+    found, checked = _trigram_index.get(url, (None, 0.0))
+    if time.monotonic() - checked >= TRIGRAM_CHECK_SECONDS:
+        exists = bool(
+            await db.scalar(
+                text(
+                    "SELECT 1 FROM pg_indexes "
+                    "WHERE indexname = 'ix_patients_name_trgm'"
+                )
+            )
+        )
+        if not exists and found is not False:
+            State.logger.warning(
+                "ix_patients_name_trgm is missing; patient search only matches "
+                "name prefixes until pg_trgm is installed and the index created"
+            )
+        found = exists
+        _trigram_index[url] = (found, time.monotonic())
+    return found
+
+
+def _rank(query: str):
+    """``_match`` as a SQL expression on ``Patient.name_normalized``."""
+    name = Patient.name_normalized
+    return case(
+        (name == query, 0),
+        (name.startswith(query, autoescape=True), 1),
+        (name.contains(" " + query, autoescape=True), 2),
+        else_=3,
+    )
+
+
+def _substring_query(query: str, columns: list, dialect_name: str):
+    if dialect_name == "postgresql":
+        # Served by the pg_trgm GIN index ix_patients_name_trgm.
+        return select(*columns).where(
+            Patient.name_normalized.contains(query, autoescape=True)
+        )
+    # FTS5 trigram index; a quoted phrase matches it as a substring.
+    return (
+        select(*columns)
+        .select_from(PATIENTS_NAME_FTS)
+        .join(Patient, literal_column("patients.rowid") == PATIENTS_NAME_FTS.c.rowid)
+        .where(
+            text("patients_name_fts MATCH :match").bindparams(
+                match='"' + query.replace('"', '""') + '"'
+            )
+        )
+    )
+
+
+def name_prefix_filters(query: str) -> list:
+    """
+    Filters for patients whose normalized name starts with ``query`` (itself
+    normalized), a range read of ``ix_patients_name_normalized``. Names sort
+    by code point on SQLite and byte on Postgres, in which every name with
+    the prefix lies in ``[query, query with its last character bumped)``.
+    """
+    query = normalize_name(query)
+    if not query:
+        return []
+    upper = query[:-1] + chr(ord(query[-1]) + 1)
+    return [Patient.name_normalized >= query, Patient.name_normalized < upper]
+
+
+async def search_patients(
+    query: str, db: AsyncSession, columns: list, limit: int = DEFAULT_SEARCH_LIMIT
+) -> list:
+    """
+    Patients whose name matches ``query``, best first, at most ``limit``.
+
+    Names and the query are compared normalized (``normalize_name``). Name
+    prefixes are read in order from ``ix_patients_name_normalized``; when
+    they do not fill the page, the best ``limit`` names containing the query
+    are added from the trigram index (pg_trgm on Postgres, an FTS5 trigram
+    table on SQLite). Hits are ranked exact name, name prefix, word prefix,
+    then substring, and by name within each, in SQL as well as here.
+
+    Returns:
+        List[dict]: ``columns`` of each patient plus ``match``, one of
+        ``MATCHES``.
+    """
+    query = normalize_name(query)
+    if not query:
+        return []
+    columns = [*columns, Patient.name_normalized]
+    live = Patient.deleted_at.is_(None)
+    rows = (
+        await db.execute(
+            select(*columns)
+            .where(*name_prefix_filters(query), live)
+            .order_by(Patient.name_normalized, Patient.patient_id)
+            .limit(limit)
+        )
+    ).all()
+    hits = {row.patient_id: row._asdict() for row in rows}
+    if (
+        len(hits) < limit
+        and len(query) >= MIN_SUBSTRING_QUERY
+        and await _has_trigram_index(db)
+    ):
+        rows = await db.execute(
+            _substring_query(query, columns, db.bind.dialect.name)
+            .where(live)
+            .order_by(_rank(query), Patient.name_normalized, Patient.patient_id)
+            .limit(limit)
+        )
+        for row in rows:
+            hits.setdefault(row.patient_id, row._asdict())
+    ranked = sorted(
+        hits.values(),
+        key=lambda hit: (
+            _match(hit["name_normalized"], query),
+            hit["name_normalized"],
+            hit["patient_id"],
+        ),
+    )
+    results = []
+    for hit in ranked[:limit]:
+        hit["match"] = MATCHES[_match(hit.pop("name_normalized"), query)]
+        results.append(hit)
+    return results
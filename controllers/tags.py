@@ -0,0 +1,103 @@
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from database.database import UPSERT_INSERTS
+from models.cases import Case, CaseTag, CaseTagCount
+
+DEFAULT_TAG_LIMIT = 50
+
+
+def normalize_tags(tags) -> list:
+    """Tags stripped of whitespace, without blanks or repeats, in order."""
+    seen = []
+    for tag in tags or []:
+        tag = tag.strip() if isinstance(tag, str) else ""
+        if tag and tag not in seen:
+            seen.append(tag)
+    return seen
+
+
+def case_tag_rows(case_id: str, patient_id: str, tags) -> list:
+    """``case_tags`` rows for a case carrying ``tags``."""
+    return [
+        {"case_id": case_id, "tag": tag, "patient_id": patient_id}
+        for tag in normalize_tags(tags)
+    ]
+
+
+async def set_case_tags(db: AsyncSession, case_id: str, patient_id: str, tags):
+    """
+    Make the ``case_tags`` rows of a case match ``tags``. Only removed and
+    added tags are written. Runs in the caller's transaction.
+    """
+    rows = case_tag_rows(case_id, patient_id, tags)
+    await db.execute(
+        delete(CaseTag).where(
+            CaseTag.case_id == case_id, CaseTag.tag.not_in([row["tag"] for row in rows])
+        )
+    )
+    if rows:
+        await db.execute(
+            UPSERT_INSERTS[db.bind.dialect.name](CaseTag).on_conflict_do_nothing(
+                index_elements=[CaseTag.case_id, CaseTag.tag]
+            ),
+            rows,
+        )
+
+
+def tagged_with(tags) -> tuple:
+    """
+    Keyset key and filters on ``Case`` for cases carrying every one of
+    ``tags``.
+
+    The first tag's ``case_tags`` rows drive the query: they are read from
+    ``ix_case_tags_tag_case_id`` already in ``case_id`` order, so a page
+    costs the same for rare and common tags. Other tags are primary key
+    lookups.
+
+    Returns:
+        tuple: ``(key, filters)``; ``key`` is ``Case.case_id`` without tags.
+    """
+    key, filters = Case.case_id, []
+    for tag in normalize_tags(tags):
+        tagged = aliased(CaseTag)
+        if not filters:
+            key = tagged.case_id
+        filters += [tagged.case_id == Case.case_id, tagged.tag == tag]
+    return key, filters
+
+
+async def count_tags(
+    db: AsyncSession,
+    patient_id: str = None,
+    tags=None,
+    limit: int = DEFAULT_TAG_LIMIT,
+) -> list:
+    """
+    Number of live cases per tag, most used first.
+
+    Soft-deleted cases lose their ``case_tags`` rows when they are marked,
+    so nothing here reads ``cases``. Unfiltered counts come from
+    ``case_tag_counts``, kept up to date by triggers on ``case_tags``; counts
+    for one patient read ``ix_case_tags_patient_id_tag``. With ``tags``, only
+    cases carrying all of them are counted, which gives the facets of a
+    filtered case listing.
+
+    Returns:
+        List[dict]: ``{"tag": ..., "cases": ...}`` for at most ``limit`` tags.
+    """
+    tags = normalize_tags(tags)
+    if not patient_id and not tags:
+        name, cases = CaseTagCount.tag, CaseTagCount.cases
+        query = select(name, cases).where(cases > 0)
+    else:
+        name, cases = CaseTag.tag, func.count().label("cases")
+        query = select(name, cases).group_by(name)
+        if patient_id:
+            query = query.where(CaseTag.patient_id == patient_id)
+        for tag in tags:
+            tagged = aliased(CaseTag)
+            query = query.where(tagged.case_id == CaseTag.case_id, tagged.tag == tag)
+    rows = await db.execute(query.order_by(cases.desc(), name).limit(limit))
+    return [{"tag": tag, "cases": count} for tag, count in rows]
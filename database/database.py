@@ -1,52 +1,364 @@
+import asyncio
 import os
 import logging
+import time
+from contextlib import asynccontextmanager
+
+import logfire
+from fastapi import Request
+from jose import jwt
 
 # Ensure SQLite enforces foreign key constraints (so ON DELETE CASCADE works)
 from sqlalchemy import event
-from sqlalchemy import create_engine
-from sqlalchemy.orm import declarative_base, sessionmaker
-from sqlalchemy.exc import OperationalError, DBAPIError, DisconnectionError
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import declarative_base
+from sqlalchemy import text
+from sqlalchemy.exc import (
+    OperationalError,
+    DBAPIError,
+    DisconnectionError,
+    TimeoutError,
+)
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
-engine = create_engine(
-    os.getenv("DATABASE_URL"),
-    connect_args=(
-        {"check_same_thread": False}
-        if "sqlite" in os.getenv("DATABASE_URL", "")
-        else {}
-    ),
-    # Help detect and recycle stale/closed connections (useful for SSL disconnects)
-    pool_pre_ping=True,
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+# Dialect-specific INSERTs that support ON CONFLICT
+UPSERT_INSERTS = {"postgresql": postgresql_insert, "sqlite": sqlite_insert}
+
+POOL_CHECKOUT_WAIT = logfire.metric_histogram(
+    "db.pool.checkout_wait",
+    unit="ms",
+    description="Time spent waiting for a pooled database connection",
+)
+POOL_CONNECT_TIME = logfire.metric_histogram(
+    "db.pool.connect_time",
+    unit="ms",
+    description="Time spent opening a new database connection",
+)
+POOL_CHECKOUT_TIMEOUTS = logfire.metric_counter(
+    "db.pool.checkout_timeouts",
+    description="Checkouts that gave up after pool_timeout",
+)
+READS_ROUTED = logfire.metric_counter(
+    "db.reads_routed",
+    description="Read-only requests by the engine that served them",
+)
+REPLICA_LAG = logfire.metric_gauge(
+    "db.replica_lag",
+    unit="s",
+    description="Replication lag of the read replica, as last measured",
 )
 
+# Seconds the replica is behind the primary. Other dialects have no lag to
+# measure, so the probe only checks that the replica answers.
+REPLICA_LAG_QUERIES = {
+    "postgresql": "SELECT CASE WHEN NOT pg_is_in_recovery() "
+    "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END",
+}
+
+
+def to_async_url(url: str) -> str:
+    """Map a DATABASE_URL to its async driver (aiosqlite / asyncpg).
+
+    URLs that already name a driver other than the sync defaults are kept as is,
+    so ``postgresql+asyncpg://`` and ``sqlite+aiosqlite://`` pass through.
+    """
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://") :]
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend in ASYNC_DRIVERS and parsed.get_driver_name() in (
+        "pysqlite",
+        "psycopg2",
+    ):
+        parsed = parsed.set(drivername=ASYNC_DRIVERS[backend])
+    return parsed.render_as_string(hide_password=False)
+
+
+class DatabaseSettings:
+    """Connection-pool and SQLite tuning for the application engine.
+
+    ``stale_connections`` picks how dropped connections are detected:
+    ``pre_ping`` tests every checkout with a round trip, ``recycle`` replaces
+    connections older than ``pool_recycle`` seconds without pinging. SQLite
+    connections are local files and never go stale, so neither applies there.
+    """
+
+    STALE_CONNECTION_MODES = ("pre_ping", "recycle")
+
+    def __init__(
+        self,
+        pool_size: int = 5,
+        max_overflow: int = 10,
+        pool_timeout: float = 30,
+        pool_recycle: int = 1800,
+        stale_connections: str = "pre_ping",
+        slow_checkout_ms: float = 100,
+        sqlite_journal_mode: str = "WAL",
+        sqlite_synchronous: str = "NORMAL",
+        sqlite_mmap_size: int = 256 * 1024 * 1024,
+        sqlite_cache_size: int = -64000,
+    ):
+        if stale_connections not in self.STALE_CONNECTION_MODES:
+            raise ValueError(f"Unknown stale connection mode: {stale_connections}")
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_timeout = pool_timeout
+        self.pool_recycle = pool_recycle
+        self.stale_connections = stale_connections
+        self.slow_checkout_ms = slow_checkout_ms
+        self.sqlite_journal_mode = sqlite_journal_mode
+        self.sqlite_synchronous = sqlite_synchronous
+        self.sqlite_mmap_size = sqlite_mmap_size
+        # Negative values are KiB, positive values are pages (SQLite semantics).
+        self.sqlite_cache_size = sqlite_cache_size
+
+    @classmethod
+    def from_env(cls) -> "DatabaseSettings":
+        return cls(
+            pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+            pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+            pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+            stale_connections=os.getenv("DB_STALE_CONNECTIONS", "pre_ping"),
+            slow_checkout_ms=float(os.getenv("DB_SLOW_CHECKOUT_MS", "100")),
+            sqlite_journal_mode=os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+            sqlite_synchronous=os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+            sqlite_mmap_size=int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+            sqlite_cache_size=int(os.getenv("SQLITE_CACHE_SIZE", "-64000")),
+        )
+
+    def engine_kwargs(self, url: str) -> dict:
+        """Keyword arguments for ``create_async_engine`` on ``url``."""
+        parsed = make_url(url)
+        is_sqlite = parsed.get_backend_name() == "sqlite"
+        if is_sqlite and parsed.database in (None, "", ":memory:"):
+            # In-memory databases live on a single shared connection.
+            return {}
+        kwargs = {
+            "poolclass": TimedQueuePool,
+            "pool_size": self.pool_size,
+            "max_overflow": self.max_overflow,
+            "pool_timeout": self.pool_timeout,
+        }
+        if is_sqlite:
+            return kwargs
+        if self.stale_connections == "pre_ping":
+            # Help detect and recycle stale/closed connections (useful for SSL disconnects)
+            kwargs["pool_pre_ping"] = True
+        else:
+            kwargs["pool_recycle"] = self.pool_recycle
+        return kwargs
+
+    def sqlite_pragmas(self) -> list:
+        return [
+            "PRAGMA foreign_keys=ON",
+            f"PRAGMA journal_mode={self.sqlite_journal_mode}",
+            f"PRAGMA synchronous={self.sqlite_synchronous}",
+            f"PRAGMA mmap_size={self.sqlite_mmap_size}",
+            f"PRAGMA cache_size={self.sqlite_cache_size}",
+        ]
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that reports how long each checkout waited for a connection.
+
+    Only time spent blocked on an exhausted pool counts as a wait; it is
+    recorded in the ``db.pool.checkout_wait`` histogram (immediate checkouts
+    record 0), and waits slower than ``DatabaseSettings.slow_checkout_ms`` are
+    also logged, so a saturated pool is visible well before requests start
+    timing out. Opening a new connection is timed separately in
+    ``db.pool.connect_time``.
+    """
+
+    def _do_get(self):
+        exhausted = self._pool.empty() and 0 <= self._max_overflow <= self._overflow
+        if not exhausted:
+            POOL_CHECKOUT_WAIT.record(0.0)
+            return super()._do_get()
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except TimeoutError:
+            POOL_CHECKOUT_TIMEOUTS.add(1)
+            raise
+        finally:
+            waited_ms = (time.perf_counter() - start) * 1000
+            POOL_CHECKOUT_WAIT.record(waited_ms)
+            if waited_ms > settings.slow_checkout_ms:
+                logging.getLogger("app.database").warning(
+                    "Waited %.0fms for a database connection (%s)",
+                    waited_ms,
+                    self.status(),
+                )
+
+    def _create_connection(self):
+        start = time.perf_counter()
+        try:
+            return super()._create_connection()
+        finally:
+            POOL_CONNECT_TIME.record((time.perf_counter() - start) * 1000)
+
+
+class ReadRouter:
+    """Picks the engine that serves a read-only request.
+
+    Reads go to the replica unless the same user wrote within the last
+    ``sticky_seconds`` (so they see their own writes), or the replica is more
+    than ``max_lag_seconds`` behind or unreachable; those fall back to the
+    primary. Lag is measured at most every ``lag_check_interval`` seconds, by
+    one probe at a time. Write stickiness is tracked per process.
+    """
+
+    def __init__(
+        self,
+        primary,
+        replica=None,
+        sticky_seconds: float = 5,
+        max_lag_seconds: float = 5,
+        lag_check_interval: float = 1,
+    ):
+        self.primary = primary
+        self.replica = replica
+        self.sticky_seconds = sticky_seconds
+        self.max_lag_seconds = max_lag_seconds
+        self.lag_check_interval = lag_check_interval
+        self.recent_writes = {}
+        self._lag = None
+        self._lag_checked = None
+        self._lag_probe = None
 
-url = os.getenv("DATABASE_URL", "")
-if "sqlite" in url:
+    def note_write(self, user_id: str):
+        """Serve ``user_id``'s reads from the primary for ``sticky_seconds``."""
+        if not user_id:
+            return
+        now = time.monotonic()
+        if len(self.recent_writes) > 1024:
+            self.recent_writes = {
+                key: until for key, until in self.recent_writes.items() if until > now
+            }
+        self.recent_writes[user_id] = now + self.sticky_seconds
 
-    @event.listens_for(engine, "connect")
-    def _set_sqlite_pragma(dbapi_connection, connection_record):
+    def is_sticky(self, user_id: str) -> bool:
+        return self.recent_writes.get(user_id, 0) > time.monotonic()
+
+    async def replica_lag(self) -> float | None:
+        """Seconds the replica is behind, or ``None`` if it is unreachable."""
+        if (
+            self._lag_checked is not None
+            and time.monotonic() - self._lag_checked < self.lag_check_interval
+        ):
+            return self._lag
+        # Requests arriving while the lag is measured wait for that probe.
+        probe = self._lag_probe
+        if (
+            probe is None
+            or probe.done()
+            or probe.get_loop() is not asyncio.get_running_loop()
+        ):
+            probe = self._lag_probe = asyncio.ensure_future(self._probe_lag())
+        return await asyncio.shield(probe)
+
+    async def _probe_lag(self) -> float | None:
+        now = time.monotonic()
         try:
-            cursor = dbapi_connection.cursor()
-            cursor.execute("PRAGMA foreign_keys=ON")
-            cursor.close()
-        except Exception:
-            # best-effort; if it fails, let SQLAlchemy raise on FK operations
-            pass
+            async with self.replica() as db:
+                query = REPLICA_LAG_QUERIES.get(db.bind.dialect.name, "SELECT 0")
+                lag = float(await db.scalar(text(query)))
+            REPLICA_LAG.set(lag)
+        except Exception as e:
+            logging.getLogger("app.database").warning(
+                "Read replica unavailable, using the primary: %s", e
+            )
+            lag = None
+        self._lag, self._lag_checked = lag, now
+        return lag
+
+    async def session_factory(self, user_id: str = None):
+        """The session factory for a read by ``user_id``."""
+        target = "primary"
+        if self.replica is not None and not self.is_sticky(user_id):
+            lag = await self.replica_lag()
+            if lag is not None and lag <= self.max_lag_seconds:
+                target = "replica"
+        READS_ROUTED.add(1, {"target": target})
+        return self.replica if target == "replica" else self.primary
+
+
+def create_engine_for(url: str):
+    """Create the async engine for ``url`` with the pool and SQLite settings."""
+    url = to_async_url(url)
+    engine_ = create_async_engine(url, **settings.engine_kwargs(url))
+    if make_url(url).get_backend_name() == "sqlite":
 
+        @event.listens_for(engine_.sync_engine, "connect")
+        def _set_sqlite_pragma(dbapi_connection, connection_record):
+            try:
+                cursor = dbapi_connection.cursor()
+                for pragma in settings.sqlite_pragmas():
+                    cursor.execute(pragma)
+                cursor.close()
+            except Exception:
+                # best-effort; if it fails, let SQLAlchemy raise on FK operations
+                pass
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    return engine_
+
+
+settings = DatabaseSettings.from_env()
+engine = create_engine_for(os.getenv("DATABASE_URL"))
+# Optional read replica for read-only routes (see get_read_db).
+read_engine = (
+    create_engine_for(os.getenv("DATABASE_READ_URL"))
+    if os.getenv("DATABASE_READ_URL")
+    else None
+)
+
+SessionLocal = async_sessionmaker(
+    bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+ReadSessionLocal = (
+    async_sessionmaker(
+        bind=read_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+    )
+    if read_engine is not None
+    else None
+)
+read_router = ReadRouter(
+    SessionLocal,
+    ReadSessionLocal,
+    sticky_seconds=float(os.getenv("READ_YOUR_WRITES_SECONDS", "5")),
+    max_lag_seconds=float(os.getenv("REPLICA_MAX_LAG_SECONDS", "5")),
+    lag_check_interval=float(os.getenv("REPLICA_LAG_CHECK_SECONDS", "1")),
+)
 Base = declarative_base()
 
 
 class DatabaseConnectionError(Exception):
-    """Raised when the DB connection fails (e.g. psycopg2 OperationalError).
+    """Raised when the DB connection fails (e.g. asyncpg / psycopg2 OperationalError).
 
     Routes can catch this and return 503 / log as needed.
     """
 
 
-def get_db():
-    db = SessionLocal()
+def request_user(request: Request) -> str | None:
+    """The ``sub`` of the request's bearer token, for read routing only."""
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
     try:
+        return jwt.get_unverified_claims(token).get("sub")
+    except Exception:
+        return None
+
+
+@asynccontextmanager
+async def _session(session_factory):
+    async with session_factory() as db:
         try:
             yield db
         except (OperationalError, DBAPIError, DisconnectionError) as e:
@@ -55,5 +367,18 @@ def get_db():
                 "Database operational error: %s", e
             )
             raise DatabaseConnectionError(str(e)) from e
-    finally:
-        db.close()
+
+
+async def get_db(request: Request):
+    """Session on the primary. Writes make the user's reads sticky to it."""
+    if request.method not in ("GET", "HEAD", "OPTIONS"):
+        read_router.note_write(request_user(request))
+    async with _session(SessionLocal) as db:
+        yield db
+
+
+async def get_read_db(request: Request):
+    """Session for read-only routes: the replica when it is safe to use."""
+    session_factory = await read_router.session_factory(request_user(request))
+    async with _session(session_factory) as db:
+        yield db
@@ -0,0 +1,443 @@
+import datetime
+import logging
+
+from sqlalchemy import inspect, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from utils.names import normalize_name
+
+logger = logging.getLogger("app.database")
+
+# Ordered list of (version, description, statements). Append new migrations at
+# the end and never edit one that has shipped. ``statements`` is a list of SQL
+# strings or callables (run with the sync connection), or a dict of such lists
+# keyed by dialect name. Statements must also be safe on a fresh database,
+# because ``create_all`` already builds those from the current models
+# (including their indexes and columns).
+
+
+def add_column(table: str, column: str, ddl: str):
+    """Migration step that adds ``column`` to ``table`` unless it exists."""
+
+    def step(sync_conn):
+        columns = {c["name"] for c in inspect(sync_conn).get_columns(table)}
+        if column not in columns:
+            sync_conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+    return step
+
+
+# Backfill of the ChatSession message summary (migration 8).
+SESSION_SUMMARY = [
+    add_column("chat_session", "message_count", "INTEGER NOT NULL DEFAULT 0"),
+    add_column("chat_session", "last_message_id", "VARCHAR"),
+    add_column("chat_session", "last_safety_level", "VARCHAR"),
+    # Session listings page by time_updated; NULLs would never be reached.
+    "UPDATE chat_session SET time_updated = coalesce(time_created, '') "
+    "WHERE time_updated IS NULL",
+    "UPDATE chat_session SET message_count = (SELECT count(*) "
+    "FROM session_messages m WHERE m.session_id = chat_session.session_id) "
+    "+ coalesce((SELECT a.message_count FROM session_archives a "
+    "WHERE a.session_id = chat_session.session_id), 0)",
+    "UPDATE chat_session SET last_message_id = (SELECT m.message_id "
+    "FROM session_messages m WHERE m.session_id = chat_session.session_id "
+    "ORDER BY m.timestamp DESC, m.message_id DESC LIMIT 1)",
+    "CREATE INDEX IF NOT EXISTS ix_chat_session_case_id_patient_id_time_updated "
+    "ON chat_session (case_id, patient_id, time_updated)",
+]
+
+# Indexes of case_tags (migration 9); the tables come from create_all.
+CASE_TAG_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_case_tags_tag_case_id ON case_tags (tag, case_id)",
+    "CREATE INDEX IF NOT EXISTS ix_case_tags_patient_id_tag "
+    "ON case_tags (patient_id, tag)",
+]
+
+# Normalized patient names for name search (migration 10); see Patient.
+PATIENT_NAME_INDEX = {
+    "postgresql": "CREATE INDEX IF NOT EXISTS ix_patients_name_normalized "
+    "ON patients (name_normalized, patient_id) WHERE deleted_at IS NULL",
+    "sqlite": "CREATE INDEX IF NOT EXISTS ix_patients_name_normalized "
+    "ON patients (deleted_at, name_normalized, patient_id)",
+}
+
+
+def backfill_normalized_names(sync_conn, chunk_size: int = 1000):
+    """Fill ``patients.name_normalized`` with ``normalize_name(name)``."""
+    after = ""
+    while rows := sync_conn.execute(
+        text(
+            "SELECT patient_id, name FROM patients WHERE name_normalized IS NULL "
+            "AND patient_id > :after ORDER BY patient_id LIMIT :limit"
+        ),
+        {"after": after, "limit": chunk_size},
+    ).all():
+        sync_conn.execute(
+            text("UPDATE patients SET name_normalized = :name WHERE patient_id = :id"),
+            [
+                {"id": patient_id, "name": normalize_name(name)}
+                for patient_id, name in rows
+            ],
+        )
+        after = rows[-1][0]
+
+
+def create_trigram_index(sync_conn):
+    """Trigram index for name substrings, if pg_trgm can be installed."""
+    extension = sync_conn.execute(
+        text(
+            "SELECT installed_version FROM pg_available_extensions "
+            "WHERE name = 'pg_trgm'"
+        )
+    ).first()
+    try:
+        if extension is None:
+            raise RuntimeError("pg_trgm is not available")
+        if extension[0] is None:
+            with sync_conn.begin_nested():
+                sync_conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    except Exception as e:
+        logger.warning(
+            "Skipping ix_patients_name_trgm (%s); patient search will only match "
+            "name prefixes until pg_trgm is installed and the index created",
+            str(e).splitlines()[0],
+        )
+        return
+    sync_conn.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS ix_patients_name_trgm ON patients "
+            "USING GIN (name_normalized gin_trgm_ops) WHERE deleted_at IS NULL"
+        )
+    )
+
+
+MIGRATIONS = [
+    (
+        1,
+        "Indexes for hot lookup columns",
+        [
+            "CREATE INDEX IF NOT EXISTS ix_session_messages_session_id_timestamp "
+            "ON session_messages (session_id, timestamp)",
+            "CREATE INDEX IF NOT EXISTS ix_tokens_user_id_access_token_status "
+            "ON tokens (user_id, access_token, status)",
+            "CREATE INDEX IF NOT EXISTS ix_chat_session_case_id_patient_id "
+            "ON chat_session (case_id, patient_id)",
+            "CREATE INDEX IF NOT EXISTS ix_users_email ON users (email)",
+        ],
+    ),
+    (
+        2,
+        "Store session_messages.timestamp as a UTC datetime",
+        {
+            # Legacy values are naive utcnow() strings or UTC isoformat strings.
+            "postgresql": [
+                "DO $$ BEGIN "
+                "IF (SELECT data_type FROM information_schema.columns "
+                "WHERE table_name = 'session_messages' AND column_name = 'timestamp')"
+                " = 'character varying' THEN "
+                'ALTER TABLE session_messages ALTER COLUMN "timestamp" '
+                "TYPE TIMESTAMP WITH TIME ZONE "
+                "USING \"timestamp\"::timestamp AT TIME ZONE 'UTC'; "
+                "END IF; END $$",
+            ],
+            # SQLite keeps DATETIME as text; rewrite it to SQLAlchemy's storage
+            # format (UTC, microseconds) so it sorts and compares correctly.
+            "sqlite": [
+                "UPDATE session_messages SET timestamp = "
+                "strftime('%Y-%m-%d %H:%M:%f', timestamp) || '000' "
+                "WHERE timestamp NOT GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9] "
+                "[0-9][0-9]:[0-9][0-9]:[0-9][0-9].[0-9][0-9][0-9][0-9][0-9][0-9]'",
+            ],
+        },
+    ),
+    (
+        3,
+        "Version counter on chat_session for history caches",
+        [add_column("chat_session", "version", "INTEGER NOT NULL DEFAULT 0")],
+    ),
+    (
+        4,
+        "Soft-delete markers and indexes for database-side cascades",
+        [
+            add_column("patients", "deleted_at", "VARCHAR"),
+            add_column("cases", "deleted_at", "VARCHAR"),
+            add_column("chat_session", "deleted_at", "VARCHAR"),
+            "CREATE INDEX IF NOT EXISTS ix_patients_deleted_at ON patients (deleted_at)",
+            "CREATE INDEX IF NOT EXISTS ix_cases_deleted_at ON cases (deleted_at)",
+            "CREATE INDEX IF NOT EXISTS ix_chat_session_deleted_at "
+            "ON chat_session (deleted_at)",
+            # ON DELETE CASCADE looks children up by these foreign keys.
+            "CREATE INDEX IF NOT EXISTS ix_cases_patient_id ON cases (patient_id)",
+            "CREATE INDEX IF NOT EXISTS ix_chat_session_patient_id "
+            "ON chat_session (patient_id)",
+            "CREATE INDEX IF NOT EXISTS ix_session_messages_case_id "
+            "ON session_messages (case_id)",
+            "CREATE INDEX IF NOT EXISTS ix_session_messages_patient_id "
+            "ON session_messages (patient_id)",
+        ],
+    ),
+    (
+        5,
+        "Full-text search over session messages",
+        {
+            # search_text is the text parts of content (message_search_text).
+            "postgresql": [
+                add_column("session_messages", "search_text", "TEXT"),
+                "UPDATE session_messages SET search_text = ("
+                "SELECT string_agg(part->>'text', ' ') "
+                "FROM jsonb_array_elements(content::jsonb) AS turn, "
+                "jsonb_array_elements(CASE WHEN jsonb_typeof(turn->'content') = "
+                "'array' THEN turn->'content' ELSE '[]'::jsonb END) AS part "
+                "WHERE part->>'type' = 'text') WHERE search_text IS NULL",
+                "ALTER TABLE session_messages ADD COLUMN IF NOT EXISTS search_vector "
+                "tsvector GENERATED ALWAYS AS "
+                "(to_tsvector('english', coalesce(search_text, ''))) STORED",
+                "CREATE INDEX IF NOT EXISTS ix_session_messages_search_vector "
+                "ON session_messages USING GIN (search_vector)",
+            ],
+            # External-content FTS5 index keyed by session_messages.rowid and
+            # kept in sync by triggers. patient_id and case_id are indexed too
+            # (with "_" kept inside tokens, so an ID is one selective token) so
+            # scoped searches are narrowed inside the index.
+            "sqlite": [
+                add_column("session_messages", "search_text", "TEXT"),
+                "UPDATE session_messages SET search_text = ("
+                "SELECT group_concat(json_extract(part.value, '$.text'), ' ') "
+                "FROM json_each(session_messages.content) AS turn, "
+                "json_each(turn.value, '$.content') AS part "
+                "WHERE CASE WHEN part.type = 'object' "
+                "THEN json_extract(part.value, '$.type') END = 'text') "
+                "WHERE search_text IS NULL",
+                "CREATE VIRTUAL TABLE IF NOT EXISTS session_messages_fts USING fts5("
+                "search_text, patient_id, case_id, content='session_messages', "
+                "content_rowid='rowid', "
+                "tokenize=\"porter unicode61 tokenchars '_'\")",
+                "CREATE TRIGGER IF NOT EXISTS session_messages_fts_insert "
+                "AFTER INSERT ON session_messages BEGIN "
+                "INSERT INTO session_messages_fts (rowid, search_text, patient_id, "
+                "case_id) VALUES (new.rowid, new.search_text, new.patient_id, "
+                "new.case_id); END",
+                "CREATE TRIGGER IF NOT EXISTS session_messages_fts_delete "
+                "AFTER DELETE ON session_messages BEGIN "
+                "INSERT INTO session_messages_fts (session_messages_fts, rowid, "
+                "search_text, patient_id, case_id) VALUES ('delete', old.rowid, "
+                "old.search_text, old.patient_id, old.case_id); END",
+                "CREATE TRIGGER IF NOT EXISTS session_messages_fts_update "
+                "AFTER UPDATE OF search_text, patient_id, case_id "
+                "ON session_messages BEGIN "
+                "INSERT INTO session_messages_fts (session_messages_fts, rowid, "
+                "search_text, patient_id, case_id) VALUES ('delete', old.rowid, "
+                "old.search_text, old.patient_id, old.case_id); "
+                "INSERT INTO session_messages_fts (rowid, search_text, patient_id, "
+                "case_id) VALUES (new.rowid, new.search_text, new.patient_id, "
+                "new.case_id); END",
+                # Also the fix if a VACUUM ever renumbers the implicit rowids.
+                "INSERT INTO session_messages_fts (session_messages_fts) "
+                "VALUES ('rebuild')",
+            ],
+        },
+    ),
+    (
+        6,
+        "Archival of idle sessions",
+        [
+            add_column("chat_session", "archived_at", "VARCHAR"),
+            "CREATE INDEX IF NOT EXISTS ix_chat_session_time_updated "
+            "ON chat_session (time_updated)",
+        ],
+    ),
+    (
+        7,
+        "Analytics rollups of message feedback and safety",
+        {
+            # Mirrors controllers.analytics for the messages stored so far.
+            "postgresql": [
+                add_column("session_messages", "model", "VARCHAR"),
+                "INSERT INTO message_rollups (day, model, case_id, safety_level, "
+                "messages, score_sum, scored, stars_sum, rated, likes, dislikes) "
+                "SELECT to_char(\"timestamp\" AT TIME ZONE 'UTC', 'YYYY-MM-DD'), "
+                "coalesce(model, 'unknown'), case_id, "
+                "coalesce(nullif(safety::jsonb->>'safety_level', ''), 'unknown'), "
+                "count(*), coalesce(sum(CASE WHEN jsonb_typeof(safety::jsonb->'score')"
+                " = 'number' THEN (safety::jsonb->>'score')::float END), 0), "
+                "count(CASE WHEN jsonb_typeof(safety::jsonb->'score') = 'number' "
+                "THEN 1 END), coalesce(sum(CASE WHEN stars > 0 THEN stars END), 0), "
+                "count(CASE WHEN stars > 0 THEN 1 END), "
+                "count(CASE WHEN lower(\"like\") IN ('true', 'like', '1') THEN 1 END), "
+                "count(CASE WHEN lower(\"like\") IN ('false', 'dislike', '0') "
+                "THEN 1 END) "
+                "FROM session_messages GROUP BY 1, 2, 3, 4 ON CONFLICT DO NOTHING",
+            ],
+            "sqlite": [
+                add_column("session_messages", "model", "VARCHAR"),
+                "INSERT INTO message_rollups (day, model, case_id, safety_level, "
+                "messages, score_sum, scored, stars_sum, rated, likes, dislikes) "
+                "SELECT substr(\"timestamp\", 1, 10), coalesce(model, 'unknown'), "
+                "case_id, coalesce(nullif(CAST(json_extract(safety, '$.safety_level')"
+                " AS TEXT), ''), 'unknown'), count(*), "
+                "total(CASE WHEN json_type(safety, '$.score') IN ('integer', 'real') "
+                "THEN json_extract(safety, '$.score') END), "
+                "count(CASE WHEN json_type(safety, '$.score') IN ('integer', 'real') "
+                "THEN 1 END), coalesce(sum(CASE WHEN stars > 0 THEN stars END), 0), "
+                "count(CASE WHEN stars > 0 THEN 1 END), "
+                "count(CASE WHEN lower(\"like\") IN ('true', 'like', '1') THEN 1 END), "
+                "count(CASE WHEN lower(\"like\") IN ('false', 'dislike', '0') "
+                "THEN 1 END) "
+                "FROM session_messages GROUP BY 1, 2, 3, 4 ON CONFLICT DO NOTHING",
+            ],
+        },
+    ),
+    (
+        8,
+        "Message counts and last message on chat_session",
+        {
+            "postgresql": [
+                *SESSION_SUMMARY,
+                "UPDATE chat_session SET last_safety_level = (SELECT "
+                "m.safety::jsonb->>'safety_level' FROM session_messages m "
+                "WHERE m.message_id = chat_session.last_message_id)",
+            ],
+            "sqlite": [
+                *SESSION_SUMMARY,
+                "UPDATE chat_session SET last_safety_level = (SELECT "
+                "CAST(json_extract(m.safety, '$.safety_level') AS TEXT) "
+                "FROM session_messages m "
+                "WHERE m.message_id = chat_session.last_message_id)",
+            ],
+        },
+    ),
+    (
+        9,
+        "Index case tags in case_tags, counted in case_tag_counts",
+        {
+            "postgresql": [
+                *CASE_TAG_INDEXES,
+                "CREATE OR REPLACE FUNCTION case_tag_counts_sync() RETURNS trigger "
+                "AS $$ BEGIN IF TG_OP = 'INSERT' THEN "
+                "INSERT INTO case_tag_counts (tag, cases) VALUES (NEW.tag, 1) "
+                "ON CONFLICT (tag) DO UPDATE SET cases = case_tag_counts.cases + 1; "
+                "RETURN NEW; END IF; "
+                "UPDATE case_tag_counts SET cases = cases - 1 WHERE tag = OLD.tag; "
+                "RETURN OLD; END $$ LANGUAGE plpgsql",
+                "CREATE OR REPLACE TRIGGER case_tags_count AFTER INSERT OR DELETE "
+                "ON case_tags FOR EACH ROW EXECUTE FUNCTION case_tag_counts_sync()",
+                "INSERT INTO case_tags (case_id, tag, patient_id) "
+                "SELECT DISTINCT c.case_id, trim(t.value #>> '{}'), c.patient_id "
+                "FROM cases c CROSS JOIN LATERAL jsonb_array_elements(CASE WHEN "
+                "jsonb_typeof(c.tags::jsonb) = 'array' THEN c.tags::jsonb "
+                "ELSE '[]'::jsonb END) AS t(value) "
+                "WHERE c.deleted_at IS NULL AND jsonb_typeof(t.value) = 'string' "
+                "AND trim(t.value #>> '{}') <> '' ON CONFLICT DO NOTHING",
+            ],
+            "sqlite": [
+                *CASE_TAG_INDEXES,
+                "CREATE TRIGGER IF NOT EXISTS case_tags_count_insert "
+                "AFTER INSERT ON case_tags BEGIN "
+                "INSERT INTO case_tag_counts (tag, cases) VALUES (new.tag, 1) "
+                "ON CONFLICT (tag) DO UPDATE SET cases = cases + 1; END",
+                "CREATE TRIGGER IF NOT EXISTS case_tags_count_delete "
+                "AFTER DELETE ON case_tags BEGIN "
+                "UPDATE case_tag_counts SET cases = cases - 1 WHERE tag = old.tag; "
+                "END",
+                "INSERT OR IGNORE INTO case_tags (case_id, tag, patient_id) "
+                "SELECT DISTINCT c.case_id, trim(j.value), c.patient_id "
+                "FROM cases c, json_each(CASE WHEN json_type(c.tags) = 'array' "
+                "THEN c.tags ELSE '[]' END) j "
+                "WHERE c.deleted_at IS NULL AND j.type = 'text' "
+                "AND trim(j.value) <> ''",
+            ],
+        },
+    ),
+    (
+        10,
+        "Normalized patient names and name search indexes",
+        {
+            "postgresql": [
+                add_column("patients", "name_normalized", 'VARCHAR COLLATE "C"'),
+                backfill_normalized_names,
+                PATIENT_NAME_INDEX["postgresql"],
+                create_trigram_index,
+            ],
+            # External-content FTS5 trigram index of the names, kept in sync by
+            # triggers like session_messages_fts (migration 5).
+            "sqlite": [
+                add_column("patients", "name_normalized", "VARCHAR"),
+                backfill_normalized_names,
+                PATIENT_NAME_INDEX["sqlite"],
+                "CREATE VIRTUAL TABLE IF NOT EXISTS patients_name_fts USING fts5("
+                "name_normalized, content='patients', content_rowid='rowid', "
+                "tokenize='trigram')",
+                "CREATE TRIGGER IF NOT EXISTS patients_name_fts_insert "
+                "AFTER INSERT ON patients BEGIN "
+                "INSERT INTO patients_name_fts (rowid, name_normalized) "
+                "VALUES (new.rowid, new.name_normalized); END",
+                "CREATE TRIGGER IF NOT EXISTS patients_name_fts_delete "
+                "AFTER DELETE ON patients BEGIN "
+                "INSERT INTO patients_name_fts (patients_name_fts, rowid, "
+                "name_normalized) VALUES ('delete', old.rowid, old.name_normalized); "
+                "END",
+                "CREATE TRIGGER IF NOT EXISTS patients_name_fts_update "
+                "AFTER UPDATE OF name_normalized ON patients BEGIN "
+                "INSERT INTO patients_name_fts (patients_name_fts, rowid, "
+                "name_normalized) VALUES ('delete', old.rowid, old.name_normalized); "
+                "INSERT INTO patients_name_fts (rowid, name_normalized) "
+                "VALUES (new.rowid, new.name_normalized); END",
+                "INSERT INTO patients_name_fts (patients_name_fts) VALUES ('rebuild')",
+            ],
+        },
+    ),
+    (
+        11,
+        "Drop the session index covered by the session listing index",
+        [
+            # A prefix of ix_chat_session_case_id_patient_id_time_updated
+            # (migration 8), which serves the same lookups.
+            "DROP INDEX IF EXISTS ix_chat_session_case_id_patient_id",
+        ],
+    ),
+]
+
+
+async def run_migrations(conn: AsyncConnection) -> list:
+    """
+    Apply pending migrations on ``conn`` and record them in ``schema_migrations``.
+
+    Run inside the startup transaction, after ``create_all``.
+
+    Returns:
+        List[int]: Versions applied by this call.
+    """
+    await conn.execute(
+        text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version INTEGER PRIMARY KEY, description VARCHAR, applied_at VARCHAR)"
+        )
+    )
+    applied = set(
+        (await conn.execute(text("SELECT version FROM schema_migrations"))).scalars()
+    )
+    newly_applied = []
+    for version, description, statements in MIGRATIONS:
+        if version in applied:
+            continue
+        if isinstance(statements, dict):
+            statements = statements.get(conn.dialect.name, [])
+        for statement in statements:
+            if callable(statement):
+                await conn.run_sync(statement)
+            else:
+                await conn.execute(text(statement))
+        await conn.execute(
+            text(
+                "INSERT INTO schema_migrations (version, description, applied_at) "
+                "VALUES (:version, :description, :applied_at)"
+            ),
+            {
+                "version": version,
+                "description": description,
+                "applied_at": datetime.datetime.now(datetime.UTC).isoformat(),
+            },
+        )
+        logger.info("Applied migration %s: %s", version, description)
+        newly_applied.append(version)
+    return newly_applied
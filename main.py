@@ -2,6 +2,7 @@ from dotenv import load_dotenv
 
 load_dotenv(".env")
 
+import asyncio
 import os
 from contextlib import asynccontextmanager
 
@@ -10,19 +11,41 @@ from fastapi import FastAPI, Depends
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
-from database.database import Base, engine, DatabaseConnectionError
-from routes import auth, cases, chat, history, patient, user
+from database.database import Base, engine, read_engine, DatabaseConnectionError
+from database.migrations import run_migrations
+from controllers.archive import ARCHIVE_AFTER_DAYS, run_archiver
+from controllers.deletion import purge_deleted
+from controllers.message import message_updates
+from routes import analytics, auth, cases, chat, history, imports, patient, user
 from utils.state import State
+from utils.upload import UploadLimitMiddleware
 
 state = State()
-Base.metadata.create_all(bind=engine)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     state.logger.info("Starting up...")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await run_migrations(conn)
+    message_updates.start()
+    # Finish purges a previous process left behind; the rows stay hidden.
+    tasks = [asyncio.create_task(purge_deleted())]
+    if ARCHIVE_AFTER_DAYS > 0:
+        tasks.append(asyncio.create_task(run_archiver()))
     yield
     state.logger.info("Shutting down...")
+    for task in tasks:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    await message_updates.drain()
+    await engine.dispose()
+    if read_engine is not None:
+        await read_engine.dispose()
 
 
 app = FastAPI(
@@ -34,6 +57,8 @@ app = FastAPI(
 
 origins = os.getenv("ORIGINS")
 
+# Added before CORS so the 413 it returns still carries CORS headers.
+app.add_middleware(UploadLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -49,7 +74,9 @@ logfire.configure(
     environment=os.getenv("ENVIRONMENT", "development"),
 )
 logfire.instrument_fastapi(app, capture_headers=True)
-logfire.instrument_sqlalchemy(engine)
+logfire.instrument_sqlalchemy(engine.sync_engine)
+if read_engine is not None:
+    logfire.instrument_sqlalchemy(read_engine.sync_engine)
 logfire.instrument_httpx()
 logfire.instrument_requests()
 logfire.instrument_system_metrics(base="full")
@@ -57,9 +84,11 @@ logfire.instrument_system_metrics(base="full")
 app.include_router(chat.router, prefix="/api/v1/chat")
 app.include_router(cases.router, prefix="/api/v1/cases")
 app.include_router(history.router, prefix="/api/v1/history")
+app.include_router(imports.router, prefix="/api/v1/imports")
 app.include_router(patient.router, prefix="/api/v1/patient")
 app.include_router(user.router, prefix="/api/v1/users")
 app.include_router(auth.router, prefix="/api/v1/auth")
+app.include_router(analytics.router, prefix="/api/v1/analytics")
 
 
 @app.get("/")
@@ -0,0 +1,27 @@
+from sqlalchemy import Column, Float, Integer, String
+
+from database.database import Base
+
+
+class MessageRollup(Base):
+    """
+    Running feedback and safety totals of AI messages, per day, model, case
+    and safety level. Maintained by ``controllers.analytics``.
+    """
+
+    __tablename__ = "message_rollups"
+
+    # UTC date of the message, YYYY-MM-DD
+    day = Column(String, primary_key=True)
+    model = Column(String, primary_key=True)
+    case_id = Column(String, primary_key=True)
+    safety_level = Column(String, primary_key=True)
+    messages = Column(Integer, nullable=False, default=0)
+    # Sum and count of the numeric safety scores
+    score_sum = Column(Float, nullable=False, default=0)
+    scored = Column(Integer, nullable=False, default=0)
+    # Sum and count of star ratings (0 means unrated)
+    stars_sum = Column(Integer, nullable=False, default=0)
+    rated = Column(Integer, nullable=False, default=0)
+    likes = Column(Integer, nullable=False, default=0)
+    dislikes = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,50 @@
+from sqlalchemy import Column, ForeignKey, Integer, LargeBinary, String
+from sqlalchemy.orm import relationship
+
+from database.database import Base
+
+
+class Attachment(Base):
+    __tablename__ = "attachments"
+
+    # SHA-256 of the uploaded bytes; identical uploads share one row.
+    attachment_id = Column(String, primary_key=True, nullable=False, index=True)
+    filename = Column(String, nullable=True)
+    content_type = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
+    time_created = Column(String, nullable=True)
+
+
+class AttachmentBlob(Base):
+    """Blob storage used by the ``database`` attachment store backend."""
+
+    __tablename__ = "attachment_blobs"
+
+    key = Column(String, primary_key=True, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+
+
+class CaseAttachment(Base):
+    """An attachment uploaded to a case's document library."""
+
+    __tablename__ = "case_attachments"
+
+    case_id = Column(
+        String,
+        ForeignKey("cases.case_id", ondelete="CASCADE"),
+        primary_key=True,
+        nullable=False,
+    )
+    attachment_id = Column(
+        String,
+        ForeignKey("attachments.attachment_id", ondelete="CASCADE"),
+        primary_key=True,
+        nullable=False,
+    )
+    filename = Column(String, nullable=True)
+    # pending -> ready | failed, updated by the background preprocessing task
+    status = Column(String, nullable=False, default="pending")
+    error = Column(String, nullable=True)
+    time_created = Column(String, nullable=True)
+
+    attachment = relationship("Attachment", lazy="joined")
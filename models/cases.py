@@ -1,4 +1,4 @@
-from sqlalchemy import JSON, Column, ForeignKey, String
+from sqlalchemy import JSON, Column, ForeignKey, Index, Integer, String
 from sqlalchemy.orm import relationship
 
 from database.database import Base
@@ -14,6 +14,7 @@ class Case(Base):
         String,
         ForeignKey("patients.patient_id", ondelete="CASCADE"),
         nullable=False,
+        index=True,
     )
     case_name = Column(String, nullable=False)
     description = Column(String, nullable=False)
@@ -21,6 +22,8 @@ class Case(Base):
     time_updated = Column(String, nullable=True)
     tags = Column(JSON, nullable=True)
     priority = Column(String, nullable=True)
+    # Set when a large case is soft-deleted and waiting to be purged.
+    deleted_at = Column(String, nullable=True, index=True)
 
     # Relationship to parent patient
     patient = relationship("Patient", back_populates="cases")
@@ -30,6 +33,7 @@ class Case(Base):
         "ChatSession",
         back_populates="case",
         cascade="all, delete-orphan",
+        passive_deletes=True,
     )
 
     # Also keep messages that reference this case directly
@@ -37,4 +41,40 @@ class Case(Base):
         "SessionMessages",
         back_populates="case",
         cascade="all, delete-orphan",
+        passive_deletes=True,
     )
+
+
+class CaseTag(Base):
+    """
+    One row per tag of a live case, so tag filters and counts use an index
+    instead of reading every ``Case.tags`` array. ``Case.tags`` stays the
+    tag list returned by the API; ``controllers.tags`` keeps both in sync.
+    """
+
+    __tablename__ = "case_tags"
+    __table_args__ = (
+        Index("ix_case_tags_tag_case_id", "tag", "case_id"),
+        Index("ix_case_tags_patient_id_tag", "patient_id", "tag"),
+    )
+
+    case_id = Column(
+        String,
+        ForeignKey("cases.case_id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    tag = Column(String, primary_key=True)
+    # Copied from the case so per-patient counts need no join.
+    patient_id = Column(String, nullable=False)
+
+
+class CaseTagCount(Base):
+    """
+    Number of live cases per tag, maintained by triggers on ``case_tags``
+    (see migration 9) so tag counts over all cases read one row per tag.
+    """
+
+    __tablename__ = "case_tag_counts"
+
+    tag = Column(String, primary_key=True)
+    cases = Column(Integer, nullable=False, default=0, server_default="0")
@@ -0,0 +1,25 @@
+from sqlalchemy import JSON, Column, Integer, String
+
+from database.database import Base
+
+
+class ImportJob(Base):
+    """A bulk import of patients or cases, run by a background task."""
+
+    __tablename__ = "import_jobs"
+
+    job_id = Column(String, primary_key=True, nullable=False)
+    # "patients" or "cases"
+    kind = Column(String, nullable=False)
+    format = Column(String, nullable=False)
+    filename = Column(String, nullable=True)
+    # pending -> running -> done | failed
+    status = Column(String, nullable=False, default="pending")
+    rows_processed = Column(Integer, nullable=False, default=0)
+    rows_inserted = Column(Integer, nullable=False, default=0)
+    rows_failed = Column(Integer, nullable=False, default=0)
+    # First IMPORT_MAX_ERRORS row errors: [{"row": n, "error": "..."}]
+    errors = Column(JSON, nullable=False, default=list)
+    error = Column(String, nullable=True)
+    time_created = Column(String, nullable=True)
+    time_updated = Column(String, nullable=True)
@@ -1,4 +1,4 @@
-from sqlalchemy import Numeric, Column, Integer, String
+from sqlalchemy import Numeric, Column, Index, Integer, String, text
 from sqlalchemy.orm import relationship
 
 from database.database import Base
@@ -6,9 +6,28 @@ from database.database import Base
 
 class Patient(Base):
     __tablename__ = "patients"
+    __table_args__ = (
+        # Name search (controllers.patient_search) on live patients. Postgres
+        # cannot read names in order behind an IS NULL key, and SQLite without
+        # ANALYZE statistics only picks the index over ix_patients_deleted_at
+        # when deleted_at leads it.
+        Index(
+            "ix_patients_name_normalized",
+            "name_normalized",
+            "patient_id",
+            postgresql_where=text("deleted_at IS NULL"),
+        ).ddl_if(dialect="postgresql"),
+        Index(
+            "ix_patients_name_normalized", "deleted_at", "name_normalized", "patient_id"
+        ).ddl_if(dialect="sqlite"),
+    )
 
     patient_id = Column(String, nullable=False, primary_key=True, index=True)
     name = Column(String, nullable=False)
+    # normalize_name(name); byte-ordered on Postgres so prefixes use the index.
+    name_normalized = Column(
+        String().with_variant(String(collation="C"), "postgresql"), nullable=True
+    )
     age = Column(Integer, nullable=True)
     gender = Column(String, nullable=True)
     dob = Column(String, nullable=True)
@@ -17,12 +36,16 @@ class Patient(Base):
     medical_history = Column(String, nullable=True)
     time_created = Column(String, nullable=True)
     time_updated = Column(String, nullable=True)
+    # Set when a large patient is soft-deleted and waiting to be purged.
+    deleted_at = Column(String, nullable=True, index=True)
 
     # One-to-many: Patient -> Case
+    # passive_deletes: ON DELETE CASCADE removes children without loading them.
     cases = relationship(
         "Case",
         back_populates="patient",
         cascade="all, delete-orphan",
+        passive_deletes=True,
     )
 
     # One-to-many: Patient -> SessionMessages (direct messages that reference patient)
@@ -30,4 +53,5 @@ class Patient(Base):
         "SessionMessages",
         back_populates="patient",
         cascade="all, delete-orphan",
+        passive_deletes=True,
     )
@@ -1,4 +1,4 @@
-from sqlalchemy import JSON, Column, ForeignKey, String
+from sqlalchemy import JSON, Column, ForeignKey, Index, Integer, LargeBinary, String
 from sqlalchemy.orm import relationship
 
 from database.database import Base
@@ -8,6 +8,16 @@ from models.patients import Patient
 
 class ChatSession(Base):
     __tablename__ = "chat_session"
+    __table_args__ = (
+        # Session listings page through a case newest first; case and patient
+        # lookups use the same index.
+        Index(
+            "ix_chat_session_case_id_patient_id_time_updated",
+            "case_id",
+            "patient_id",
+            "time_updated",
+        ),
+    )
 
     session_id = Column(String, primary_key=True, nullable=False, index=True)
     title = Column(String)
@@ -20,17 +30,52 @@ class ChatSession(Base):
         String,
         ForeignKey("patients.patient_id", ondelete="CASCADE"),
         nullable=False,
+        index=True,
     )
     time_created = Column(String)
-    time_updated = Column(String)
+    # The archiver looks for sessions idle since before a cutoff.
+    time_updated = Column(String, index=True)
+    # Bumped on every new message; history caches compare it before reuse.
+    version = Column(Integer, nullable=False, default=0, server_default="0")
+    # Set when a large session is soft-deleted and waiting to be purged.
+    deleted_at = Column(String, nullable=True, index=True)
+    # Set while the messages live compressed in session_archives.
+    archived_at = Column(String, nullable=True)
+    # Summary of the messages, kept up to date by add_ai_response.
+    message_count = Column(Integer, nullable=False, default=0, server_default="0")
+    last_message_id = Column(String, nullable=True)
+    last_safety_level = Column(String, nullable=True)
 
-    # Relationship with cascade delete (ORM-level)
+    # Messages are removed by ON DELETE CASCADE, not loaded and deleted here
     messages = relationship(
         "SessionMessages",
         back_populates="session",
         cascade="all, delete-orphan",
+        passive_deletes=True,
     )
 
     # Relationship back to Case and Patient
     case = relationship("Case", back_populates="chat_sessions")
     patient = relationship("Patient")
+
+
+class SessionArchive(Base):
+    """Messages of an idle session, moved out of session_messages.
+
+    ``data`` is zlib-compressed JSON Lines, one message row per line in
+    timestamp order. See ``controllers/archive.py``.
+    """
+
+    __tablename__ = "session_archives"
+
+    session_id = Column(
+        String,
+        ForeignKey("chat_session.session_id", ondelete="CASCADE"),
+        primary_key=True,
+        nullable=False,
+    )
+    data = Column(LargeBinary, nullable=False)
+    message_count = Column(Integer, nullable=False)
+    # Size of the uncompressed JSON Lines, for the compression ratio
+    raw_size = Column(Integer, nullable=False)
+    archived_at = Column(String, nullable=False)
@@ -1,4 +1,14 @@
-from sqlalchemy import JSON, Column, ForeignKey, String, Boolean, Integer
+from sqlalchemy import (
+    JSON,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    String,
+    Boolean,
+    Integer,
+    Text,
+)
 from sqlalchemy.orm import relationship
 import datetime
 from database.database import Base
@@ -9,6 +19,10 @@ from models.session import ChatSession
 
 class SessionMessages(Base):
     __tablename__ = "session_messages"
+    __table_args__ = (
+        # get_chat_history loads a session's messages on every chat turn
+        Index("ix_session_messages_session_id_timestamp", "session_id", "timestamp"),
+    )
 
     message_id = Column(String, primary_key=True, nullable=False, index=True)
     session_id = Column(
@@ -20,18 +34,28 @@ class SessionMessages(Base):
         String,
         ForeignKey("cases.case_id", ondelete="CASCADE"),
         nullable=False,
+        index=True,
     )
     patient_id = Column(
         String,
         ForeignKey("patients.patient_id", ondelete="CASCADE"),
         nullable=False,
+        index=True,
     )
     feedback = Column(String, default=None)
     like = Column(String, default=None)
     stars = Column(Integer, default=0)
     content = Column(JSON, nullable=False)
+    # Text parts of content; indexed for full-text search (migration 5).
+    search_text = Column(Text, nullable=True)
     safety = Column(JSON, nullable=False)
-    timestamp = Column(String, nullable=False, default=f"{datetime.datetime.utcnow()}")
+    # Model that generated the response; NULL for messages stored before it was kept.
+    model = Column(String, nullable=True)
+    timestamp = Column(
+        DateTime(timezone=True),
+        nullable=False,
+        default=lambda: datetime.datetime.now(datetime.UTC),
+    )
 
     # Relationships back to parents
     session = relationship("ChatSession", back_populates="messages")
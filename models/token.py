@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, String
+from sqlalchemy import Boolean, Column, ForeignKey, Index, String
 from sqlalchemy.orm import relationship
 
 from database.database import Base, engine
@@ -7,6 +7,15 @@ from models.user import User
 
 class Token(Base):
     __tablename__ = "tokens"
+    __table_args__ = (
+        # token_required looks up the caller's token on every authenticated request
+        Index(
+            "ix_tokens_user_id_access_token_status",
+            "user_id",
+            "access_token",
+            "status",
+        ),
+    )
 
     token_id = Column(String, nullable=False, primary_key=True, index=True)
     # Add ondelete cascade so DB can clean rows if foreign key supported; keep manual delete fallback.
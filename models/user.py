@@ -9,7 +9,7 @@ class User(Base):
 
     user_id = Column(String, nullable=False, primary_key=True, index=True)
     name = Column(String, nullable=True)
-    email = Column(String, nullable=False)
+    email = Column(String, nullable=False, index=True)
     password = Column(String, nullable=False)
     phone = Column(String, nullable=True)
     role = Column(String, nullable=False)
@@ -0,0 +1,61 @@
+import datetime
+from typing import List
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from controllers.analytics import ROLLUP_GROUPS, get_rollups
+from controllers.auth import JWTBearer, token_required
+from database.database import get_read_db
+from utils.state import State
+
+router = APIRouter()
+
+
+@router.get(
+    "/messages",
+    description="Feedback and safety statistics of AI messages, read from rollups "
+    "that are append-only history: a message counts from when it is generated, "
+    "and deleting its session, case or patient does not remove it from them.",
+)
+@token_required
+async def get_message_analytics(
+    group_by: List[str] = Query(
+        ["model"], description=f"Group by any of: {', '.join(ROLLUP_GROUPS)}"
+    ),
+    model: str = Query(None, description="Only messages of this model"),
+    case_id: str = Query(None, description="Only messages of this case"),
+    since: datetime.date = Query(None, description="First day (YYYY-MM-DD, UTC)"),
+    until: datetime.date = Query(None, description="Last day (YYYY-MM-DD, UTC)"),
+    dependencies=Depends(JWTBearer()),
+    db=Depends(get_read_db),
+):
+    try:
+        unknown = [group for group in group_by if group not in ROLLUP_GROUPS]
+        if unknown:
+            State.logger.error(f"Invalid analytics grouping: {', '.join(unknown)}")
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid group_by. Allowed values are: {', '.join(ROLLUP_GROUPS)}.",
+            )
+        if since and until and since > until:
+            State.logger.error(f"Invalid analytics range: {since} is after {until}")
+            raise HTTPException(
+                status_code=422, detail="since must not be after until."
+            )
+        groups = await get_rollups(
+            db,
+            list(dict.fromkeys(group_by)),
+            model=model,
+            case_id=case_id,
+            since=since and since.isoformat(),
+            until=until and until.isoformat(),
+        )
+        return {"groups": groups}
+    except HTTPException:
+        raise
+    except Exception as e:
+        State.logger.error(f"An error occured while fetching analytics: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occured while fetching analytics: {str(e)}",
+        )
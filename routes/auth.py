@@ -1,7 +1,7 @@
 import datetime
 
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import desc, or_
+from sqlalchemy import desc, or_, select
 from uuid import uuid4
 from controllers.auth import (
     JWTBearer,
@@ -10,7 +10,7 @@ from controllers.auth import (
     decodeJWT,
     token_required,
 )
-from database.database import get_db
+from database.database import get_db, read_router
 from models.token import Token
 from models.user import User
 from utils.token import get_hashed_password, verify_password
@@ -26,10 +26,10 @@ async def register_user(
     db=Depends(get_db),
 ):
     try:
-        user = (
-            db.query(User)
-            .filter(or_(User.user_id == req.user_id, User.email == req.email))
-            .first()
+        user = await db.scalar(
+            select(User)
+            .where(or_(User.user_id == req.user_id, User.email == req.email))
+            .limit(1)
         )
         if user:
             State.logger.error("User with email already exists")
@@ -47,8 +47,8 @@ async def register_user(
             time_updated=datetime.datetime.now(datetime.UTC).isoformat(),
         )
         db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
+        await db.commit()
+        await db.refresh(new_user)
         return {"message": "User created successfully"}
     except HTTPException:
         raise
@@ -65,7 +65,7 @@ async def login_user(
     db=Depends(get_db),
 ):
     try:
-        user = db.query(User).filter(User.email == req.email).first()
+        user = await db.scalar(select(User).where(User.email == req.email).limit(1))
         if not user or not verify_password(req.password, user.password):
             State.logger.error("Invalid credentials")
             raise HTTPException(status_code=401, detail="Invalid credentials")
@@ -73,18 +73,18 @@ async def login_user(
         refresh_token = create_refresh_token(subject=user.user_id)
 
         # Logout of previous session
-        token = (
-            db.query(Token)
+        token = await db.scalar(
+            select(Token)
             .filter_by(user_id=user.user_id, status=True)
             .order_by(desc(Token.time_created))
-            .first()
+            .limit(1)
         )
         if token:
             token.status = False
             token.time_updated = datetime.datetime.now(datetime.UTC).isoformat()
             db.add(token)
-            db.commit()
-            db.refresh(token)
+            await db.commit()
+            await db.refresh(token)
 
         new_token = Token(
             token_id=str(uuid4()),
@@ -96,8 +96,10 @@ async def login_user(
             time_updated=datetime.datetime.now(datetime.UTC).isoformat(),
         )
         db.add(new_token)
-        db.commit()
-        db.refresh(new_token)
+        await db.commit()
+        await db.refresh(new_token)
+        # The new token must be found by the next read, replica or not.
+        read_router.note_write(user.user_id)
         return {
             "access_token": access_token,
             "refresh_token": refresh_token,
@@ -119,23 +121,24 @@ async def relogin_user(req: RefreshRequest, db=Depends(get_db)):
             State.logger.error("Invalid refresh token")
             raise HTTPException(status_code=401, detail="Invalid refresh token")
         user_id = payload["sub"]
-        user = db.query(User).filter(User.user_id == user_id).first()
+        user = await db.scalar(select(User).where(User.user_id == user_id))
         if not user:
             State.logger.error("User not found")
             raise HTTPException(status_code=404, detail="User not found")
         new_access_token = create_access_token(subject=user.__dict__)
-        token = (
-            db.query(Token)
+        token = await db.scalar(
+            select(Token)
             .filter_by(user_id=user_id, refresh_token=req.refresh_token, status=True)
             .order_by(desc(Token.time_created))
-            .first()
+            .limit(1)
         )
         if token:
             token.access_token = new_access_token
             token.time_updated = datetime.datetime.now(datetime.UTC).isoformat()
             db.add(token)
-            db.commit()
-            db.refresh(token)
+            await db.commit()
+            await db.refresh(token)
+        read_router.note_write(user_id)
         return {
             "access_token": new_access_token,
             "refresh_token": req.refresh_token,
@@ -160,25 +163,26 @@ async def refresh_token(
             State.logger.error("Invalid refresh token")
             raise HTTPException(status_code=401, detail="Invalid refresh token")
         user_id = payload["sub"]
-        user = db.query(User).filter(User.user_id == user_id).first()
+        user = await db.scalar(select(User).where(User.user_id == user_id))
         if not user:
             State.logger.error("User not found")
             raise HTTPException(status_code=404, detail="User not found")
         new_access_token = create_access_token(subject=user.__dict__)
         new_refresh_token = create_refresh_token(subject=user.user_id)
-        token = (
-            db.query(Token)
+        token = await db.scalar(
+            select(Token)
             .filter_by(user_id=user_id, refresh_token=req.refresh_token, status=True)
             .order_by(desc(Token.time_created))
-            .first()
+            .limit(1)
         )
         if token:
             token.access_token = new_access_token
             token.refresh_token = new_refresh_token
             token.time_updated = datetime.datetime.now(datetime.UTC).isoformat()
             db.add(token)
-            db.commit()
-            db.refresh(token)
+            await db.commit()
+            await db.refresh(token)
+        read_router.note_write(user_id)
         return {
             "access_token": new_access_token,
             "refresh_token": new_refresh_token,
@@ -200,22 +204,22 @@ async def logout_user(
 ):
     try:
         user_id = decodeJWT(dependencies)["sub"]
-        user = db.query(User).filter(User.user_id == user_id).first()
+        user = await db.scalar(select(User).where(User.user_id == user_id))
         if not user:
             State.logger.error("User not found")
             raise HTTPException(status_code=404, detail="User not found")
-        token = (
-            db.query(Token)
+        token = await db.scalar(
+            select(Token)
             .filter_by(user_id=user_id, access_token=dependencies, status=True)
             .order_by(desc(Token.time_created))
-            .first()
+            .limit(1)
         )
         if token:
             token.status = False
             token.time_updated = datetime.datetime.now(datetime.UTC).isoformat()
             db.add(token)
-            db.commit()
-            db.refresh(token)
+            await db.commit()
+            await db.refresh(token)
         return {"message": "User logged out successfully"}
     except HTTPException:
         raise
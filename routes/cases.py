@@ -1,25 +1,84 @@
 import datetime
 from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    File,
+    HTTPException,
+    Query,
+    UploadFile,
+)
+from sqlalchemy import select
+
+from controllers.attachment import (
+    ALLOWED_CONTENT_TYPES,
+    ingest_attachment,
+    process_case_attachment,
+)
 from controllers.auth import JWTBearer, decodeJWT, token_required
-from database.database import get_db
+from controllers.deletion import delete_case_rows, purge_deleted
+from controllers.message import history_cache
+from controllers.tags import (
+    DEFAULT_TAG_LIMIT,
+    count_tags,
+    normalize_tags,
+    set_case_tags,
+    tagged_with,
+)
+from database.database import get_db, get_read_db
+from models.attachment import CaseAttachment
 from models.cases import Case
 from models.patients import Patient
+from utils.pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    keyset_page,
+    select_fields,
+)
 from utils.state import State
+from utils.upload import UploadBudget, UploadRoute
+
+router = APIRouter(route_class=UploadRoute)
 
-router = APIRouter()
+CASE_FIELDS = [column.key for column in Case.__table__.columns]
 
 
 @router.get("/")
 @token_required
 async def get_cases(
+    patient_id: str = Query(None, description="Only cases of this patient"),
+    priority: str = Query(None, description="Only cases with this priority"),
+    tag: List[str] = Query([], description="Only cases carrying all of these tags"),
+    fields: str = Query(
+        None, description=f"Comma-separated fields to return: {', '.join(CASE_FIELDS)}"
+    ),
+    limit: int = Query(
+        DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Page size"
+    ),
+    after: str = Query(None, description="Cursor: `next_after` of the previous page"),
     dependencies=Depends(JWTBearer()),
-    db=Depends(get_db),
+    db=Depends(get_read_db),
 ):
     try:
-        cases = db.query(Case).all()
-        return {"cases": [case.__dict__ for case in cases]}
+        key, filters = tagged_with(tag)
+        filters.append(Case.deleted_at.is_(None))
+        if patient_id:
+            filters.append(Case.patient_id == patient_id)
+        if priority:
+            filters.append(Case.priority == priority)
+        cases, next_after = await keyset_page(
+            db,
+            select_fields(Case, fields, CASE_FIELDS, key="case_id"),
+            key=key,
+            filters=filters,
+            limit=limit,
+            after=after,
+        )
+        return {"cases": cases, "next_after": next_after}
+    except HTTPException:
+        raise
     except Exception as e:
         State.logger.error(f"An error occured while fetching all cases: {str(e)}")
         raise HTTPException(
@@ -28,15 +87,38 @@ async def get_cases(
         )
 
 
+@router.get("/tags")
+@token_required
+async def get_case_tags(
+    patient_id: str = Query(None, description="Only cases of this patient"),
+    tag: List[str] = Query([], description="Only cases carrying all of these tags"),
+    limit: int = Query(
+        DEFAULT_TAG_LIMIT, ge=1, le=MAX_PAGE_SIZE, description="Number of tags"
+    ),
+    dependencies=Depends(JWTBearer()),
+    db=Depends(get_read_db),
+):
+    try:
+        return {"tags": await count_tags(db, patient_id, tag, limit)}
+    except Exception as e:
+        State.logger.error(f"An error occured while counting case tags: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occured while counting case tags: {str(e)}",
+        )
+
+
 @router.get("/{case_id}")
 @token_required
 async def get_case(
     case_id: str,
     dependencies=Depends(JWTBearer()),
-    db=Depends(get_db),
+    db=Depends(get_read_db),
 ):
     try:
-        case = db.query(Case).filter(Case.case_id == case_id).first()
+        case = await db.scalar(
+            select(Case).where(Case.case_id == case_id, Case.deleted_at.is_(None))
+        )
         if not case:
             State.logger.error(f"Case with ID {case_id} not found")
             raise HTTPException(status_code=404, detail="Case not found")
@@ -63,11 +145,15 @@ async def create_case(
     db=Depends(get_db),
 ):
     try:
-        patient = db.query(Patient).filter(Patient.patient_id == patient_id).first()
+        patient = await db.scalar(
+            select(Patient).where(
+                Patient.patient_id == patient_id, Patient.deleted_at.is_(None)
+            )
+        )
         if not patient:
             State.logger.error(f"Patient with ID {patient_id} not found")
             raise HTTPException(status_code=404, detail="Patient not found")
-        existing_case = db.query(Case).filter(Case.case_id == case_id).first()
+        existing_case = await db.scalar(select(Case).where(Case.case_id == case_id))
         if existing_case:
             State.logger.error(f"Case with ID {case_id} already exists")
             raise HTTPException(status_code=400, detail="Case ID already exists")
@@ -78,12 +164,14 @@ async def create_case(
             description=description,
             time_created=datetime.datetime.now(datetime.UTC).isoformat(),
             time_updated=datetime.datetime.now(datetime.UTC).isoformat(),
-            tags=tags,
+            tags=normalize_tags(tags),
             priority=priority,
         )
         db.add(new_case)
-        db.commit()
-        db.refresh(new_case)
+        await db.flush()
+        await set_case_tags(db, case_id, patient_id, new_case.tags)
+        await db.commit()
+        await db.refresh(new_case)
         return {"case": new_case.__dict__}
     except HTTPException:
         raise
@@ -107,7 +195,9 @@ async def update_case(
     db=Depends(get_db),
 ):
     try:
-        case = db.query(Case).filter(Case.case_id == case_id).first()
+        case = await db.scalar(
+            select(Case).where(Case.case_id == case_id, Case.deleted_at.is_(None))
+        )
         if not case:
             State.logger.error(f"Case with ID {case_id} not found")
             raise HTTPException(status_code=404, detail="Case not found")
@@ -116,12 +206,13 @@ async def update_case(
         if description:
             case.description = description
         if tags is not None:
-            case.tags = tags
+            case.tags = normalize_tags(tags)
+            await set_case_tags(db, case_id, case.patient_id, case.tags)
         if priority:
             case.priority = priority
         case.time_updated = datetime.datetime.now(datetime.UTC).isoformat()
-        db.commit()
-        db.refresh(case)
+        await db.commit()
+        await db.refresh(case)
         return {"case": case.__dict__}
     except HTTPException:
         raise
@@ -136,16 +227,18 @@ async def update_case(
 @token_required
 async def delete_case(
     case_id: str,
+    background_tasks: BackgroundTasks,
     dependencies=Depends(JWTBearer()),
     db=Depends(get_db),
 ):
     try:
-        case = db.query(Case).filter(Case.case_id == case_id).first()
-        if not case:
+        deleted = await delete_case_rows(case_id, db)
+        if not deleted:
             State.logger.error(f"Case with ID {case_id} not found")
             raise HTTPException(status_code=404, detail="Case not found")
-        db.delete(case)
-        db.commit()
+        if deleted == "scheduled":
+            background_tasks.add_task(purge_deleted)
+        history_cache.discard_where(case_id=case_id)
         return {"detail": "Case deleted successfully"}
     except HTTPException:
         raise
@@ -154,3 +247,158 @@ async def delete_case(
         raise HTTPException(
             status_code=500, detail=f"An error occured while deleting case: {str(e)}"
         )
+
+
+def _case_attachment_dict(entry: CaseAttachment) -> dict:
+    return {
+        "attachment_id": entry.attachment_id,
+        "case_id": entry.case_id,
+        "filename": entry.filename,
+        "content_type": entry.attachment.content_type,
+        "size": entry.attachment.size,
+        "status": entry.status,
+        "error": entry.error,
+        "time_created": entry.time_created,
+    }
+
+
+async def _require_live_case(case_id: str, db):
+    """Raise 404 unless the case exists and is not soft-deleted."""
+    found = await db.scalar(
+        select(Case.case_id).where(Case.case_id == case_id, Case.deleted_at.is_(None))
+    )
+    if not found:
+        State.logger.error(f"Case with ID {case_id} not found")
+        raise HTTPException(status_code=404, detail="Case not found")
+
+
+@router.post("/{case_id}/attachments")
+@token_required
+async def upload_case_attachments(
+    case_id: str,
+    background_tasks: BackgroundTasks,
+    files: List[UploadFile] = File(..., description="Image or PDF files"),
+    dependencies=Depends(JWTBearer()),
+    db=Depends(get_db),
+):
+    try:
+        await _require_live_case(case_id, db)
+        if not all(file.content_type in ALLOWED_CONTENT_TYPES for file in files):
+            State.logger.error("Invalid file type")
+            raise HTTPException(
+                status_code=400,
+                detail="Invalid file type. Allowed types are: JPEG, PNG, PDF.",
+            )
+        entries = []
+        budget = UploadBudget()
+        for file in files:
+            attachment = await ingest_attachment(file, db, budget)
+            entry = await db.get(CaseAttachment, (case_id, attachment.attachment_id))
+            if not entry:
+                entry = CaseAttachment(
+                    case_id=case_id,
+                    attachment_id=attachment.attachment_id,
+                    filename=file.filename,
+                    status="pending",
+                    time_created=datetime.datetime.now(datetime.UTC).isoformat(),
+                )
+                db.add(entry)
+                await db.commit()
+                await db.refresh(entry)
+            if entry.status != "ready":
+                background_tasks.add_task(
+                    process_case_attachment, case_id, attachment.attachment_id
+                )
+            entries.append(entry)
+        return {"attachments": [_case_attachment_dict(entry) for entry in entries]}
+    except HTTPException:
+        raise
+    except Exception as e:
+        State.logger.error(f"An error occured while uploading attachments: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occured while uploading attachments: {str(e)}",
+        )
+
+
+@router.get("/{case_id}/attachments")
+@token_required
+async def get_case_attachments(
+    case_id: str,
+    dependencies=Depends(JWTBearer()),
+    db=Depends(get_read_db),
+):
+    try:
+        await _require_live_case(case_id, db)
+        entries = (
+            await db.scalars(
+                select(CaseAttachment).where(CaseAttachment.case_id == case_id)
+            )
+        ).all()
+        return {"attachments": [_case_attachment_dict(entry) for entry in entries]}
+    except HTTPException:
+        raise
+    except Exception as e:
+        State.logger.error(f"An error occured while fetching attachments: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occured while fetching attachments: {str(e)}",
+        )
+
+
+@router.get("/{case_id}/attachments/{attachment_id}")
+@token_required
+async def get_case_attachment(
+    case_id: str,
+    attachment_id: str,
+    dependencies=Depends(JWTBearer()),
+    db=Depends(get_read_db),
+):
+    try:
+        await _require_live_case(case_id, db)
+        entry = await db.get(CaseAttachment, (case_id, attachment_id))
+        if not entry:
+            State.logger.error(
+                f"Attachment {attachment_id} not found for case {case_id}"
+            )
+            raise HTTPException(status_code=404, detail="Attachment not found")
+        return {"attachment": _case_attachment_dict(entry)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        State.logger.error(f"An error occured while fetching attachment: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occured while fetching attachment: {str(e)}",
+        )
+
+
+@router.delete("/{case_id}/attachments/{attachment_id}")
+@token_required
+async def delete_case_attachment(
+    case_id: str,
+    attachment_id: str,
+    dependencies=Depends(JWTBearer()),
+    db=Depends(get_db),
+):
+    try:
+        await _require_live_case(case_id, db)
+        entry = await db.get(CaseAttachment, (case_id, attachment_id))
+        if not entry:
+            State.logger.error(
+                f"Attachment {attachment_id} not found for case {case_id}"
+            )
+            raise HTTPException(status_code=404, detail="Attachment not found")
+        # Only the library entry is removed; the content-addressed blob may be
+        # shared with other cases or referenced by stored messages.
+        await db.delete(entry)
+        await db.commit()
+        return {"detail": "Attachment deleted successfully"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        State.logger.error(f"An error occured while deleting attachment: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occured while deleting attachment: {str(e)}",
+        )
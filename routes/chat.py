@@ -2,25 +2,33 @@ import os
 from typing import List
 
 from fastapi import APIRouter, Depends, File, HTTPException, Query, UploadFile
+from sqlalchemy import select
+from starlette.concurrency import run_in_threadpool
 
 from controllers.generate_response import generate_response
 from controllers.safety_score import generate_safety_score
 from database.database import get_db
-from utils.file_processor import convert_image_to_base64, convert_pdf_to_images
+from controllers.attachment import (
+    ALLOWED_CONTENT_TYPES,
+    get_case_attachments,
+    get_processed_attachment,
+    ingest_attachment,
+)
 from controllers.message import (
     add_ai_response,
     edit_feedback,
-    get_chat_history,
+    get_chat_memory,
     like_ai_message,
     submit_feedback,
 )
+from utils.upload import UploadBudget, UploadRoute
 from models.cases import Case
 from models.patients import Patient
 from utils.state import State
 from controllers.auth import token_required, JWTBearer
 from utils.state import State
 
-router = APIRouter()
+router = APIRouter(route_class=UploadRoute)
 
 
 @router.post("/")
@@ -42,45 +50,70 @@ async def predict(
     max_tokens: int = Query(1024, description="Maximum number of tokens to generate"),
     debug: bool = Query(os.getenv("DEBUG") == "1", description="Enable debug mode"),
     files: List[UploadFile] = File(None, description="Image files"),
+    attachment_ids: List[str] = Query(
+        None, description="IDs of attachments already uploaded to the case library"
+    ),
     dependencies=Depends(JWTBearer()),
     db=Depends(get_db),  # Dependency injection for database session
 ):
     try:
-        case = db.query(Case).filter(Case.case_id == case_id).first()
+        case = await db.scalar(
+            select(Case).where(Case.case_id == case_id, Case.deleted_at.is_(None))
+        )
         if not case:
             State.logger.error(f"Case with ID {case_id} not found")
             raise HTTPException(status_code=404, detail="Case not found")
-        patient = db.query(Patient).filter(Patient.patient_id == patient_id).first()
+        patient = await db.scalar(
+            select(Patient).where(
+                Patient.patient_id == patient_id, Patient.deleted_at.is_(None)
+            )
+        )
         if not patient:
             State.logger.error(f"Patient with ID {patient_id} not found")
             raise HTTPException(status_code=404, detail="Patient not found")
-        image_base64s = []
+        attachments = []
+        if attachment_ids:
+            for entry in await get_case_attachments(case_id, attachment_ids, db):
+                attachments.append((entry.attachment, entry.filename))
         if files:
-            if not all(
-                file.content_type in ["image/jpeg", "image/png", "application/pdf"]
-                for file in files
-            ):
+            if not all(file.content_type in ALLOWED_CONTENT_TYPES for file in files):
                 State.logger.error("Invalid file type")
                 raise HTTPException(
                     status_code=400,
                     detail="Invalid file type. Allowed types are: JPEG, PNG, PDF.",
                 )
-            if files[0].content_type.startswith("image/"):
-                for image in files:
-                    img = await convert_image_to_base64(image)
-                    image_base64s.append(img)
-            elif files[0].content_type.startswith("application/pdf"):
-                for pdf in files:
-                    imgs = await convert_pdf_to_images(pdf)
-                    image_base64s.extend(imgs)
+            budget = UploadBudget()
+            for file in files:
+                attachments.append(
+                    (await ingest_attachment(file, db, budget), file.filename)
+                )
+
+        image_refs = []
+        document_texts = []
+        for attachment, filename in attachments:
+            processed = await get_processed_attachment(attachment, db)
+            image_refs.extend(
+                {"attachment_id": attachment.attachment_id, "index": index}
+                for index in range(len(processed["images"]))
+            )
+            document_texts.extend(
+                f'<document name="{filename}">\n{text}\n</document>'
+                for text in processed["text"]
+            )
+        if attachments:
+            # Persist any newly cached preprocessing before the model call.
+            await db.commit()
+        if document_texts:
+            prompt = "\n\n".join([prompt, *document_texts])
 
-        history = get_chat_history(session_id, db)
-        memory = [content for msg in history for content in msg["content"]]
-        response, messages = generate_response(
+        memory = await get_chat_memory(session_id, db)
+        # Model calls block, so keep them off the event loop.
+        response, messages = await run_in_threadpool(
+            generate_response,
             model=model,
             model_provider=model_provider,
             tokenizer=State.tokenizer,
-            images=image_base64s,
+            images=image_refs,
             prompt=prompt,
             temperature=temperature,
             top_p=top_p,
@@ -88,15 +121,18 @@ async def predict(
             memory=memory,
             debug=debug,
         )
-        safety_score = generate_safety_score(response, debug=debug)
-        new_message = add_ai_response(
+        safety_score = await run_in_threadpool(
+            generate_safety_score, response, debug=debug
+        )
+        new_message = await add_ai_response(
             case_id=case_id,
             patient_id=patient_id,
             session_id=session_id,
             content=messages,
             safety=safety_score,
-            history=history,
+            history=[],
             db=db,
+            model=model,
         )
         return {**new_message.__dict__}
     except HTTPException:
@@ -118,7 +154,7 @@ async def like_ai_message_(
     db=Depends(get_db),
 ):
     try:
-        res = like_ai_message(message_id=message_id, like=like, db=db)
+        res = await like_ai_message(message_id=message_id, like=like, db=db)
         if res:
             return res
         return {"detail": "Message not found"}
@@ -132,6 +168,32 @@ async def like_ai_message_(
         )
 
 
+@router.post("/submit-feedback/{message_id}")
+@token_required
+async def submit_feedback_(
+    message_id: str,
+    feedback: str = Query(None, description="Feedback text"),
+    stars: int = Query(None, ge=1, le=5, description="Star rating from 1 to 5"),
+    dependencies=Depends(JWTBearer()),
+    db=Depends(get_db),
+):
+    try:
+        res = await submit_feedback(
+            message_id=message_id, feedback=feedback, stars=stars, db=db
+        )
+        if res:
+            return res
+        return {"detail": "Message not found"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        State.logger.error(f"An error occured while submitting feedback: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occured while submitting feedback: {str(e)}",
+        )
+
+
 @router.put("/edit-feedback/{message_id}")
 @token_required
 async def edit_feedback_(
@@ -142,7 +204,7 @@ async def edit_feedback_(
     db=Depends(get_db),
 ):
     try:
-        res = edit_feedback(
+        res = await edit_feedback(
             message_id=message_id, feedback=feedback, stars=stars, db=db
         )
         if res:
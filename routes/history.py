@@ -1,6 +1,7 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query
 
-from database.database import get_db
+from database.database import get_db, get_read_db
+from utils.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 from models.session_message import SessionMessages
 from models.session import ChatSession
 from controllers.message import (
@@ -9,6 +10,7 @@ from controllers.message import (
     edit_session,
     list_sessions_for_case,
     delete_session,
+    search_messages,
 )
 from utils.state import State
 from controllers.auth import token_required, JWTBearer
@@ -20,12 +22,39 @@ router = APIRouter()
 @token_required
 async def get_session_messages(
     session_id: str,
+    limit: int = Query(
+        None,
+        ge=1,
+        le=MAX_PAGE_SIZE,
+        description="Maximum number of (most recent) messages to return.",
+    ),
+    before: str = Query(
+        None, description="Message ID; only return messages older than this one."
+    ),
+    newest_first: bool = Query(False, description="Return the newest message first."),
     dependencies=Depends(JWTBearer()),
-    db=Depends(get_db),
+    db=Depends(get_read_db),
 ):
     try:
-        conversations = get_chat_history(session_id, db=db)
-        return {"conversations": conversations}
+        # Read one message past the page to know whether an older page exists.
+        conversations = await get_chat_history(
+            session_id,
+            db=db,
+            limit=limit + 1 if limit else None,
+            before=before,
+            newest_first=newest_first,
+        )
+        next_before = None
+        if limit and len(conversations) > limit:
+            if newest_first:
+                conversations = conversations[:limit]
+                next_before = conversations[-1]["message_id"]
+            else:
+                conversations = conversations[1:]
+                next_before = conversations[0]["message_id"]
+        return {"conversations": conversations, "next_before": next_before}
+    except HTTPException:
+        raise
     except Exception as e:
         State.logger.error(f"An error occured while fetching history: {str(e)}")
         raise HTTPException(
@@ -33,6 +62,39 @@ async def get_session_messages(
         )
 
 
+@router.get("/search")
+@token_required
+async def search_session_messages(
+    q: str = Query(..., min_length=1, description="Words to search for."),
+    patient_id: str = Query(None, description="Only messages of this patient."),
+    case_id: str = Query(None, description="Only messages of this case."),
+    limit: int = Query(20, ge=1, le=100, description="Page size."),
+    offset: int = Query(
+        0, ge=0, le=MAX_PAGE_SIZE, description="`next_offset` of the previous page."
+    ),
+    dependencies=Depends(JWTBearer()),
+    db=Depends(get_read_db),
+):
+    try:
+        if not patient_id and not case_id:
+            State.logger.error("Message search without a patient or case")
+            raise HTTPException(
+                status_code=400, detail="Provide a patient_id or case_id to search"
+            )
+        results, next_offset = await search_messages(
+            q, db, patient_id=patient_id, case_id=case_id, limit=limit, offset=offset
+        )
+        return {"results": results, "next_offset": next_offset}
+    except HTTPException:
+        raise
+    except Exception as e:
+        State.logger.error(f"An error occured while searching messages: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occured while searching messages: {str(e)}",
+        )
+
+
 @router.post("/sessions")
 @token_required
 async def create_session_(
@@ -44,7 +106,7 @@ async def create_session_(
     db=Depends(get_db),
 ):
     try:
-        session_id = create_session(
+        session_id = await create_session(
             session_id=session_id,
             case_id=case_id,
             patient_id=patient_id,
@@ -70,7 +132,9 @@ async def edit_session_title(
     db=Depends(get_db),
 ):
     try:
-        updated_session_id = edit_session(session_id=session_id, title=title, db=db)
+        updated_session_id = await edit_session(
+            session_id=session_id, title=title, db=db
+        )
         return {
             "detail": f"Session {updated_session_id} updated successfully",
         }
@@ -86,12 +150,31 @@ async def edit_session_title(
 async def get_sessions_for_case(
     case_id: str = Query(..., description="Case id for fetching session."),
     patient_id: str = Query(..., description="Patient id for fetching session."),
+    limit: int = Query(
+        DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Page size"
+    ),
+    before: str = Query(
+        None, description="Session ID: `next_before` of the previous page"
+    ),
     dependencies=Depends(JWTBearer()),
-    db=Depends(get_db),
+    db=Depends(get_read_db),
 ):
     try:
-        sessions = list_sessions_for_case(case_id=case_id, patient_id=patient_id, db=db)
-        return {"sessions": sessions}
+        # Read one session past the page to know whether another page exists.
+        sessions = await list_sessions_for_case(
+            case_id=case_id,
+            patient_id=patient_id,
+            db=db,
+            limit=limit + 1,
+            before=before,
+        )
+        next_before = None
+        if len(sessions) > limit:
+            sessions = sessions[:limit]
+            next_before = sessions[-1]["session_id"]
+        return {"sessions": sessions, "next_before": next_before}
+    except HTTPException:
+        raise
     except Exception as e:
         State.logger.error(f"An error occured while fetching history: {str(e)}")
         raise HTTPException(
@@ -103,16 +186,19 @@ async def get_sessions_for_case(
 @token_required
 async def delete_session_(
     session_id: str,
+    background_tasks: BackgroundTasks,
     dependencies=Depends(JWTBearer()),
     db=Depends(get_db),
 ):
     try:
-        return delete_session(session_id=session_id, db=db)
+        return await delete_session(
+            session_id=session_id, db=db, background_tasks=background_tasks
+        )
     except HTTPException:
         raise
     except Exception as e:
         State.logger.error(f"An error occured while deleting session: {str(e)}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=500, detail=f"An error occured while deleting session: {str(e)}"
         )
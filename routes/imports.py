@@ -0,0 +1,79 @@
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    File,
+    HTTPException,
+    Query,
+    UploadFile,
+)
+
+from controllers.auth import JWTBearer, token_required
+from controllers.bulk_import import import_job_dict, run_import, start_import
+from database.database import get_db, get_read_db
+from models.import_job import ImportJob
+from utils.state import State
+
+router = APIRouter()
+
+
+async def _start(kind, background_tasks, file, format, db):
+    try:
+        job, path = await start_import(kind, file, format, db)
+        background_tasks.add_task(run_import, job.job_id, path)
+        return {"job": import_job_dict(job)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        State.logger.error(f"An error occured while starting {kind} import: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occured while starting {kind} import: {str(e)}",
+        )
+
+
+@router.post("/patients")
+@token_required
+async def import_patients(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(..., description="CSV or NDJSON file of patients"),
+    format: str = Query(None, description="csv or ndjson; inferred if omitted"),
+    dependencies=Depends(JWTBearer()),
+    db=Depends(get_db),
+):
+    return await _start("patients", background_tasks, file, format, db)
+
+
+@router.post("/cases")
+@token_required
+async def import_cases(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(..., description="CSV or NDJSON file of cases"),
+    format: str = Query(None, description="csv or ndjson; inferred if omitted"),
+    dependencies=Depends(JWTBearer()),
+    db=Depends(get_db),
+):
+    return await _start("cases", background_tasks, file, format, db)
+
+
+@router.get("/{job_id}")
+@token_required
+async def get_import(
+    job_id: str,
+    dependencies=Depends(JWTBearer()),
+    db=Depends(get_read_db),
+):
+    try:
+        job = await db.get(ImportJob, job_id)
+        if not job:
+            State.logger.error(f"Import job {job_id} not found")
+            raise HTTPException(status_code=404, detail="Import job not found")
+        return {"job": import_job_dict(job)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        State.logger.error(f"An error occured while fetching import job: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occured while fetching import job: {str(e)}",
+        )
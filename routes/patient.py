@@ -1,24 +1,77 @@
 import datetime
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
 
 from controllers.auth import JWTBearer, token_required
-from database.database import get_db
+from controllers.deletion import delete_patient_rows, purge_deleted
+from controllers.export import export_patient, gzip_chunks
+from controllers.message import history_cache, recent_sessions_by_case
+from controllers.patient_search import (
+    DEFAULT_SEARCH_LIMIT,
+    MAX_SEARCH_LIMIT,
+    name_prefix_filters,
+    search_patients,
+)
+from database.database import get_db, get_read_db
+from models.cases import Case
 from models.patients import Patient
+from utils.names import normalize_name
+from utils.pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    keyset_page,
+    select_fields,
+)
 from utils.state import State
 
 router = APIRouter()
 
+# name_normalized only feeds the name search index.
+PATIENT_FIELDS = [
+    column.key
+    for column in Patient.__table__.columns
+    if column.key != "name_normalized"
+]
+CASE_FIELDS = [column.key for column in Case.__table__.columns]
+
 
 @router.get("/")
 @token_required
 async def get_patients(
+    name: str = Query(
+        None,
+        description="Only patients whose name starts with this, ignoring case, "
+        "accents and punctuation",
+    ),
+    fields: str = Query(
+        None,
+        description=f"Comma-separated fields to return: {', '.join(PATIENT_FIELDS)}",
+    ),
+    limit: int = Query(
+        DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Page size"
+    ),
+    after: str = Query(None, description="Cursor: `next_after` of the previous page"),
     dependencies=Depends(JWTBearer()),
-    db=Depends(get_db),
+    db=Depends(get_read_db),
 ):
     try:
-        patients = db.query(Patient).all()
-        return {"patients": [patient.__dict__ for patient in patients]}
+        filters = [Patient.deleted_at.is_(None)]
+        if name:
+            filters += name_prefix_filters(name)
+        patients, next_after = await keyset_page(
+            db,
+            select_fields(Patient, fields, PATIENT_FIELDS, key="patient_id"),
+            key=Patient.patient_id,
+            filters=filters,
+            limit=limit,
+            after=after,
+        )
+        return {"patients": patients, "next_after": next_after}
+    except HTTPException:
+        raise
     except Exception as e:
         State.logger.error(f"An error occured while fetching all patients: {str(e)}")
         raise HTTPException(
@@ -27,15 +80,46 @@ async def get_patients(
         )
 
 
+@router.get("/search")
+@token_required
+async def search_patients_by_name(
+    q: str = Query(..., min_length=1, description="Part of the patient's name"),
+    fields: str = Query(
+        None,
+        description=f"Comma-separated fields to return: {', '.join(PATIENT_FIELDS)}",
+    ),
+    limit: int = Query(
+        DEFAULT_SEARCH_LIMIT, ge=1, le=MAX_SEARCH_LIMIT, description="Most results"
+    ),
+    dependencies=Depends(JWTBearer()),
+    db=Depends(get_read_db),
+):
+    try:
+        columns = select_fields(Patient, fields, PATIENT_FIELDS, key="patient_id")
+        return {"patients": await search_patients(q, db, columns, limit)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        State.logger.error(f"An error occured while searching patients: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occured while searching patients: {str(e)}",
+        )
+
+
 @router.get("/{patient_id}")
 @token_required
 async def get_patient(
     patient_id: str,
     dependencies=Depends(JWTBearer()),
-    db=Depends(get_db),
+    db=Depends(get_read_db),
 ):
     try:
-        patient = db.query(Patient).filter(Patient.patient_id == patient_id).first()
+        patient = await db.scalar(
+            select(Patient).where(
+                Patient.patient_id == patient_id, Patient.deleted_at.is_(None)
+            )
+        )
         if not patient:
             State.logger.error(f"Patient with ID {patient_id} not found")
             raise HTTPException(status_code=404, detail="Patient not found")
@@ -49,6 +133,90 @@ async def get_patient(
         )
 
 
+@router.get("/{patient_id}/overview")
+@token_required
+async def get_patient_overview(
+    patient_id: str,
+    sessions: int = Query(
+        10, ge=1, le=MAX_PAGE_SIZE, description="Most recent sessions per case"
+    ),
+    dependencies=Depends(JWTBearer()),
+    db=Depends(get_read_db),
+):
+    try:
+        # Three queries: the patient, its cases (selectinload) and the sessions.
+        patient = await db.scalar(
+            select(Patient)
+            .where(Patient.patient_id == patient_id, Patient.deleted_at.is_(None))
+            .options(selectinload(Patient.cases.and_(Case.deleted_at.is_(None))))
+        )
+        if not patient:
+            State.logger.error(f"Patient with ID {patient_id} not found")
+            raise HTTPException(status_code=404, detail="Patient not found")
+        recent = await recent_sessions_by_case(patient_id, db, per_case=sessions)
+        cases = []
+        for case in sorted(patient.cases, key=lambda case: case.case_id):
+            case_sessions, total = recent.get(case.case_id, ([], 0))
+            cases.append(
+                {
+                    **{field: getattr(case, field) for field in CASE_FIELDS},
+                    "session_count": total,
+                    "sessions": case_sessions,
+                }
+            )
+        return {
+            "patient": {field: getattr(patient, field) for field in PATIENT_FIELDS},
+            "cases": cases,
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        State.logger.error(
+            f"An error occured while fetching patient overview: {str(e)}"
+        )
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occured while fetching patient overview: {str(e)}",
+        )
+
+
+@router.get("/{patient_id}/export")
+@token_required
+async def export_patient_history(
+    patient_id: str,
+    request: Request,
+    gzip: bool = Query(False, description="Compress the export with gzip"),
+    dependencies=Depends(JWTBearer()),
+    db=Depends(get_read_db),
+):
+    try:
+        exists = await db.scalar(
+            select(Patient.patient_id).where(
+                Patient.patient_id == patient_id, Patient.deleted_at.is_(None)
+            )
+        )
+        if not exists:
+            State.logger.error(f"Patient with ID {patient_id} not found")
+            raise HTTPException(status_code=404, detail="Patient not found")
+        chunks = export_patient(patient_id, db, request.is_disconnected)
+        filename = f"patient_{patient_id}.ndjson"
+        if gzip:
+            chunks, filename = gzip_chunks(chunks), f"{filename}.gz"
+        return StreamingResponse(
+            chunks,
+            media_type="application/gzip" if gzip else "application/x-ndjson",
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        State.logger.error(f"An error occured while exporting patient: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occured while exporting patient: {str(e)}",
+        )
+
+
 @router.post("/")
 @token_required
 async def create_patient(
@@ -67,6 +235,7 @@ async def create_patient(
         new_patient = Patient(
             patient_id=patient_id,
             name=name,
+            name_normalized=normalize_name(name),
             age=age,
             gender=gender,
             dob=dob,
@@ -77,8 +246,8 @@ async def create_patient(
             time_updated=datetime.datetime.now(datetime.UTC).isoformat(),
         )
         db.add(new_patient)
-        db.commit()
-        db.refresh(new_patient)
+        await db.commit()
+        await db.refresh(new_patient)
         return {"patient": new_patient.__dict__}
     except HTTPException:
         raise
@@ -105,12 +274,17 @@ async def update_patient(
     db=Depends(get_db),
 ):
     try:
-        patient = db.query(Patient).filter(Patient.patient_id == patient_id).first()
+        patient = await db.scalar(
+            select(Patient).where(
+                Patient.patient_id == patient_id, Patient.deleted_at.is_(None)
+            )
+        )
         if not patient:
             State.logger.error(f"Patient with ID {patient_id} not found")
             raise HTTPException(status_code=404, detail="Patient not found")
         if name:
             patient.name = name
+            patient.name_normalized = normalize_name(name)
         if age:
             patient.age = age
         if gender:
@@ -124,8 +298,8 @@ async def update_patient(
         if medical_history:
             patient.medical_history = medical_history
         patient.time_updated = datetime.datetime.now(datetime.UTC).isoformat()
-        db.commit()
-        db.refresh(patient)
+        await db.commit()
+        await db.refresh(patient)
         return {"patient": patient.__dict__}
     except HTTPException:
         raise
@@ -140,16 +314,18 @@ async def update_patient(
 @token_required
 async def delete_patient(
     patient_id: str,
+    background_tasks: BackgroundTasks,
     dependencies=Depends(JWTBearer()),
     db=Depends(get_db),
 ):
     try:
-        patient = db.query(Patient).filter(Patient.patient_id == patient_id).first()
-        if not patient:
+        deleted = await delete_patient_rows(patient_id, db)
+        if not deleted:
             State.logger.error(f"Patient with ID {patient_id} not found")
             raise HTTPException(status_code=404, detail="Patient not found")
-        db.delete(patient)
-        db.commit()
+        if deleted == "scheduled":
+            background_tasks.add_task(purge_deleted)
+        history_cache.discard_where(patient_id=patient_id)
         return {"detail": "Patient deleted successfully"}
     except HTTPException:
         raise
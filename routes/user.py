@@ -1,26 +1,50 @@
 import datetime
 
 from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy import desc
+from sqlalchemy import delete, desc, select
 
 from controllers.auth import JWTBearer, decodeJWT, token_required
-from database.database import get_db
+from database.database import get_db, get_read_db
 from models.token import Token
 from models.user import User
+from utils.pagination import (
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    keyset_page,
+    select_fields,
+)
 from utils.state import State
 
 router = APIRouter()
 
+# Password hashes are never selectable
+USER_FIELDS = [
+    column.key for column in User.__table__.columns if column.key != "password"
+]
+
 
 @router.get("/")
 async def get_users(
-    db=Depends(get_db),
+    fields: str = Query(
+        None, description=f"Comma-separated fields to return: {', '.join(USER_FIELDS)}"
+    ),
+    limit: int = Query(
+        DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Page size"
+    ),
+    after: str = Query(None, description="Cursor: `next_after` of the previous page"),
+    db=Depends(get_read_db),
 ):
     try:
-        users = db.query(User).all()
-        for user in users:
-            del user.password
-        return {"users": [user.__dict__ for user in users]}
+        users, next_after = await keyset_page(
+            db,
+            select_fields(User, fields, USER_FIELDS, key="user_id"),
+            key=User.user_id,
+            limit=limit,
+            after=after,
+        )
+        return {"users": users, "next_after": next_after}
+    except HTTPException:
+        raise
     except Exception as e:
         State.logger.error(f"An error occured while fetching all users: {str(e)}")
         raise HTTPException(
@@ -33,11 +57,11 @@ async def get_users(
 @token_required
 async def get_self(
     dependencies=Depends(JWTBearer()),
-    db=Depends(get_db),
+    db=Depends(get_read_db),
 ):
     try:
         user_id = decodeJWT(dependencies)["sub"]
-        user = db.query(User).filter(User.user_id == user_id).first()
+        user = await db.scalar(select(User).where(User.user_id == user_id))
         if not user:
             State.logger.error(f"User with ID {user_id} not found")
             raise HTTPException(status_code=404, detail="User not found")
@@ -58,10 +82,10 @@ async def get_self(
 async def get_user(
     user_id: str,
     dependencies=Depends(JWTBearer()),
-    db=Depends(get_db),
+    db=Depends(get_read_db),
 ):
     try:
-        user = db.query(User).filter(User.user_id == user_id).first()
+        user = await db.scalar(select(User).where(User.user_id == user_id))
         if not user:
             State.logger.error(f"User with ID {user_id} not found")
             raise HTTPException(status_code=404, detail="User not found")
@@ -89,11 +113,13 @@ async def update_user(
 ):
     try:
         user_id = decodeJWT(dependencies)["sub"]
-        user = db.query(User).filter(User.user_id == user_id).first()
+        user = await db.scalar(select(User).where(User.user_id == user_id))
         if not user:
             State.logger.error(f"User with ID {user_id} not found")
             raise HTTPException(status_code=404, detail="User not found")
-        user_with_email = db.query(User).filter(User.email == email).first()
+        user_with_email = await db.scalar(
+            select(User).where(User.email == email).limit(1)
+        )
         if user_with_email and user_with_email.user_id != user_id:
             State.logger.error("Email already in use")
             raise HTTPException(status_code=400, detail="Email already in use")
@@ -103,8 +129,8 @@ async def update_user(
         user.role = role if role else user.role
         user.time_updated = datetime.datetime.now(datetime.UTC).isoformat()
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
         return {"message": "User updated successfully"}
     except HTTPException:
         raise
@@ -124,29 +150,27 @@ async def delete_user(
     try:
         user_id = decodeJWT(dependencies)["sub"]
         # Invalidate the current access token if exists
-        token = (
-            db.query(Token)
+        token = await db.scalar(
+            select(Token)
             .filter_by(user_id=user_id, access_token=dependencies, status=True)
             .order_by(desc(Token.time_created))
-            .first()
+            .limit(1)
         )
         if token:
             token.status = False
             token.time_updated = datetime.datetime.now(datetime.UTC).isoformat()
             db.add(token)
-            db.commit()
+            await db.commit()
 
-        user = db.query(User).filter(User.user_id == user_id).first()
+        user = await db.scalar(select(User).where(User.user_id == user_id))
         if not user:
             State.logger.error(f"User with ID {user_id} not found")
             raise HTTPException(status_code=404, detail="User not found")
 
         # Manually delete tokens (safer for sqlite without ON DELETE enforcement)
-        db.query(Token).filter(Token.user_id == user_id).delete(
-            synchronize_session=False
-        )
-        db.delete(user)
-        db.commit()
+        await db.execute(delete(Token).where(Token.user_id == user_id))
+        await db.delete(user)
+        await db.commit()
         return {"message": "User deleted successfully"}
     except HTTPException:
         raise
@@ -0,0 +1,29 @@
+from pydantic import BaseModel, Field, field_validator
+
+
+class PatientRow(BaseModel):
+    patient_id: str = Field(min_length=1)
+    name: str = Field(min_length=1)
+    age: int | None = Field(None, ge=0)
+    gender: str | None = None
+    dob: str | None = None
+    height: str | None = None
+    weight: str | None = None
+    medical_history: str | None = None
+
+
+class CaseRow(BaseModel):
+    case_id: str = Field(min_length=1)
+    patient_id: str = Field(min_length=1)
+    case_name: str = Field(min_length=1)
+    description: str
+    tags: list[str] = Field(default_factory=list)
+    priority: str | None = None
+
+    @field_validator("tags", mode="before")
+    @classmethod
+    def split_tags(cls, value):
+        # CSV cells carry tags as "anxiety;insomnia"
+        if isinstance(value, str):
+            return [tag.strip() for tag in value.split(";") if tag.strip()]
+        return value
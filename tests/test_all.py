@@ -2,6 +2,7 @@ from dotenv import load_dotenv
 
 load_dotenv(".env")
 
+import asyncio
 import datetime
 import uuid
 import pytest
@@ -9,9 +10,12 @@ import sys
 import pathlib
 import os
 import tempfile
+import time
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 
 # Ensure project root on sys.path for application imports
 PROJECT_ROOT = pathlib.Path(__file__).resolve().parents[1]
@@ -36,6 +40,7 @@ def test_db_url():
     os.environ.setdefault("JWT_REFRESH_TOKEN_EXPIRE_MINUTES", "1440")
     os.environ.setdefault("LOGFIRE_TOKEN", "test-token")
     os.environ.setdefault("ENVIRONMENT", "test")
+    os.environ.setdefault("ATTACHMENT_STORE_PATH", tempfile.mkdtemp())
     return url
 
 
@@ -54,6 +59,9 @@ def engine(test_db_url):
     Base.metadata.create_all(bind=engine_)
     yield engine_
     Base.metadata.drop_all(bind=engine_)
+    # Migrations create objects outside the models; rerun them next time.
+    with engine_.begin() as conn:
+        conn.exec_driver_sql("DROP TABLE IF EXISTS schema_migrations")
 
 
 @pytest.fixture(scope="function")
@@ -66,6 +74,27 @@ def db_session(engine):
         session.close()
 
 
+@pytest.fixture(scope="session")
+def async_session_factory(engine, test_db_url):
+    from database.database import to_async_url
+
+    # NullPool: every TestClient runs its own event loop, so connections
+    # must not be reused across tests.
+    async_engine = create_async_engine(to_async_url(test_db_url), poolclass=NullPool)
+    if async_engine.dialect.name == "sqlite":
+        # Same as the app engine, so ON DELETE CASCADE applies.
+        @event.listens_for(async_engine.sync_engine, "connect")
+        def _foreign_keys(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA foreign_keys=ON")
+            cursor.close()
+
+    yield async_sessionmaker(
+        bind=async_engine, autoflush=False, expire_on_commit=False
+    )
+    asyncio.run(async_engine.dispose())
+
+
 @pytest.fixture(scope="session")
 def app(test_db_url):  # noqa: D401
     from main import app as fastapi_app
@@ -74,15 +103,18 @@ def app(test_db_url):  # noqa: D401
 
 
 @pytest.fixture(autouse=True)
-def _override_dependency(app, db_session):
-    from database.database import get_db
+def _override_dependency(app, async_session_factory):
+    from database.database import get_db, get_read_db
 
-    def _get_db():
-        yield db_session
+    async def _get_db():
+        async with async_session_factory() as session:
+            yield session
 
     app.dependency_overrides[get_db] = _get_db
+    app.dependency_overrides[get_read_db] = _get_db
     yield
     app.dependency_overrides.pop(get_db, None)
+    app.dependency_overrides.pop(get_read_db, None)
 
 
 @pytest.fixture()
@@ -340,6 +372,16 @@ def test_get_users_list(client, db_session):
     assert all("password" not in u for u in filtered)
 
 
+def test_users_list_never_exposes_passwords(client, db_session):
+    ensure_user(client, email=f"{_uniq('pw')}@example.com")
+    r = client.get("/api/v1/users/", params={"limit": 1})
+    assert r.status_code == 200, r.text
+    assert len(r.json()["users"]) == 1
+    assert "password" not in r.json()["users"][0]
+    denied = client.get("/api/v1/users/", params={"fields": "password"})
+    assert denied.status_code == 400
+
+
 def test_users_get_self(client, db_session, token_manager):
     email = f"self_{uuid.uuid4().hex[:6]}@example.com"
     ensure_user(client, email=email)
@@ -405,6 +447,85 @@ def test_patient_list(client, db_session, token_manager):
     assert len(ls.json()["patients"]) >= 2
 
 
+def test_patient_list_name_prefix(client, db_session, token_manager):
+    headers, _, _ = auth_headers(client, db_session, token_manager)
+    prefix = _uniq("Zed")
+    for suffix in ("a", "b"):
+        payload = {
+            **_create_patient_payload(_uniq("pn")),
+            "name": f"{prefix} {suffix}",
+        }
+        r = client.post("/api/v1/patient/", params=payload, headers=headers)
+        assert r.status_code == 200, r.text
+    r = client.get(
+        "/api/v1/patient/", params={"name": prefix, "fields": "name"}, headers=headers
+    )
+    assert r.status_code == 200, r.text
+    patients = r.json()["patients"]
+    assert sorted(p["name"] for p in patients) == [f"{prefix} a", f"{prefix} b"]
+    assert all(set(p) == {"patient_id", "name"} for p in patients)
+
+    # Matched on the normalized name: case and accents do not matter
+    query = prefix.upper().replace("E", "\u00c9") + " B"
+    r = client.get("/api/v1/patient/", params={"name": query}, headers=headers)
+    assert [p["name"] for p in r.json()["patients"]] == [f"{prefix} b"]
+
+
+def test_patient_search_ranks_normalized_name_matches(
+    client, db_session, token_manager
+):
+    headers, _, _ = auth_headers(client, db_session, token_manager)
+    key = uuid.uuid4().hex[:8]
+    names = {
+        "exact": f"ZORA{key}",
+        "prefix": f"Zora{key}-N\u00fa\u00f1ez",
+        # Inserted first, so an unordered index read would return it first.
+        "substring": f"Bzora{key}",
+        "word": f"Ann Zora{key}",
+        "deleted": f"Zora{key} Gone",
+    }
+    ids = {}
+    for kind, name in names.items():
+        ids[kind] = _uniq("ps")
+        payload = {**_create_patient_payload(ids[kind]), "name": name}
+        r = client.post("/api/v1/patient/", params=payload, headers=headers)
+        assert r.status_code == 200, r.text
+    r = client.delete(f"/api/v1/patient/{ids['deleted']}", headers=headers)
+    assert r.status_code == 200
+
+    def _search(q, **params):
+        r = client.get(
+            "/api/v1/patient/search", params={"q": q, **params}, headers=headers
+        )
+        assert r.status_code == 200, r.text
+        return [(p["patient_id"], p["match"]) for p in r.json()["patients"]]
+
+    # The substring index on Postgres needs pg_trgm, which may be missing.
+    kinds = ["exact", "prefix", "word", "substring"]
+    if db_session.bind.dialect.name != "sqlite":
+        found = {match for _, match in _search(f"zora{key}")}
+        kinds = [kind for kind in kinds if kind in found]
+    assert kinds[:2] == ["exact", "prefix"]
+    assert _search(f"  Z\u00f3ra{key} ") == [(ids[kind], kind) for kind in kinds]
+    assert _search(f"zora{key}", limit=1) == [(ids["exact"], "exact")]
+    assert _search(f"zora{key}", limit=3) == [(ids[kind], kind) for kind in kinds[:3]]
+    assert _search(f"zora{key} n") == [(ids["prefix"], "prefix")]
+
+    r = client.get(
+        "/api/v1/patient/search",
+        params={"q": f"ann zora{key}", "fields": "name"},
+        headers=headers,
+    )
+    assert r.json()["patients"] == [
+        {"patient_id": ids["word"], "name": names["word"], "match": "exact"}
+    ]
+    r = client.put(
+        f"/api/v1/patient/{ids['word']}", params={"name": "Renamed"}, headers=headers
+    )
+    assert r.status_code == 200
+    assert ids["word"] not in dict(_search(f"zora{key}"))
+
+
 def test_patient_get(client, db_session, token_manager):
     headers, _, _ = auth_headers(client, db_session, token_manager)
     pid = _uniq("pg")
@@ -440,6 +561,242 @@ def test_patient_delete(client, db_session, token_manager):
     assert dl.json()["detail"].startswith("Patient deleted")
 
 
+def _seed_messages(db_session, sid: str, cid: str, pid: str, count: int):
+    from sqlalchemy import insert
+    from models.session_message import SessionMessages
+
+    db_session.execute(
+        insert(SessionMessages),
+        [
+            {
+                "message_id": _uniq("m"),
+                "session_id": sid,
+                "case_id": cid,
+                "patient_id": pid,
+                "content": [],
+                "safety": {},
+                "timestamp": datetime.datetime.now(datetime.UTC),
+            }
+            for _ in range(count)
+        ],
+    )
+    db_session.commit()
+
+
+def _count_rows(db_session, model, **filters) -> int:
+    from sqlalchemy import func, select
+
+    return db_session.scalar(
+        select(func.count()).select_from(model).filter_by(**filters)
+    )
+
+
+def test_patient_delete_cascades_in_the_database(
+    client, db_session, token_manager, async_session_factory
+):
+    from models.cases import Case
+    from models.session import ChatSession
+    from models.session_message import SessionMessages
+
+    headers, _, _ = auth_headers(client, db_session, token_manager)
+    pid, cid = _setup_session_dependencies_api(client, headers)
+    sid = _uniq("s")
+    assert _create_session(client, headers, sid, cid, pid).status_code == 200
+    _seed_messages(db_session, sid, cid, pid, 3)
+    sync_engine = async_session_factory.kw["bind"].sync_engine
+    statements = []
+
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(sync_engine, "before_cursor_execute", _record)
+    try:
+        dl = client.delete(f"/api/v1/patient/{pid}", headers=headers)
+    finally:
+        event.remove(sync_engine, "before_cursor_execute", _record)
+    assert dl.status_code == 200, dl.text
+    # Children are neither loaded nor deleted one by one.
+    assert not any("FROM cases" in s or "FROM chat_session" in s for s in statements)
+    deletes = [s for s in statements if s.lstrip().startswith("DELETE")]
+    assert len(deletes) == 1 and "patients" in deletes[0]
+    assert _count_rows(db_session, Case, patient_id=pid) == 0
+    assert _count_rows(db_session, ChatSession, patient_id=pid) == 0
+    assert _count_rows(db_session, SessionMessages, patient_id=pid) == 0
+    assert client.delete(f"/api/v1/patient/{pid}", headers=headers).status_code == 404
+
+
+def test_patient_export_streams_ndjson_with_archived_sessions(
+    client, db_session, token_manager, async_session_factory, monkeypatch
+):
+    import gzip
+    import json
+    import controllers.archive as archive
+    import controllers.export as export
+    from sqlalchemy import update
+    from models.session import ChatSession
+
+    monkeypatch.setattr(archive, "SessionLocal", async_session_factory)
+    headers, _, _ = auth_headers(client, db_session, token_manager)
+    pid, cid = _setup_session_dependencies_api(client, headers)
+    hot, cold = _uniq("s"), _uniq("s")
+    for sid, count in ((hot, 3), (cold, 2)):
+        assert _create_session(client, headers, sid, cid, pid).status_code == 200
+        _seed_messages(db_session, sid, cid, pid, count)
+    db_session.execute(
+        update(ChatSession)
+        .where(ChatSession.session_id == cold)
+        .values(time_updated="2000-01-01T00:00:00+00:00")
+    )
+    db_session.commit()
+    assert asyncio.run(archive.archive_idle_sessions(days=30)) >= 1
+
+    r = client.get(f"/api/v1/patient/{pid}/export", headers=headers)
+    assert r.status_code == 200, r.text
+    assert r.headers["content-type"] == "application/x-ndjson"
+    records = [json.loads(line) for line in r.text.splitlines()]
+    assert [record["type"] for record in records[:2]] == ["patient", "case"]
+    assert records[0]["data"]["patient_id"] == pid
+    messages = [record["data"] for record in records if record["type"] == "message"]
+    assert len(messages) == 5 and "search_text" not in messages[0]
+    assert {m["session_id"] for m in messages} == {hot, cold}
+
+    compressed = client.get(
+        f"/api/v1/patient/{pid}/export", params={"gzip": True}, headers=headers
+    )
+    assert compressed.headers["content-disposition"].endswith('.ndjson.gz"')
+    assert gzip.decompress(compressed.content) == r.content
+    assert client.get("/api/v1/patient/nope/export", headers=headers).status_code == 404
+
+    async def _export_until_disconnect():
+        async def _disconnected():
+            return True
+
+        async with async_session_factory() as db:
+            return [
+                chunk async for chunk in export.export_patient(pid, db, _disconnected)
+            ]
+
+    # The client went away after the first batch: nothing more is read.
+    assert len(asyncio.run(_export_until_disconnect())) == 2
+
+
+def test_patient_overview_uses_a_fixed_number_of_queries(
+    client, db_session, token_manager, async_session_factory
+):
+    headers, _, _ = auth_headers(client, db_session, token_manager)
+    pid, busy = _setup_session_dependencies_api(client, headers)
+    quiet, gone = _uniq("c"), _uniq("c")
+    for cid in (quiet, gone):
+        assert _create_case(client, headers, pid, cid).status_code == 200
+    assert client.delete(f"/api/v1/cases/{gone}", headers=headers).status_code == 200
+    sids = [_uniq("s") for _ in range(3)]
+    for sid in sids:
+        assert _create_session(client, headers, sid, busy, pid).status_code == 200
+    r = client.post(
+        "/api/v1/chat/",
+        params={
+            "session_id": sids[0],
+            "case_id": busy,
+            "patient_id": pid,
+            "prompt": "Hello",
+            "debug": True,
+        },
+        headers=headers,
+    )
+    assert r.status_code == 200, r.text
+    message_id = r.json()["message_id"]
+
+    sync_engine = async_session_factory.kw["bind"].sync_engine
+    statements = []
+
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        if "FROM tokens" not in statement:
+            statements.append(statement)
+
+    event.listen(sync_engine, "before_cursor_execute", _record)
+    try:
+        r = client.get(
+            f"/api/v1/patient/{pid}/overview", params={"sessions": 2}, headers=headers
+        )
+    finally:
+        event.remove(sync_engine, "before_cursor_execute", _record)
+    assert r.status_code == 200, r.text
+    assert len(statements) == 3
+    overview = r.json()
+    assert overview["patient"]["patient_id"] == pid
+    cases = {case["case_id"]: case for case in overview["cases"]}
+    assert set(cases) == {busy, quiet}
+    assert cases[busy]["session_count"] == 3 and len(cases[busy]["sessions"]) == 2
+    latest = cases[busy]["sessions"][0]
+    assert latest["session_id"] == sids[0] and latest["message_count"] == 1
+    assert latest["last_message"]["message_id"] == message_id
+    assert (cases[quiet]["session_count"], cases[quiet]["sessions"]) == (0, [])
+    missing = client.get("/api/v1/patient/nope/overview", headers=headers)
+    assert missing.status_code == 404
+
+
+def test_large_case_delete_is_hidden_then_purged_in_chunks(
+    client, db_session, token_manager, async_session_factory, monkeypatch
+):
+    import controllers.deletion as deletion
+    import routes.cases
+    from models.cases import Case
+    from models.session import ChatSession
+    from models.session_message import SessionMessages
+
+    async def _no_purge():
+        return 0
+
+    monkeypatch.setattr(deletion, "SOFT_DELETE_MIN_MESSAGES", 3)
+    monkeypatch.setattr(deletion, "SessionLocal", async_session_factory)
+    monkeypatch.setattr(routes.cases, "purge_deleted", _no_purge)
+    headers, _, _ = auth_headers(client, db_session, token_manager)
+    pid, cid = _setup_session_dependencies_api(client, headers)
+    sid = _uniq("s")
+    assert _create_session(client, headers, sid, cid, pid).status_code == 200
+    _seed_messages(db_session, sid, cid, pid, 5)
+    up = client.post(
+        f"/api/v1/cases/{cid}/attachments",
+        files=[("files", ("xray.png", _make_png(), "image/png"))],
+        headers=headers,
+    )
+    attachment_id = up.json()["attachments"][0]["attachment_id"]
+
+    dl = client.delete(f"/api/v1/cases/{cid}", headers=headers)
+    assert dl.status_code == 200, dl.text
+    # Soft-deleted: hidden from the API, rows still there for the purge.
+    assert client.get(f"/api/v1/cases/{cid}", headers=headers).status_code == 404
+    for path in ("attachments", f"attachments/{attachment_id}"):
+        r = client.get(f"/api/v1/cases/{cid}/{path}", headers=headers)
+        assert r.status_code == 404
+    sessions = client.get(
+        "/api/v1/history/sessions",
+        params={"case_id": cid, "patient_id": pid},
+        headers=headers,
+    )
+    assert sessions.json()["sessions"] == []
+    assert client.get(f"/api/v1/patient/{pid}", headers=headers).status_code == 200
+    assert _count_rows(db_session, SessionMessages, case_id=cid) == 5
+
+    sync_engine = async_session_factory.kw["bind"].sync_engine
+    statements = []
+
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(sync_engine, "before_cursor_execute", _record)
+    try:
+        purged = asyncio.run(deletion.purge_deleted(chunk_size=2))
+    finally:
+        event.remove(sync_engine, "before_cursor_execute", _record)
+    assert purged == 2
+    chunks = [s for s in statements if s.startswith("DELETE FROM session_messages")]
+    assert len(chunks) == 3
+    assert _count_rows(db_session, SessionMessages, case_id=cid) == 0
+    assert _count_rows(db_session, ChatSession, case_id=cid) == 0
+    assert _count_rows(db_session, Case, case_id=cid) == 0
+
+
 #########################
 # Cases
 #########################
@@ -481,6 +838,141 @@ def test_case_list(client, db_session, token_manager):
     assert len(ls.json()["cases"]) >= 2
 
 
+def test_case_list_filters_pagination_and_projection(
+    client, db_session, token_manager
+):
+    headers, _, _ = auth_headers(client, db_session, token_manager)
+    pid = _uniq("pf")
+    _ensure_patient_api(client, headers, pid)
+    for i, (tags, priority) in enumerate(
+        [(["cardio", "urgent"], "high"), (["cardio"], "low"), (["neuro"], "high")]
+    ):
+        r = client.post(
+            "/api/v1/cases/",
+            params={
+                "case_id": f"{pid}_c{i}",
+                "patient_id": pid,
+                "case_name": f"Case {i}",
+                "description": "Desc",
+                "tags": tags,
+                "priority": priority,
+            },
+            headers=headers,
+        )
+        assert r.status_code == 200, r.text
+
+    def _ids(**params):
+        r = client.get(
+            "/api/v1/cases/", params={"patient_id": pid, **params}, headers=headers
+        )
+        assert r.status_code == 200, r.text
+        return [case["case_id"] for case in r.json()["cases"]]
+
+    assert _ids() == [f"{pid}_c0", f"{pid}_c1", f"{pid}_c2"]
+    assert _ids(tag="cardio") == [f"{pid}_c0", f"{pid}_c1"]
+    assert _ids(priority="high", tag="neuro") == [f"{pid}_c2"]
+
+    first = client.get(
+        "/api/v1/cases/",
+        params={"patient_id": pid, "limit": 2, "fields": "case_name,priority"},
+        headers=headers,
+    ).json()
+    assert [set(case) for case in first["cases"]] == [
+        {"case_id", "case_name", "priority"}
+    ] * 2
+    assert first["next_after"] == f"{pid}_c1"
+    second = client.get(
+        "/api/v1/cases/",
+        params={"patient_id": pid, "limit": 2, "after": first["next_after"]},
+        headers=headers,
+    ).json()
+    assert [case["case_id"] for case in second["cases"]] == [f"{pid}_c2"]
+    assert second["next_after"] is None
+
+    bad = client.get("/api/v1/cases/", params={"fields": "secret"}, headers=headers)
+    assert bad.status_code == 400
+
+
+def test_case_tags_are_indexed_filtered_and_counted(
+    client, db_session, token_manager, monkeypatch
+):
+    from sqlalchemy import select
+    import controllers.deletion as deletion
+    from models.cases import CaseTag, CaseTagCount
+
+    headers, _, _ = auth_headers(client, db_session, token_manager)
+    pid, rare = _uniq("pt"), _uniq("rare")
+    _ensure_patient_api(client, headers, pid)
+    for i, tags in enumerate(
+        [["cardio", " urgent", "cardio"], ["cardio", rare], ["neuro"]]
+    ):
+        r = client.post(
+            "/api/v1/cases/",
+            params={
+                "case_id": f"{pid}_c{i}",
+                "patient_id": pid,
+                "case_name": f"Case {i}",
+                "description": "Desc",
+                "tags": tags,
+            },
+            headers=headers,
+        )
+        assert r.status_code == 200, r.text
+    assert r.json()["case"]["tags"] == ["neuro"]
+    assert _count_rows(db_session, CaseTag, case_id=f"{pid}_c0") == 2
+
+    def _total(tag):
+        return db_session.scalar(
+            select(CaseTagCount.cases).where(CaseTagCount.tag == tag)
+        )
+
+    def _tags(**params):
+        r = client.get(
+            "/api/v1/cases/tags", params={"patient_id": pid, **params}, headers=headers
+        )
+        assert r.status_code == 200, r.text
+        return [(tag["tag"], tag["cases"]) for tag in r.json()["tags"]]
+
+    def _ids(**params):
+        r = client.get(
+            "/api/v1/cases/", params={"patient_id": pid, **params}, headers=headers
+        )
+        assert r.status_code == 200, r.text
+        return [case["case_id"] for case in r.json()["cases"]]
+
+    assert _tags() == [("cardio", 2), ("neuro", 1), (rare, 1), ("urgent", 1)]
+    assert _tags(limit=1) == [("cardio", 2)]
+    assert _total(rare) == 1
+    overall = client.get("/api/v1/cases/tags", headers=headers).json()["tags"]
+    assert overall[0]["cases"] >= 2
+    assert [tag["cases"] for tag in overall] == sorted(
+        (tag["cases"] for tag in overall), reverse=True
+    )
+    assert _ids(tag=["cardio", "urgent"]) == [f"{pid}_c0"]
+
+    r = client.put(
+        f"/api/v1/cases/{pid}_c1", params={"tags": ["neuro"]}, headers=headers
+    )
+    assert r.status_code == 200, r.text
+    assert _total(rare) == 0
+    assert _tags() == [("neuro", 2), ("cardio", 1), ("urgent", 1)]
+    assert _tags(tag="neuro") == [("neuro", 2)]
+    assert _ids(tag="neuro") == [f"{pid}_c1", f"{pid}_c2"]
+
+    # Soft-deleted cases stop counting before they are purged.
+    monkeypatch.setattr(deletion, "SOFT_DELETE_MIN_MESSAGES", 0)
+    assert client.delete(f"/api/v1/cases/{pid}_c2", headers=headers).status_code == 200
+    assert _tags() == [("cardio", 1), ("neuro", 1), ("urgent", 1)]
+    assert _ids(tag="neuro") == [f"{pid}_c1"]
+
+    # Cascading deletes are counted by the triggers on case_tags.
+    monkeypatch.setattr(deletion, "SOFT_DELETE_MIN_MESSAGES", 10000)
+    r = client.put(f"/api/v1/cases/{pid}_c1", params={"tags": [rare]}, headers=headers)
+    assert r.status_code == 200 and _total(rare) == 1
+    assert client.delete(f"/api/v1/patient/{pid}", headers=headers).status_code == 200
+    assert _total(rare) == 0 and _tags() == []
+
+
 def test_case_get(client, db_session, token_manager):
     headers, _, _ = auth_headers(client, db_session, token_manager)
     pid = _uniq("pgc")
@@ -516,6 +1008,84 @@ def test_case_delete(client, db_session, token_manager):
     assert dl.json()["detail"].startswith("Case deleted")
 
 
+def test_bulk_import_reports_row_errors_and_progress(
+    client, db_session, token_manager, async_session_factory, monkeypatch
+):
+    import json
+    import controllers.bulk_import as bulk_import
+
+    monkeypatch.setattr(bulk_import, "SessionLocal", async_session_factory)
+    monkeypatch.setattr(bulk_import, "IMPORT_CHUNK_SIZE", 2)
+    headers, _, _ = auth_headers(client, db_session, token_manager)
+    p1, p2 = _uniq("ip"), _uniq("ip")
+    patients = (
+        "patient_id,name,age,gender\n"
+        f"{p1},Ada,41,F\n"
+        f"{p2},Grace,,\n"
+        f"{_uniq('ip')},,30,M\n"
+        f"{_uniq('ip')},Alan,old,M\n"
+        f"{p1},Ada again,41,F\n"
+    )
+
+    def _import(kind, name, body):
+        r = client.post(
+            f"/api/v1/imports/{kind}",
+            files=[("file", (name, body.encode(), "application/octet-stream"))],
+            headers=headers,
+        )
+        assert r.status_code == 200, r.text
+        # The job runs as a background task, after the response.
+        job_id = r.json()["job"]["job_id"]
+        return client.get(f"/api/v1/imports/{job_id}", headers=headers).json()["job"]
+
+    job = _import("patients", "clinic.csv", patients)
+    assert job["status"] == "done" and job["format"] == "csv"
+    counts = (job["rows_processed"], job["rows_inserted"], job["rows_failed"])
+    assert counts == (5, 2, 3)
+    assert [error["row"] for error in job["errors"]] == [3, 4, 5]
+    assert "already exists" in job["errors"][2]["error"]
+    patient = client.get(f"/api/v1/patient/{p2}", headers=headers).json()["patient"]
+    assert patient["name"] == "Grace" and patient["age"] is None
+
+    cid = _uniq("ic")
+    cases = "\n".join(
+        [
+            json.dumps(
+                {
+                    "case_id": cid,
+                    "patient_id": p1,
+                    "case_name": "Intake",
+                    "description": "Imported",
+                    "tags": ["anxiety"],
+                }
+            ),
+            json.dumps(
+                {
+                    "case_id": _uniq("ic"),
+                    "patient_id": "missing",
+                    "case_name": "Intake",
+                    "description": "Imported",
+                }
+            ),
+            "{not json",
+        ]
+    )
+    job = _import("cases", "cases.ndjson", cases)
+    assert (job["rows_inserted"], job["rows_failed"]) == (1, 2)
+    assert "Patient missing not found" in job["errors"][0]["error"]
+    case = client.get(f"/api/v1/cases/{cid}", headers=headers).json()["case"]
+    assert case["tags"] == ["anxiety"] and case["patient_id"] == p1
+
+    r = client.post(
+        "/api/v1/imports/cases",
+        params={"format": "xml"},
+        files=[("file", ("cases.xml", b"<cases/>", "application/xml"))],
+        headers=headers,
+    )
+    assert r.status_code == 400
+    assert client.get("/api/v1/imports/nope", headers=headers).status_code == 404
+
+
 #########################
 # History / Sessions
 #########################
@@ -573,6 +1143,69 @@ def test_session_get_sessions(client, db_session, token_manager):
     assert isinstance(gs.json()["conversations"], list)
 
 
+def test_session_list_summarises_messages_in_one_query(
+    client, db_session, token_manager, async_session_factory
+):
+    headers, _, _ = auth_headers(client, db_session, token_manager)
+    pid, cid = _setup_session_dependencies_api(client, headers)
+    s1, s2, s3 = _uniq("s"), _uniq("s"), _uniq("s")
+    for sid in (s3, s1, s2):
+        assert _create_session(client, headers, sid, cid, pid).status_code == 200
+
+    def _chat(sid, prompt):
+        r = client.post(
+            "/api/v1/chat/",
+            params={
+                "session_id": sid,
+                "case_id": cid,
+                "patient_id": pid,
+                "prompt": prompt,
+                "debug": True,
+            },
+            headers=headers,
+        )
+        assert r.status_code == 200, r.text
+        return r.json()["message_id"]
+
+    _chat(s1, "first")
+    last = _chat(s1, "second")
+    _chat(s2, "third")
+
+    def _list(**params):
+        r = client.get(
+            "/api/v1/history/sessions",
+            params={"case_id": cid, "patient_id": pid, **params},
+            headers=headers,
+        )
+        assert r.status_code == 200, r.text
+        return r.json()
+
+    sync_engine = async_session_factory.kw["bind"].sync_engine
+    statements = []
+
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(sync_engine, "before_cursor_execute", _record)
+    try:
+        page = _list(limit=2)
+    finally:
+        event.remove(sync_engine, "before_cursor_execute", _record)
+    assert len([s for s in statements if "chat_session" in s]) == 1
+    sessions = page["sessions"]
+    assert [session["session_id"] for session in sessions] == [s2, s1]
+    assert sessions[1]["message_count"] == 2
+    assert sessions[1]["last_safety_level"] == "High"
+    assert sessions[1]["last_message"]["message_id"] == last
+    assert "mock response" in sessions[1]["last_message"]["preview"].lower()
+
+    rest = _list(limit=2, before=page["next_before"])
+    assert [session["session_id"] for session in rest["sessions"]] == [s3]
+    assert rest["sessions"][0]["message_count"] == 0
+    assert rest["sessions"][0]["last_message"] is None
+    assert rest["next_before"] is None
+
+
 def test_session_get_messages(client, db_session, token_manager):
     headers, _, _ = auth_headers(client, db_session, token_manager)
     pid, cid = _setup_session_dependencies_api(client, headers)
@@ -583,6 +1216,267 @@ def test_session_get_messages(client, db_session, token_manager):
     assert isinstance(gm.json()["conversations"], list)
 
 
+def test_session_messages_keyset_pagination(client, db_session, token_manager):
+    headers, _, _ = auth_headers(client, db_session, token_manager)
+    pid, cid = _setup_session_dependencies_api(client, headers)
+    sid = _uniq("s")
+    _create_session(client, headers, sid, cid, pid)
+    prompts = [f"message {i}" for i in range(5)]
+    for prompt in prompts:
+        r = client.post(
+            "/api/v1/chat/",
+            params={
+                "session_id": sid,
+                "case_id": cid,
+                "patient_id": pid,
+                "prompt": prompt,
+                "debug": True,
+            },
+            headers=headers,
+        )
+        assert r.status_code == 200, r.text
+
+    def _prompts(conversations):
+        return [msg["content"][0]["content"][-1]["text"] for msg in conversations]
+
+    url = f"/api/v1/history/messages/{sid}"
+    everything = client.get(url, headers=headers).json()
+    assert _prompts(everything["conversations"]) == prompts
+    assert everything["next_before"] is None
+
+    latest = client.get(
+        url, params={"limit": 2, "newest_first": True}, headers=headers
+    ).json()
+    assert _prompts(latest["conversations"]) == ["message 4", "message 3"]
+    older = client.get(
+        url,
+        params={"limit": 2, "newest_first": True, "before": latest["next_before"]},
+        headers=headers,
+    ).json()
+    assert _prompts(older["conversations"]) == ["message 2", "message 1"]
+
+    # Chronological pages hold the most recent messages before the cursor
+    page = client.get(url, params={"limit": 3}, headers=headers).json()
+    assert _prompts(page["conversations"]) == prompts[2:]
+    rest = client.get(
+        url, params={"limit": 3, "before": page["next_before"]}, headers=headers
+    ).json()
+    assert _prompts(rest["conversations"]) == prompts[:2]
+    assert rest["next_before"] is None
+
+    # A page that ends exactly at the first message has no older page
+    exact = client.get(url, params={"limit": 5}, headers=headers).json()
+    assert _prompts(exact["conversations"]) == prompts
+    assert exact["next_before"] is None
+    too_big = client.get(url, params={"limit": 10**9}, headers=headers)
+    assert too_big.status_code == 422
+
+    missing = client.get(url, params={"before": "nope"}, headers=headers)
+    assert missing.status_code == 404
+
+
+def test_add_ai_response_round_trips(
+    client, db_session, token_manager, async_session_factory
+):
+    from sqlalchemy import event
+    from controllers.message import add_ai_response
+    from models.session import ChatSession
+
+    headers, _, _ = auth_headers(client, db_session, token_manager)
+    pid, cid = _setup_session_dependencies_api(client, headers)
+    sid = _uniq("s")
+    sync_engine = async_session_factory.kw["bind"].sync_engine
+    statements = []
+
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement.split()[0].upper())
+
+    async def _turn(text):
+        history = []
+        async with async_session_factory() as db:
+            event.listen(sync_engine, "before_cursor_execute", _count)
+            try:
+                message = await add_ai_response(
+                    case_id=cid,
+                    patient_id=pid,
+                    session_id=sid,
+                    content=[{"role": "user", "content": text}],
+                    safety={"score": 1},
+                    history=history,
+                    db=db,
+                )
+            finally:
+                event.remove(sync_engine, "before_cursor_execute", _count)
+            session = await db.get(ChatSession, sid)
+        return message, session, history
+
+    # First turn creates the session, later turns only bump time_updated
+    first, session, history = asyncio.run(_turn("hello"))
+    # Session upsert, message insert and analytics rollup upsert
+    assert statements == ["INSERT", "INSERT", "INSERT"]
+    assert first.session_id == sid and first.content[0]["content"] == "hello"
+    assert first.timestamp is not None and history[0]["session_id"] == sid
+    created = session.time_updated
+
+    statements.clear()
+    second, session, _ = asyncio.run(_turn("again"))
+    assert statements == ["INSERT", "INSERT", "INSERT"]
+    assert session.title == "New Session"
+    assert session.time_created == created
+    assert session.time_updated > created
+    assert second.message_id != first.message_id
+
+
+def test_chat_memory_reads_only_content(
+    client, db_session, token_manager, async_session_factory
+):
+    from sqlalchemy import event
+    from controllers.message import get_chat_history, get_chat_memory, history_cache
+
+    headers, _, _ = auth_headers(client, db_session, token_manager)
+    pid, cid = _setup_session_dependencies_api(client, headers)
+    sid = _uniq("s")
+    for prompt in ("first", "second"):
+        r = client.post(
+            "/api/v1/chat/",
+            params={
+                "session_id": sid,
+                "case_id": cid,
+                "patient_id": pid,
+                "prompt": prompt,
+                "debug": True,
+            },
+            headers=headers,
+        )
+        assert r.status_code == 200, r.text
+    sync_engine = async_session_factory.kw["bind"].sync_engine
+    statements = []
+
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    async def _load():
+        history_cache.discard(sid)
+        async with async_session_factory() as db:
+            history = await get_chat_history(sid, db)
+            event.listen(sync_engine, "before_cursor_execute", _record)
+            try:
+                memory = await get_chat_memory(sid, db)
+            finally:
+                event.remove(sync_engine, "before_cursor_execute", _record)
+            return history, memory, list(db.identity_map)
+
+    history, memory, identity_map = asyncio.run(_load())
+    assert memory == [turn for msg in history for turn in msg["content"]]
+    assert memory[0]["content"][-1]["text"] == "first"
+    assert identity_map == []
+    _, stream = statements
+    selected = stream.split("FROM")[0]
+    assert "content" in selected and "safety" not in selected
+
+
+def test_history_cache_write_through_and_version_check(
+    client, db_session, token_manager, async_session_factory
+):
+    from sqlalchemy import event, insert
+    from controllers.message import get_chat_memory, history_cache
+    from models.session import ChatSession
+    from models.session_message import SessionMessages
+
+    headers, _, _ = auth_headers(client, db_session, token_manager)
+    pid, cid = _setup_session_dependencies_api(client, headers)
+    sid = _uniq("s")
+
+    def _chat(prompt):
+        r = client.post(
+            "/api/v1/chat/",
+            params={
+                "session_id": sid,
+                "case_id": cid,
+                "patient_id": pid,
+                "prompt": prompt,
+                "debug": True,
+            },
+            headers=headers,
+        )
+        assert r.status_code == 200, r.text
+
+    sync_engine = async_session_factory.kw["bind"].sync_engine
+    statements = []
+
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    async def _memory():
+        statements.clear()
+        async with async_session_factory() as db:
+            event.listen(sync_engine, "before_cursor_execute", _count)
+            try:
+                memory = await get_chat_memory(sid, db)
+            finally:
+                event.remove(sync_engine, "before_cursor_execute", _count)
+        return [turn["content"][-1]["text"] for turn in memory], len(statements)
+
+    _chat("one")
+    _chat("two")  # cached by the first turn's read, then written through
+    texts, queries = asyncio.run(_memory())
+    assert texts[::2] == ["one", "two"] and queries == 1
+
+    # A write from another worker bumps the version, so the entry is reloaded
+    async def _write_elsewhere():
+        async with async_session_factory() as db:
+            await db.execute(
+                insert(SessionMessages).values(
+                    message_id=_uniq("m"),
+                    session_id=sid,
+                    case_id=cid,
+                    patient_id=pid,
+                    content=[
+                        {"role": "user", "content": [{"type": "text", "text": "x"}]}
+                    ],
+                    safety={},
+                    timestamp=datetime.datetime.now(datetime.UTC),
+                )
+            )
+            await db.execute(
+                ChatSession.__table__.update()
+                .where(ChatSession.session_id == sid)
+                .values(version=ChatSession.version + 1)
+            )
+            await db.commit()
+
+    asyncio.run(_write_elsewhere())
+    texts, queries = asyncio.run(_memory())
+    assert texts[-1] == "x" and queries == 2
+
+    assert sid in history_cache.entries
+    r = client.delete(f"/api/v1/cases/{cid}", headers=headers)
+    assert r.status_code == 200, r.text
+    assert sid not in history_cache.entries
+
+
+def test_history_cache_is_bounded_by_bytes():
+    from utils.history_cache import HistoryCache
+
+    cache = HistoryCache(max_bytes=250)  # three 73-byte entries
+    turn = [{"role": "user", "content": "x" * 40}]
+    for i in range(5):
+        cache.put(f"s{i}", ("t", 1), turn, ("c", "p"))
+    assert cache.size <= 250
+    assert list(cache.entries) == ["s2", "s3", "s4"]
+    assert cache.get("s2", ("t", 1)) == turn  # refreshes s2
+    cache.put("s5", ("t", 1), turn, ("c", "p"))
+    assert list(cache.entries) == ["s4", "s2", "s5"]
+    assert cache.get("s4", ("t", 2)) is None
+
+    cache.append("s2", ("t", 1), ("t", 2), turn)
+    assert cache.get("s2", ("t", 2)) == turn * 2
+    cache.append("s5", ("t", 0), ("t", 1), turn)  # missed a write: dropped
+    assert "s5" not in cache.entries
+    cache.put("huge", ("t", 1), turn * 10, ("c", "p"))
+    assert "huge" not in cache.entries
+
+
 def test_session_delete(client, db_session, token_manager):
     headers, _, _ = auth_headers(client, db_session, token_manager)
     pid, cid = _setup_session_dependencies_api(client, headers)
@@ -593,6 +1487,121 @@ def test_session_delete(client, db_session, token_manager):
     assert "deleted successfully" in dl.json()["detail"]
 
 
+def test_message_search_is_ranked_scoped_and_synced(
+    client, db_session, token_manager
+):
+    headers, _, _ = auth_headers(client, db_session, token_manager)
+    pid, cid = _setup_session_dependencies_api(client, headers)
+    other_pid, other_cid = _setup_session_dependencies_api(client, headers)
+    sid, other_sid = _uniq("s"), _uniq("s")
+
+    def _chat(session_id, case_id, patient_id, prompt):
+        r = client.post(
+            "/api/v1/chat/",
+            params={
+                "session_id": session_id,
+                "case_id": case_id,
+                "patient_id": patient_id,
+                "prompt": prompt,
+                "debug": True,
+            },
+            headers=headers,
+        )
+        assert r.status_code == 200, r.text
+        return r.json()["message_id"]
+
+    once = _chat(sid, cid, pid, "a migraine since Monday")
+    often = _chat(sid, cid, pid, "migraine again, the migraine aura and migraine pain")
+    _chat(sid, cid, pid, "trouble sleeping")
+    _chat(other_sid, other_cid, other_pid, "migraine as well")
+
+    def _search(**params):
+        return client.get("/api/v1/history/search", params=params, headers=headers)
+
+    r = _search(q="migraines", patient_id=pid)
+    assert r.status_code == 200, r.text
+    results = r.json()["results"]
+    assert [hit["message_id"] for hit in results] == [often, once]
+    assert results[0]["session_id"] == sid and "migraine" in results[0]["snippet"]
+    assert r.json()["next_offset"] is None
+    assert len(_search(q="migraine", case_id=other_cid).json()["results"]) == 1
+
+    first = _search(q="migraine", patient_id=pid, limit=1).json()
+    assert [hit["message_id"] for hit in first["results"]] == [often]
+    rest = _search(q="migraine", patient_id=pid, limit=1, offset=first["next_offset"])
+    assert [hit["message_id"] for hit in rest.json()["results"]] == [once]
+    assert rest.json()["next_offset"] is None
+
+    # Query syntax in the input is searched for, not interpreted.
+    assert _search(q='migraine" OR (', patient_id=pid).status_code == 200
+    assert _search(q="migraine").status_code == 400
+    client.delete(f"/api/v1/history/session/{sid}", headers=headers)
+    assert _search(q="migraine", patient_id=pid).json()["results"] == []
+
+
+def test_idle_session_is_archived_and_restored_on_access(
+    client, db_session, token_manager, async_session_factory, monkeypatch
+):
+    import controllers.archive as archive
+    import controllers.message
+    from sqlalchemy import update
+    from models.session import ChatSession, SessionArchive
+    from models.session_message import SessionMessages
+
+    monkeypatch.setattr(archive, "SessionLocal", async_session_factory)
+    monkeypatch.setattr(controllers.message, "SessionLocal", async_session_factory)
+    headers, _, _ = auth_headers(client, db_session, token_manager)
+    pid, cid = _setup_session_dependencies_api(client, headers)
+    sid = _uniq("s")
+
+    def _chat(prompt):
+        r = client.post(
+            "/api/v1/chat/",
+            params={
+                "session_id": sid,
+                "case_id": cid,
+                "patient_id": pid,
+                "prompt": prompt,
+                "debug": True,
+            },
+            headers=headers,
+        )
+        assert r.status_code == 200, r.text
+        return r.json()["message_id"]
+
+    def _archive():
+        db_session.execute(
+            update(ChatSession)
+            .where(ChatSession.session_id == sid)
+            .values(time_updated="2000-01-01T00:00:00+00:00")
+        )
+        db_session.commit()
+        return asyncio.run(archive.archive_idle_sessions(days=30))
+
+    def _history():
+        r = client.get(f"/api/v1/history/messages/{sid}", headers=headers)
+        assert r.status_code == 200, r.text
+        return r.json()["conversations"]
+
+    first, second = _chat("first"), _chat("second")
+    before = _history()
+    assert _archive() >= 1
+    assert _count_rows(db_session, SessionMessages, session_id=sid) == 0
+    stored = db_session.get(SessionArchive, sid)
+    assert stored.message_count == 2 and len(stored.data) < stored.raw_size
+    db_session.expire_all()
+
+    # Reading the history brings the messages back unchanged.
+    assert _history() == before
+    assert _count_rows(db_session, SessionArchive, session_id=sid) == 0
+    assert _count_rows(db_session, SessionMessages, session_id=sid) == 2
+
+    assert _archive() >= 1
+    third = _chat("third")
+    assert [m["message_id"] for m in _history()] == [first, second, third]
+    assert _count_rows(db_session, SessionArchive, session_id=sid) == 0
+
+
 #########################
 # Chat Predict Endpoint
 #########################
@@ -724,6 +1733,11 @@ def test_like_ai_message(client, db_session, token_manager):
     assert like.status_code == 200, like.text
     assert like.json().get("detail") == "Liked message."
 
+    missing = client.post(
+        "/api/v1/chat/like-message/missing", params={"like": True}, headers=headers
+    )
+    assert missing.status_code == 404
+
 
 def test_submit_feedback(client, db_session, token_manager):
     headers, _, _ = auth_headers(client, db_session, token_manager)
@@ -758,6 +1772,15 @@ def test_submit_feedback(client, db_session, token_manager):
     assert fb.status_code == 200, fb.text
     assert fb.json().get("detail") == "Feedback submitted."
 
+    for method, path in (
+        (client.post, "submit-feedback"),
+        (client.put, "edit-feedback"),
+    ):
+        missing = method(
+            f"/api/v1/chat/{path}/missing", params={"stars": 5}, headers=headers
+        )
+        assert missing.status_code == 404
+
 
 def test_edit_feedback(client, db_session, token_manager):
     headers, _, _ = auth_headers(client, db_session, token_manager)
@@ -801,3 +1824,948 @@ def test_edit_feedback(client, db_session, token_manager):
     assert edit.status_code == 200, edit.text
     # Controller returns the same message string for submit/edit
     assert edit.json().get("detail") == "Feedback submitted."
+
+
+def test_write_behind_queue_merges_and_batches(
+    client, db_session, token_manager, async_session_factory, caplog
+):
+    from sqlalchemy import event, select
+    from utils.write_behind import WriteBehindQueue
+    from models.session_message import SessionMessages
+
+    headers, _, _ = auth_headers(client, db_session, token_manager)
+    pid, cid = _setup_session_dependencies_api(client, headers)
+    sid, ids = _uniq("s"), [_uniq("m") for _ in range(3)]
+    _create_session(client, headers, sid, cid, pid)
+    sync_engine = async_session_factory.kw["bind"].sync_engine
+    statements = []
+
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement.split()[0].upper(), executemany))
+
+    async def _run():
+        async with async_session_factory() as db:
+            db.add_all(
+                SessionMessages(
+                    message_id=message_id,
+                    session_id=sid,
+                    case_id=cid,
+                    patient_id=pid,
+                    content=[],
+                    safety={},
+                )
+                for message_id in ids
+            )
+            await db.commit()
+        queue = WriteBehindQueue(
+            SessionMessages, "message_id", async_session_factory, max_batch=3
+        )
+        queue.submit(ids[0], like="true")
+        queue.submit(ids[0], like="false", stars=2)
+        queue.submit(ids[1], feedback="helpful")
+        queue.submit(ids[2], like="true", stars=1)
+        queue.submit("missing", like="true", stars=1)
+        assert queue.pending[ids[0]] == {"like": "false", "stars": 2}
+
+        event.listen(sync_engine, "before_cursor_execute", _count)
+        try:
+            with caplog.at_level("WARNING", logger="app.write_behind"):
+                assert await queue.flush() == 4
+        finally:
+            event.remove(sync_engine, "before_cursor_execute", _count)
+
+        # The size trigger wakes the worker before the interval elapses
+        queue.flush_interval = 60
+        queue.start()
+        for message_id in ids:
+            queue.submit(message_id, stars=5)
+        for _ in range(100):
+            if not queue.pending:
+                break
+            await asyncio.sleep(0.01)
+        assert queue.pending == {}
+
+        # Anything left when the app shuts down is flushed by drain
+        queue.submit(ids[2], feedback="late")
+        await queue.drain()
+        async with async_session_factory() as db:
+            rows = await db.scalars(
+                select(SessionMessages)
+                .where(SessionMessages.session_id == sid)
+                .order_by(SessionMessages.message_id)
+            )
+            return {row.message_id: (row.like, row.feedback, row.stars) for row in rows}
+
+    rows = asyncio.run(_run())
+    # One lookup of the keys, then one executemany UPDATE per set of columns
+    assert sorted(statements) == [
+        ("SELECT", False),
+        ("UPDATE", False),
+        ("UPDATE", True),
+    ]
+    assert "dropped updates to 1 missing session_messages rows: missing" in caplog.text
+    assert rows[ids[0]] == ("false", None, 5)
+    assert rows[ids[1]] == (None, "helpful", 5)
+    assert rows[ids[2]] == ("true", "late", 5)
+
+
+def test_feedback_is_visible_before_it_is_flushed(
+    client, db_session, token_manager, monkeypatch
+):
+    from controllers.message import message_updates
+
+    headers, _, _ = auth_headers(client, db_session, token_manager)
+    pid, cid = _setup_session_dependencies_api(client, headers)
+    sid = _uniq("s")
+    r = client.post(
+        "/api/v1/chat/",
+        params={
+            "session_id": sid,
+            "case_id": cid,
+            "patient_id": pid,
+            "prompt": "Hello",
+            "debug": True,
+        },
+        headers=headers,
+    )
+    assert r.status_code == 200, r.text
+    url = f"/api/v1/history/messages/{sid}"
+    message_id = client.get(url, headers=headers).json()["conversations"][-1][
+        "message_id"
+    ]
+
+    async def _hold():
+        return 0
+
+    # Hold the worker back; the lifespan drain flushes after monkeypatch undoes this
+    monkeypatch.setattr(message_updates, "flush", _hold)
+    fb = client.post(
+        f"/api/v1/chat/submit-feedback/{message_id}",
+        params={"feedback": "Clear answer", "stars": 4},
+        headers=headers,
+    )
+    assert fb.status_code == 200, fb.text
+    assert message_updates.pending_values(message_id) == {
+        "feedback": "Clear answer",
+        "stars": 4,
+    }
+    (message,) = client.get(url, headers=headers).json()["conversations"]
+    assert (message["feedback"], message["stars"]) == ("Clear answer", 4)
+    bad = client.post(
+        f"/api/v1/chat/submit-feedback/{message_id}",
+        params={"stars": 9},
+        headers=headers,
+    )
+    assert bad.status_code == 422
+
+
+def test_message_analytics_come_from_rollups(
+    client, db_session, token_manager, async_session_factory
+):
+    import time
+
+    headers, _, _ = auth_headers(client, db_session, token_manager)
+    pid, cid = _setup_session_dependencies_api(client, headers)
+    sid, model = _uniq("s"), _uniq("model")
+    ids = []
+    for prompt in ("first", "second"):
+        r = client.post(
+            "/api/v1/chat/",
+            params={
+                "session_id": sid,
+                "case_id": cid,
+                "patient_id": pid,
+                "prompt": prompt,
+                "model": model,
+                "debug": True,
+            },
+            headers=headers,
+        )
+        assert r.status_code == 200, r.text
+        ids.append(r.json()["message_id"])
+
+    def _stats(**params):
+        r = client.get(
+            "/api/v1/analytics/messages",
+            params={"case_id": cid, **params},
+            headers=headers,
+        )
+        assert r.status_code == 200, r.text
+        return r.json()["groups"]
+
+    def _wait_for(check):
+        # Feedback reaches the rollups with the write-behind flush.
+        for _ in range(50):
+            (group,) = _stats()
+            if check(group):
+                return group
+            time.sleep(0.1)
+        raise AssertionError(group)
+
+    (group,) = _stats()
+    assert group["model"] == model and group["messages"] == 2
+    assert group["safety_levels"] == {"High": 2} and group["avg_safety_score"] == 100
+    assert group["avg_stars"] is None and group["like_ratio"] is None
+
+    client.post(
+        f"/api/v1/chat/like-message/{ids[0]}", params={"like": True}, headers=headers
+    )
+    client.post(
+        f"/api/v1/chat/like-message/{ids[1]}", params={"like": False}, headers=headers
+    )
+    client.post(
+        f"/api/v1/chat/submit-feedback/{ids[0]}", params={"stars": 4}, headers=headers
+    )
+    group = _wait_for(lambda group: group["rated"] == 1)
+    assert (group["avg_stars"], group["like_ratio"]) == (4, 0.5)
+    # An edit replaces the earlier rating instead of adding to it.
+    client.put(
+        f"/api/v1/chat/edit-feedback/{ids[0]}", params={"stars": 2}, headers=headers
+    )
+    group = _wait_for(lambda group: group["avg_stars"] == 2)
+    assert (group["rated"], group["likes"], group["dislikes"]) == (1, 1, 1)
+
+    sync_engine = async_session_factory.kw["bind"].sync_engine
+    statements = []
+
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(sync_engine, "before_cursor_execute", _record)
+    try:
+        (day,) = _stats(group_by=["day", "model"])
+    finally:
+        event.remove(sync_engine, "before_cursor_execute", _record)
+    assert day["day"] == datetime.datetime.now(datetime.UTC).date().isoformat()
+    assert not any("session_messages" in statement for statement in statements)
+    r = client.get(
+        "/api/v1/analytics/messages", params={"group_by": "patient"}, headers=headers
+    )
+    assert r.status_code == 400
+    for since, until in (("2024-13-01", None), ("2024-02-02", "2024-02-01")):
+        r = client.get(
+            "/api/v1/analytics/messages",
+            params={"since": since, "until": until},
+            headers=headers,
+        )
+        assert r.status_code == 422
+
+
+#########################
+# File processing
+#########################
+def _make_pdf(text: str | None = None) -> bytes:
+    import pymupdf
+
+    doc = pymupdf.open()
+    page = doc.new_page()
+    if text:
+        page.insert_textbox(pymupdf.Rect(36, 36, 560, 800), text)
+    return doc.tobytes()
+
+
+def test_chat_predict_pdf_text_layer(client, db_session, token_manager):
+    headers, _, _ = auth_headers(client, db_session, token_manager)
+    pid, cid = _setup_session_dependencies_api(client, headers)
+    sid = _uniq("s")
+    report = "Chest radiograph shows no acute cardiopulmonary findings. " * 10
+    r = client.post(
+        "/api/v1/chat/",
+        params={
+            "session_id": sid,
+            "case_id": cid,
+            "patient_id": pid,
+            "prompt": "Summarise the report",
+            "debug": True,
+        },
+        files=[("files", ("report.pdf", _make_pdf(report), "application/pdf"))],
+        headers=headers,
+    )
+    assert r.status_code == 200, r.text
+
+    hist = client.get(f"/api/v1/history/messages/{sid}", headers=headers)
+    user_parts = hist.json()["conversations"][-1]["content"][0]["content"]
+    assert all(part["type"] == "text" for part in user_parts)
+    assert "no acute cardiopulmonary findings" in user_parts[-1]["text"]
+
+
+def test_chat_predict_pdf_scanned_page_rasterized(client, db_session, token_manager):
+    headers, _, _ = auth_headers(client, db_session, token_manager)
+    pid, cid = _setup_session_dependencies_api(client, headers)
+    sid = _uniq("s")
+    r = client.post(
+        "/api/v1/chat/",
+        params={
+            "session_id": sid,
+            "case_id": cid,
+            "patient_id": pid,
+            "prompt": "What does the scan show?",
+            "debug": True,
+        },
+        files=[("files", ("scan.pdf", _make_pdf(), "application/pdf"))],
+        headers=headers,
+    )
+    assert r.status_code == 200, r.text
+
+    hist = client.get(f"/api/v1/history/messages/{sid}", headers=headers)
+    user_parts = hist.json()["conversations"][-1]["content"][0]["content"]
+    assert [part["type"] for part in user_parts] == ["image", "text"]
+
+
+def test_pdf_failed_page_is_recorded(monkeypatch):
+    import utils.file_processor as file_processor
+
+    def _broken(page):
+        raise RuntimeError("corrupt page")
+
+    monkeypatch.setattr(file_processor, "_image_coverage", _broken)
+    result = file_processor.pdf_bytes_to_content(_make_pdf("text"), "broken.pdf")
+    assert result["images"] == [] and result["text"] == []
+    (page,) = result["pages"]
+    assert page["page"] == 1 and page["mode"] == "error"
+    assert page["error"] == "corrupt page"
+
+
+def _make_png() -> bytes:
+    from io import BytesIO
+    from PIL import Image
+
+    buffer = BytesIO()
+    Image.new("RGB", (64, 48), color=(120, 30, 200)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_chat_predict_reuploaded_image_is_deduplicated(
+    client, db_session, token_manager, monkeypatch
+):
+    import controllers.attachment as attachment_controller
+    from models.attachment import Attachment
+
+    calls = []
+    original = attachment_controller.encode_image_bytes
+    monkeypatch.setattr(
+        attachment_controller,
+        "encode_image_bytes",
+        lambda data, policy: calls.append(data) or original(data, policy),
+    )
+
+    headers, _, _ = auth_headers(client, db_session, token_manager)
+    pid, cid = _setup_session_dependencies_api(client, headers)
+    sid = _uniq("s")
+    png = _make_png() + uuid.uuid4().bytes  # trailing bytes keep the hash unique
+    for _ in range(2):
+        r = client.post(
+            "/api/v1/chat/",
+            params={
+                "session_id": sid,
+                "case_id": cid,
+                "patient_id": pid,
+                "prompt": "Any fracture?",
+                "debug": True,
+            },
+            files=[("files", ("xray.png", png, "image/png"))],
+            headers=headers,
+        )
+        assert r.status_code == 200, r.text
+
+    assert len(calls) == 1
+    hist = client.get(f"/api/v1/history/messages/{sid}", headers=headers)
+    image_parts = [
+        part
+        for msg in hist.json()["conversations"]
+        for part in msg["content"][0]["content"]
+        if part["type"] == "image"
+    ]
+    assert len(image_parts) == 2
+    assert len({part["attachment_id"] for part in image_parts}) == 1
+    assert all("image" not in part for part in image_parts)
+    assert (
+        db_session.query(Attachment)
+        .filter(Attachment.attachment_id == image_parts[0]["attachment_id"])
+        .count()
+        == 1
+    )
+
+
+#########################
+# Case attachments
+#########################
+def test_database_store_put_is_idempotent_and_uncommitted(
+    client, async_session_factory
+):
+    from utils.attachment_store import DatabaseAttachmentStore
+
+    store = DatabaseAttachmentStore()
+    key = _uniq("blob")
+
+    async def _run():
+        async with async_session_factory() as db:
+            await store.put(key, b"first", db)
+            await store.put(key, b"second", db)
+            assert await store.get(key, db) == b"first"
+            await db.rollback()
+        async with async_session_factory() as db:
+            return await store.exists(key, db)
+
+    assert asyncio.run(_run()) is False
+
+
+def test_database_store_caps_blob_size(client, db_session, token_manager, monkeypatch):
+    import utils.attachment_store
+    from io import BytesIO
+    from utils.attachment_store import DatabaseAttachmentStore
+
+    store = DatabaseAttachmentStore(max_blob_bytes=1024)
+    with pytest.raises(ValueError):
+        asyncio.run(store.put_file(_uniq("blob"), BytesIO(b"\0" * 1025), None))
+
+    monkeypatch.setattr(utils.attachment_store, "_store", store)
+    headers, _, _ = auth_headers(client, db_session, token_manager)
+    pid, cid = _setup_session_dependencies_api(client, headers)
+    r = client.post(
+        f"/api/v1/cases/{cid}/attachments",
+        files=[("files", ("big.png", b"\0" * 2048, "image/png"))],
+        headers=headers,
+    )
+    assert r.status_code == 413
+    assert "per-file limit of 1024" in r.json()["detail"]
+
+def test_case_attachment_upload_and_list(client, db_session, token_manager):
+    headers, _, _ = auth_headers(client, db_session, token_manager)
+    pid, cid = _setup_session_dependencies_api(client, headers)
+    up = client.post(
+        f"/api/v1/cases/{cid}/attachments",
+        files=[("files", ("xray.png", _make_png(), "image/png"))],
+        headers=headers,
+    )
+    assert up.status_code == 200, up.text
+    attachment_id = up.json()["attachments"][0]["attachment_id"]
+
+    ls = client.get(f"/api/v1/cases/{cid}/attachments", headers=headers)
+    assert ls.status_code == 200
+    (entry,) = ls.json()["attachments"]
+    assert entry["attachment_id"] == attachment_id
+    assert entry["status"] == "ready"
+
+    dl = client.delete(
+        f"/api/v1/cases/{cid}/attachments/{attachment_id}", headers=headers
+    )
+    assert dl.status_code == 200
+    gt = client.get(f"/api/v1/cases/{cid}/attachments/{attachment_id}", headers=headers)
+    assert gt.status_code == 404
+
+
+def test_chat_predict_with_case_attachment_ids(client, db_session, token_manager):
+    headers, _, _ = auth_headers(client, db_session, token_manager)
+    pid, cid = _setup_session_dependencies_api(client, headers)
+    report = "Lumbar spine MRI demonstrates mild disc desiccation at L4-L5. " * 10
+    up = client.post(
+        f"/api/v1/cases/{cid}/attachments",
+        files=[("files", ("mri.pdf", _make_pdf(report), "application/pdf"))],
+        headers=headers,
+    )
+    assert up.status_code == 200, up.text
+    attachment_id = up.json()["attachments"][0]["attachment_id"]
+
+    sid = _uniq("s")
+    r = client.post(
+        "/api/v1/chat/",
+        params={
+            "session_id": sid,
+            "case_id": cid,
+            "patient_id": pid,
+            "prompt": "Summarise",
+            "attachment_ids": [attachment_id],
+            "debug": True,
+        },
+        headers=headers,
+    )
+    assert r.status_code == 200, r.text
+    hist = client.get(f"/api/v1/history/messages/{sid}", headers=headers)
+    user_parts = hist.json()["conversations"][-1]["content"][0]["content"]
+    assert "mild disc desiccation" in user_parts[-1]["text"]
+
+    missing = client.post(
+        "/api/v1/chat/",
+        params={
+            "session_id": sid,
+            "case_id": cid,
+            "patient_id": pid,
+            "prompt": "Summarise",
+            "attachment_ids": ["does-not-exist"],
+            "debug": True,
+        },
+        headers=headers,
+    )
+    assert missing.status_code == 404
+
+
+def test_case_attachment_upload_size_limits(
+    client, db_session, token_manager, monkeypatch
+):
+    import utils.upload
+
+    headers, _, _ = auth_headers(client, db_session, token_manager)
+    pid, cid = _setup_session_dependencies_api(client, headers)
+    monkeypatch.setattr(utils.upload, "MAX_UPLOAD_FILE_BYTES", 1024)
+    too_big = client.post(
+        f"/api/v1/cases/{cid}/attachments",
+        files=[("files", ("big.png", b"\0" * 2048, "image/png"))],
+        headers=headers,
+    )
+    assert too_big.status_code == 413
+
+    monkeypatch.setattr(utils.upload, "MAX_UPLOAD_FILE_BYTES", 4096)
+    monkeypatch.setattr(utils.upload, "MAX_UPLOAD_REQUEST_BYTES", 4096)
+    too_many = client.post(
+        f"/api/v1/cases/{cid}/attachments",
+        files=[
+            ("files", ("a.png", b"\1" * 3000, "image/png")),
+            ("files", ("b.png", b"\2" * 3000, "image/png")),
+        ],
+        headers=headers,
+    )
+    assert too_many.status_code == 413
+
+
+def test_oversized_upload_rejected_before_form_parsing(
+    client, db_session, token_manager, monkeypatch
+):
+    import starlette.requests
+    import utils.upload
+
+    headers, _, _ = auth_headers(client, db_session, token_manager)
+    pid, cid = _setup_session_dependencies_api(client, headers)
+    parsed = []
+    original_form = starlette.requests.Request.form
+    monkeypatch.setattr(
+        starlette.requests.Request,
+        "form",
+        lambda self, **kwargs: parsed.append(self.url.path) or original_form(
+            self, **kwargs
+        ),
+    )
+    monkeypatch.setattr(utils.upload, "MAX_UPLOAD_REQUEST_BYTES", 4096)
+    r = client.post(
+        f"/api/v1/cases/{cid}/attachments",
+        files=[("files", ("big.png", b"\0" * 8192, "image/png"))],
+        headers=headers,
+    )
+    assert r.status_code == 413
+    assert "per-request limit of 4096" in r.json()["detail"]
+    assert parsed == []
+
+    # Without a Content-Length the body is counted as it streams in
+    def _chunks():
+        yield b"\0" * 3000
+        yield b"\0" * 3000
+
+    r = client.post(
+        f"/api/v1/cases/{cid}/attachments",
+        content=_chunks(),
+        headers={**headers, "Content-Type": "multipart/form-data; boundary=x"},
+    )
+    assert r.status_code == 413
+
+
+def test_upload_routes_spool_without_patching_starlette(
+    client, db_session, token_manager, monkeypatch
+):
+    import starlette.formparsers
+    import utils.upload
+
+    headers, _, _ = auth_headers(client, db_session, token_manager)
+    pid, cid = _setup_session_dependencies_api(client, headers)
+    parser = utils.upload.SpoolingMultiPartParser
+    assert starlette.formparsers.MultiPartParser.max_file_size == 1024 * 1024
+    monkeypatch.setattr(parser, "max_file_size", 16)
+    spooled = []
+    original_parse = parser.parse
+
+    async def _parse(self):
+        form = await original_parse(self)
+        spooled.extend(upload.file._rolled for _, upload in form.multi_items())
+        return form
+
+    monkeypatch.setattr(parser, "parse", _parse)
+    r = client.post(
+        f"/api/v1/cases/{cid}/attachments",
+        files=[("files", ("a.png", b"\1" * 64, "image/png"))],
+        headers=headers,
+    )
+    assert r.status_code == 200, r.text
+    assert spooled == [True]
+
+def test_import_upload_has_its_own_request_limit(
+    client, db_session, token_manager, async_session_factory, monkeypatch
+):
+    import controllers.bulk_import as bulk_import
+    import utils.upload
+
+    monkeypatch.setattr(bulk_import, "SessionLocal", async_session_factory)
+    monkeypatch.setattr(utils.upload, "MAX_UPLOAD_REQUEST_BYTES", 4096)
+    headers, _, _ = auth_headers(client, db_session, token_manager)
+    rows = "".join(f"{_uniq('il')},{'N' * 40}\n" for _ in range(100))
+    body = f"patient_id,name\n{rows}".encode()
+    assert len(body) > 4096
+
+    def _import():
+        return client.post(
+            "/api/v1/imports/patients",
+            files=[("file", ("clinic.csv", body, "text/csv"))],
+            headers=headers,
+        )
+
+    r = _import()
+    assert r.status_code == 200, r.text
+    job_id = r.json()["job"]["job_id"]
+    job = client.get(f"/api/v1/imports/{job_id}", headers=headers).json()["job"]
+    assert (job["status"], job["rows_inserted"]) == ("done", 100)
+
+    monkeypatch.setattr(utils.upload, "MAX_IMPORT_REQUEST_BYTES", 4096)
+    r = _import()
+    assert r.status_code == 413
+    assert "per-request limit of 4096" in r.json()["detail"]
+
+def test_processed_image_keeps_aspect_ratio(
+    client, db_session, token_manager, async_session_factory
+):
+    from io import BytesIO
+    from PIL import Image
+    from controllers.attachment import get_processed_attachment, load_processed_image
+    from models.attachment import Attachment
+
+    headers, _, _ = auth_headers(client, db_session, token_manager)
+    pid, cid = _setup_session_dependencies_api(client, headers)
+    buffer = BytesIO()
+    Image.new("RGB", (2000, 1000), color=(10, 200, 30)).save(buffer, format="PNG")
+    up = client.post(
+        f"/api/v1/cases/{cid}/attachments",
+        files=[("files", ("wide.png", buffer.getvalue() + uuid.uuid4().bytes, "image/png"))],
+        headers=headers,
+    )
+    assert up.status_code == 200, up.text
+    attachment_id = up.json()["attachments"][0]["attachment_id"]
+
+    async def _process():
+        async with async_session_factory() as db:
+            attachment = await db.get(Attachment, attachment_id)
+            processed = await get_processed_attachment(attachment, db)
+            (image,) = processed["images"]
+            return image, await load_processed_image(image, db)
+
+    image, data = asyncio.run(_process())
+    assert image["mime_type"] == "image/jpeg"
+    encoded = Image.open(BytesIO(data))
+    assert encoded.format == "JPEG"
+    assert encoded.size == (768, 384)
+
+
+def test_16bit_grayscale_image_keeps_its_range():
+    from io import BytesIO
+    from PIL import Image
+    from utils.file_processor import ImageEncodingPolicy
+
+    gradient = Image.new("I", (256, 16))
+    gradient.putdata([x * 257 for x in range(256)] * 16)  # 0..65535
+    buffer = BytesIO()
+    gradient.save(buffer, format="PNG")
+
+    for fmt in ("JPEG", "WEBP", "PNG"):
+        with Image.open(BytesIO(buffer.getvalue())) as image:
+            assert image.mode.startswith("I")
+            encoded = ImageEncodingPolicy(fmt).encode(image)
+        pixels = list(Image.open(BytesIO(encoded)).convert("L").getdata())
+        assert min(pixels) <= 5 and max(pixels) >= 250
+        assert pixels.count(255) / len(pixels) < 0.05
+        assert len(set(pixels)) > 200
+
+
+#########################
+# Database settings
+#########################
+
+
+def test_database_settings_stale_connection_modes():
+    from database.database import DatabaseSettings, TimedQueuePool
+
+    pg_url = "postgresql+asyncpg://u:p@db/app"
+    pre_ping = DatabaseSettings(pool_size=3).engine_kwargs(pg_url)
+    assert pre_ping["pool_pre_ping"] is True and "pool_recycle" not in pre_ping
+    assert pre_ping["pool_size"] == 3 and pre_ping["poolclass"] is TimedQueuePool
+    recycle = DatabaseSettings(stale_connections="recycle", pool_recycle=60)
+    kwargs = recycle.engine_kwargs(pg_url)
+    assert kwargs["pool_recycle"] == 60 and "pool_pre_ping" not in kwargs
+    assert DatabaseSettings().engine_kwargs("sqlite+aiosqlite://") == {}
+
+
+def test_sqlite_profile_pragmas(test_db_url):
+    from sqlalchemy import text
+    from database.database import engine
+
+    if engine.dialect.name != "sqlite":
+        pytest.skip("SQLite profile only")
+
+    async def _pragmas():
+        try:
+            async with engine.connect() as conn:
+                return [
+                    (await conn.execute(text(f"PRAGMA {name}"))).scalar()
+                    for name in ("journal_mode", "synchronous", "foreign_keys")
+                ]
+        finally:
+            await engine.dispose()
+
+    # synchronous=NORMAL is reported as 1
+    assert asyncio.run(_pragmas()) == ["wal", 1, 1]
+
+
+def test_pool_records_checkout_wait(test_db_url, monkeypatch):
+    import database.database as database
+    from sqlalchemy.exc import TimeoutError
+
+    from sqlalchemy import event
+
+    waits, timeouts, connects = [], [], []
+    monkeypatch.setattr(
+        database.POOL_CHECKOUT_WAIT, "record", lambda value, **_: waits.append(value)
+    )
+    monkeypatch.setattr(
+        database.POOL_CHECKOUT_TIMEOUTS, "add", lambda value, **_: timeouts.append(value)
+    )
+    monkeypatch.setattr(
+        database.POOL_CONNECT_TIME, "record", lambda value, **_: connects.append(value)
+    )
+    pool_engine = create_async_engine(
+        database.to_async_url(test_db_url),
+        poolclass=database.TimedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.2,
+    )
+    # A slow connect is connect time, not time spent waiting for the pool
+    event.listen(
+        pool_engine.sync_engine,
+        "do_connect",
+        lambda *args: time.sleep(0.3),
+    )
+
+    async def _exhaust():
+        try:
+            async with pool_engine.connect():
+                with pytest.raises(TimeoutError):
+                    async with pool_engine.connect():
+                        pass
+        finally:
+            await pool_engine.dispose()
+
+    asyncio.run(_exhaust())
+    assert timeouts == [1]
+    assert waits[0] == 0.0 and waits[1] >= 200
+    assert len(connects) == 1 and connects[0] >= 300
+
+
+def test_read_router_stickiness_and_lag_fallback(tmp_path, monkeypatch):
+    import database.database as database
+    from sqlalchemy import text
+    from starlette.requests import Request
+
+    engines = {
+        name: create_async_engine(
+            f"sqlite+aiosqlite:///{tmp_path}/{name}.sqlite", poolclass=NullPool
+        )
+        for name in ("primary", "replica")
+    }
+    factories = {
+        name: async_sessionmaker(bind=engine_) for name, engine_ in engines.items()
+    }
+    unreachable = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path}/missing/replica.sqlite", poolclass=NullPool
+    )
+
+    async def _served_by(router, user_id):
+        async with (await router.session_factory(user_id))() as db:
+            return await db.scalar(text("SELECT name FROM node"))
+
+    async def _run():
+        try:
+            for name, engine_ in engines.items():
+                async with engine_.begin() as conn:
+                    await conn.execute(text("CREATE TABLE node (name VARCHAR)"))
+                    await conn.execute(text(f"INSERT INTO node VALUES ('{name}')"))
+            router = database.ReadRouter(
+                factories["primary"],
+                factories["replica"],
+                sticky_seconds=60,
+                lag_check_interval=0,
+            )
+            served = [await _served_by(router, "u1")]
+            router.note_write("u1")
+            served += [await _served_by(router, "u1"), await _served_by(router, "u2")]
+            monkeypatch.setitem(database.REPLICA_LAG_QUERIES, "sqlite", "SELECT 30")
+            served.append(await _served_by(router, "u2"))
+            down = database.ReadRouter(
+                factories["primary"], async_sessionmaker(bind=unreachable)
+            )
+            served.append(await _served_by(down, "u2"))
+            return served
+        finally:
+            for engine_ in (*engines.values(), unreachable):
+                await engine_.dispose()
+
+    served = asyncio.run(_run())
+    assert served == ["replica", "primary", "replica", "primary", "primary"]
+
+    # A write through get_db makes the token's user sticky.
+    token = database.jwt.encode({"sub": "writer"}, "secret")
+    request = Request(
+        {
+            "type": "http",
+            "method": "POST",
+            "headers": [(b"authorization", f"Bearer {token}".encode())],
+        }
+    )
+
+    async def _write():
+        dependency = database.get_db(request)
+        await dependency.__anext__()
+        await dependency.aclose()
+
+    asyncio.run(_write())
+    assert database.read_router.is_sticky("writer")
+    assert not database.read_router.is_sticky("reader")
+
+
+def test_read_router_runs_one_lag_probe_at_a_time(tmp_path):
+    import database.database as database
+
+    engine_ = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path}/replica.sqlite", poolclass=NullPool
+    )
+    replica = async_sessionmaker(bind=engine_)
+    probes = []
+
+    def _counting_replica():
+        probes.append(1)
+        return replica()
+
+    async def _run():
+        try:
+            router = database.ReadRouter(
+                async_sessionmaker(bind=engine_), _counting_replica
+            )
+            lags = await asyncio.gather(*(router.replica_lag() for _ in range(10)))
+            return lags + [await router.replica_lag()]
+        finally:
+            await engine_.dispose()
+
+    assert asyncio.run(_run()) == [0.0] * 11
+    assert len(probes) == 1
+
+
+def test_migrations_add_indexes_to_existing_schema(tmp_path):
+    from sqlalchemy import inspect, text
+    from database.database import Base
+    from database.migrations import MIGRATIONS, run_migrations
+
+    index_names = [
+        "ix_session_messages_session_id_timestamp",
+        "ix_session_messages_patient_id",
+        "ix_users_email",
+        "ix_patients_deleted_at",
+        "ix_cases_deleted_at",
+        "ix_chat_session_deleted_at",
+        "ix_chat_session_time_updated",
+        "ix_chat_session_case_id_patient_id_time_updated",
+        "ix_case_tags_tag_case_id",
+        "ix_case_tags_patient_id_tag",
+        "ix_patients_name_normalized",
+    ]
+    added_columns = [
+        ("chat_session", "version"),
+        ("patients", "deleted_at"),
+        ("cases", "deleted_at"),
+        ("chat_session", "deleted_at"),
+        ("session_messages", "search_text"),
+        ("chat_session", "archived_at"),
+        ("session_messages", "model"),
+        ("chat_session", "message_count"),
+        ("chat_session", "last_message_id"),
+        ("chat_session", "last_safety_level"),
+        ("patients", "name_normalized"),
+    ]
+    legacy_engine = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path}/legacy.sqlite", poolclass=NullPool
+    )
+
+    async def _migrate():
+        try:
+            async with legacy_engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+                # Simulate a database created before the indexes existed
+                for name in index_names:
+                    await conn.execute(text(f"DROP INDEX {name}"))
+                for table, column in added_columns:
+                    await conn.execute(text(f"ALTER TABLE {table} DROP COLUMN {column}"))
+                first = await run_migrations(conn)
+                second = await run_migrations(conn)
+                indexes = await conn.run_sync(
+                    lambda sync_conn: {
+                        index["name"]
+                        for table in (
+                            "session_messages",
+                            "users",
+                            "patients",
+                            "cases",
+                            "chat_session",
+                            "case_tags",
+                        )
+                        for index in inspect(sync_conn).get_indexes(table)
+                    }
+                )
+                columns = await conn.run_sync(
+                    lambda sync_conn: {
+                        (table, column["name"])
+                        for table, _ in added_columns
+                        for column in inspect(sync_conn).get_columns(table)
+                    }
+                )
+            return first, second, indexes, columns
+        finally:
+            await legacy_engine.dispose()
+
+    first, second, indexes, columns = asyncio.run(_migrate())
+    assert first == [version for version, _, _ in MIGRATIONS]
+    assert second == []
+    assert set(index_names) <= indexes
+    assert "ix_chat_session_case_id_patient_id" not in indexes
+    assert set(added_columns) <= columns
+
+
+def test_hot_lookups_use_indexes(engine):
+    from sqlalchemy import desc, select, text
+    from models.session import ChatSession
+    from models.session_message import SessionMessages
+    from models.token import Token
+    from models.user import User
+
+    if engine.dialect.name != "sqlite":
+        pytest.skip("EXPLAIN QUERY PLAN is SQLite specific")
+    lookups = {
+        "ix_session_messages_session_id_timestamp": select(SessionMessages).where(
+            SessionMessages.session_id == "s"
+        ),
+        "ix_tokens_user_id_access_token_status": select(Token)
+        .filter_by(user_id="u", access_token="t", status=True)
+        .order_by(desc(Token.time_created))
+        .limit(1),
+        "ix_chat_session_case_id_patient_id_time_updated": select(ChatSession).where(
+            ChatSession.case_id == "c", ChatSession.patient_id == "p"
+        ),
+        "ix_users_email": select(User).where(User.email == "e@example.com"),
+    }
+    with engine.connect() as conn:
+        for index_name, stmt in lookups.items():
+            sql = stmt.compile(engine, compile_kwargs={"literal_binds": True})
+            plan = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")).fetchall()
+            assert any(index_name in row[-1] for row in plan), (index_name, plan)
@@ -0,0 +1,179 @@
+import mmap
+import os
+import shutil
+import tempfile
+from contextlib import asynccontextmanager
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from database.database import UPSERT_INSERTS
+from models.attachment import AttachmentBlob
+
+# The database store keeps each blob in one row, read into memory whole.
+MAX_DATABASE_BLOB_BYTES = int(
+    os.getenv("MAX_DATABASE_BLOB_BYTES", str(8 * 1024 * 1024))
+)
+
+
+class AttachmentStore:
+    """Key/value blob storage for uploaded attachments and their preprocessed output.
+
+    Keys are content hashes (optionally with a suffix), so a blob is written once
+    and never changes afterwards.
+    """
+
+    # Largest blob ``put_file`` accepts, or ``None`` for no limit.
+    max_blob_bytes: int | None = None
+
+    async def get(self, key: str, db: AsyncSession) -> bytes | None:
+        raise NotImplementedError
+
+    async def put(self, key: str, data: bytes, db: AsyncSession) -> None:
+        raise NotImplementedError
+
+    async def put_file(self, key: str, fileobj, db: AsyncSession) -> None:
+        """Store the contents of a readable binary file object."""
+        raise NotImplementedError
+
+    @asynccontextmanager
+    async def open_buffer(self, key: str, db: AsyncSession):
+        """Yield a read-only bytes-like view of a blob, or ``None`` if missing."""
+        yield await self.get(key, db)
+
+    async def exists(self, key: str, db: AsyncSession) -> bool:
+        return await self.get(key, db) is not None
+
+
+class FileSystemAttachmentStore(AttachmentStore):
+    """Stores blobs under ``root/<first two hex chars>/<key>``."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key.replace("/", "_"))
+
+    def _read(self, key: str) -> bytes | None:
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    async def get(self, key: str, db: AsyncSession) -> bytes | None:
+        return await run_in_threadpool(self._read, key)
+
+    async def put(self, key: str, data: bytes, db: AsyncSession) -> None:
+        await run_in_threadpool(self._write, key, lambda f: f.write(data))
+
+    async def put_file(self, key: str, fileobj, db: AsyncSession) -> None:
+        await run_in_threadpool(
+            self._write, key, lambda f: shutil.copyfileobj(fileobj, f)
+        )
+
+    def _write(self, key: str, writer) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file first so readers never see a partial blob.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            writer(f)
+        os.replace(tmp_path, path)
+
+    def _map(self, key: str) -> tuple | None:
+        """``(file, mmap)`` of a blob (``mmap`` is ``None`` when it is empty)."""
+        try:
+            f = open(self._path(key), "rb")
+        except FileNotFoundError:
+            return None
+        try:
+            if os.fstat(f.fileno()).st_size == 0:
+                return f, None
+            return f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except BaseException:
+            f.close()
+            raise
+
+    @asynccontextmanager
+    async def open_buffer(self, key: str, db: AsyncSession):
+        """Memory-map the blob so large files are paged in on demand."""
+        opened = await run_in_threadpool(self._map, key)
+        if opened is None:
+            yield None
+            return
+        f, mapped = opened
+        with f:
+            if mapped is None:
+                yield b""
+                return
+            with mapped:
+                view = memoryview(mapped)
+                try:
+                    yield view
+                finally:
+                    view.release()
+
+    async def exists(self, key: str, db: AsyncSession) -> bool:
+        return await run_in_threadpool(os.path.exists, self._path(key))
+
+
+class DatabaseAttachmentStore(AttachmentStore):
+    """
+    Stores blobs in the ``attachment_blobs`` table, one row per blob.
+
+    A row is written from a single in-memory value, so blobs are capped at
+    ``MAX_DATABASE_BLOB_BYTES``; use the filesystem store for larger files.
+    """
+
+    def __init__(self, max_blob_bytes: int = None):
+        self.max_blob_bytes = max_blob_bytes or MAX_DATABASE_BLOB_BYTES
+
+    async def get(self, key: str, db: AsyncSession) -> bytes | None:
+        return await db.scalar(
+            select(AttachmentBlob.data).where(AttachmentBlob.key == key)
+        )
+
+    async def put(self, key: str, data: bytes, db: AsyncSession) -> None:
+        """Insert the blob in the caller's transaction; an existing key is kept."""
+        await db.execute(
+            UPSERT_INSERTS[db.bind.dialect.name](AttachmentBlob)
+            .values(key=key, data=data)
+            .on_conflict_do_nothing(index_elements=[AttachmentBlob.key])
+        )
+
+    async def put_file(self, key: str, fileobj, db: AsyncSession) -> None:
+        """Store a file of at most ``max_blob_bytes``; larger ones raise ValueError."""
+        data = await run_in_threadpool(fileobj.read, self.max_blob_bytes + 1)
+        if len(data) > self.max_blob_bytes:
+            raise ValueError(
+                f"Blob {key} exceeds the database store limit of "
+                f"{self.max_blob_bytes} bytes"
+            )
+        await self.put(key, data, db)
+
+    async def exists(self, key: str, db: AsyncSession) -> bool:
+        return (
+            await db.scalar(select(AttachmentBlob.key).where(AttachmentBlob.key == key))
+            is not None
+        )
+
+
+_store: AttachmentStore | None = None
+
+
+def get_attachment_store() -> AttachmentStore:
+    """Return the process-wide store selected by ``ATTACHMENT_STORE_BACKEND``."""
+    global _store
+    if _store is None:
+        backend = os.getenv("ATTACHMENT_STORE_BACKEND", "filesystem")
+        if backend == "filesystem":
+            _store = FileSystemAttachmentStore(
+                os.getenv("ATTACHMENT_STORE_PATH", "./attachments")
+            )
+        elif backend == "database":
+            _store = DatabaseAttachmentStore()
+        else:
+            raise ValueError(f"Unknown attachment store backend: {backend}")
+    return _store
@@ -1,45 +1,174 @@
-import base64
+import os
+import time
 import pymupdf
 
-from typing import List
 from PIL import Image
-from fastapi import UploadFile
 from io import BytesIO
 
-async def convert_image_to_base64(image: UploadFile) -> str:
+from utils.state import State
+
+# A page is treated as born-digital when its text layer has at least this many
+# characters and embedded images cover no more than this fraction of the page.
+PDF_TEXT_MIN_CHARS = int(os.getenv("PDF_TEXT_MIN_CHARS", "200"))
+PDF_MAX_IMAGE_COVERAGE = float(os.getenv("PDF_MAX_IMAGE_COVERAGE", "0.5"))
+
+
+class ImageEncodingPolicy:
+    """How images are resized and encoded before they are handed to a model.
+
+    Images are scaled down (never up) so their longest side is at most
+    ``max_side`` pixels, keeping the aspect ratio, and encoded as ``format``
+    (``JPEG``, ``WEBP`` or ``PNG``) with the given ``quality``.
+    """
+
+    MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+    def __init__(self, format: str = "JPEG", quality: int = 85, max_side: int = 768):
+        self.format = format.upper()
+        if self.format not in self.MIME_TYPES:
+            raise ValueError(f"Unsupported image encoding format: {format}")
+        self.quality = quality
+        self.max_side = max_side
+
+    @classmethod
+    def from_env(cls) -> "ImageEncodingPolicy":
+        return cls(
+            format=os.getenv("IMAGE_ENCODING_FORMAT", "JPEG"),
+            quality=int(os.getenv("IMAGE_ENCODING_QUALITY", "85")),
+            max_side=int(os.getenv("IMAGE_MAX_SIDE", "768")),
+        )
+
+    @property
+    def mime_type(self) -> str:
+        return self.MIME_TYPES[self.format]
+
+    @property
+    def fingerprint(self) -> str:
+        """Identifies the policy in cache keys, so a policy change re-encodes."""
+        return f"{self.format.lower()}-q{self.quality}-{self.max_side}"
+
+    def encode(self, image: Image.Image) -> bytes:
+        image = _to_8bit(image) if image.mode in HIGH_DEPTH_MODES else image.copy()
+        image.thumbnail((self.max_side, self.max_side), Image.LANCZOS)
+        if self.format == "JPEG" and image.mode != "RGB":
+            image = image.convert("RGB")
+        buffer = BytesIO()
+        if self.format == "PNG":
+            image.save(buffer, format="PNG", optimize=True)
+        else:
+            image.save(buffer, format=self.format, quality=self.quality)
+        return buffer.getvalue()
+
+
+IMAGE_ENCODING_POLICY = ImageEncodingPolicy.from_env()
+
+# 16-bit and float images (e.g. radiographs); JPEG and WEBP clip them to 0-255.
+HIGH_DEPTH_MODES = ("I", "I;16", "I;16B", "I;16L", "I;16N", "F")
+
+
+def _to_8bit(image: Image.Image) -> Image.Image:
+    """Stretch a high bit-depth grayscale image over 0-255 (mode ``L``)."""
+    if image.mode.startswith("I;16"):
+        image = image.convert("I")
+    low, high = image.getextrema()
+    scale = 255 / (high - low) if high > low else 0
+    return image.point(lambda v: (v - low) * scale).convert("L")
+
+
+def encode_image_bytes(image_bytes, policy: ImageEncodingPolicy = None) -> bytes:
     """
-    Convert an image file to a base64-encoded string.
+    Decode raw image bytes and re-encode them according to ``policy``.
     """
-    image_bytes = await image.read()
-    pil_image = Image.open(BytesIO(image_bytes)).resize(
-        (768, 768), Image.LANCZOS
-    )
-    buffer = BytesIO()
-    pil_image.save(buffer, format="PNG")
-    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+    policy = policy or IMAGE_ENCODING_POLICY
+    with Image.open(BytesIO(image_bytes)) as image:
+        return policy.encode(image)
+
+
+def _rasterize_page(page, policy: ImageEncodingPolicy) -> bytes:
+    # Render straight at the target resolution instead of rendering large and
+    # downscaling afterwards.
+    zoom = policy.max_side / max(page.rect.width, page.rect.height)
+    pix = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom))
+    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+    return policy.encode(img)
+
+
+def _image_coverage(page) -> float:
+    """Fraction of the page area covered by embedded images (capped at 1.0)."""
+    page_area = abs(page.rect)
+    if not page_area:
+        return 0.0
+    covered = 0.0
+    for info in page.get_image_info():
+        covered += abs(pymupdf.Rect(info["bbox"]) & page.rect)
+    return min(covered / page_area, 1.0)
 
-async def convert_pdf_to_images(pdf_file: UploadFile) -> List[str]:
+
+def pdf_bytes_to_content(
+    pdf_bytes, filename: str = None, policy: ImageEncodingPolicy = None
+) -> dict:
     """
-    Convert a PDF file to a list of base64-encoded image strings.
+    Extract the content of a PDF document page by page.
+
+    ``pdf_bytes`` may be any bytes-like object, including a ``memoryview`` over
+    a memory-mapped file, in which case pages are read without copying the
+    whole document into memory.
+
+    Pages with a usable text layer are read with PyMuPDF's text extractor;
+    scanned or image-heavy pages are rasterized and encoded with ``policy``.
+
+    Returns:
+        dict: ``images`` (list of encoded image bytes), ``text`` (list of page
+        texts) and ``pages`` (per-page decision records with timing).
     """
+    policy = policy or IMAGE_ENCODING_POLICY
+    result = {"images": [], "text": [], "pages": []}
     try:
-        pdf_bytes = await pdf_file.read()
-        pdf = pymupdf.open(stream=pdf_bytes)
-        pdf_images = []
+        pdf = pymupdf.open(stream=pdf_bytes, filetype="pdf")
+    except Exception as e:
+        State.logger.error(f"Error processing PDF file: {e}")
+        return result
 
+    with pdf:
         for page in pdf:
+            start = time.perf_counter()
             try:
-                pix = page.get_pixmap(matrix=pymupdf.Matrix(4, 4))
-                img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-                img = img.resize((768, 768), Image.LANCZOS)
-                buffer = BytesIO()
-                img.save(buffer, format="PNG")
-                pdf_images.append(base64.b64encode(buffer.getvalue()).decode("utf-8"))
+                text = page.get_text("text").strip()
+                coverage = _image_coverage(page)
+                if (
+                    len(text) >= PDF_TEXT_MIN_CHARS
+                    and coverage <= PDF_MAX_IMAGE_COVERAGE
+                ):
+                    mode = "text"
+                    result["text"].append(text)
+                else:
+                    mode = "raster"
+                    result["images"].append(_rasterize_page(page, policy))
             except Exception as e:
-                print(f"Error processing page {page.number}: {e}")
+                State.logger.error(f"Error processing page {page.number}: {e}")
+                result["pages"].append(
+                    {
+                        "page": page.number + 1,
+                        "mode": "error",
+                        "error": str(e),
+                        "elapsed_ms": round((time.perf_counter() - start) * 1000, 3),
+                    }
+                )
                 continue
+            result["pages"].append(
+                {
+                    "page": page.number + 1,
+                    "mode": mode,
+                    "chars": len(text),
+                    "image_coverage": round(coverage, 3),
+                    "elapsed_ms": round((time.perf_counter() - start) * 1000, 3),
+                }
+            )
 
-        return pdf_images
-    except Exception as e:
-        print(f"Error processing PDF file: {e}")
-        return []
\ No newline at end of file
+    State.logger.info(
+        f"Processed PDF {filename}: "
+        + ", ".join(
+            f"p{p['page']}={p['mode']} ({p['elapsed_ms']}ms)" for p in result["pages"]
+        )
+    )
+    return result
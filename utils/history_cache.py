@@ -0,0 +1,101 @@
+import json
+from collections import OrderedDict
+
+import logfire
+
+HISTORY_CACHE_HITS = logfire.metric_counter(
+    "history_cache.hits", description="Chat memory served from the process cache"
+)
+HISTORY_CACHE_MISSES = logfire.metric_counter(
+    "history_cache.misses", description="Chat memory loaded from the database"
+)
+HISTORY_CACHE_BYTES = logfire.metric_gauge(
+    "history_cache.bytes",
+    unit="By",
+    description="Approximate size of the cached chat memory",
+)
+
+
+def _size(turns: list) -> int:
+    return len(json.dumps(turns, default=str))
+
+
+class HistoryCache:
+    """Per-process LRU cache of chat memory, bounded by approximate JSON size.
+
+    Entries are keyed by ``session_id`` and tagged with a ``stamp`` (the
+    session's ``time_created`` and ``version``). Readers look the stamp up
+    first and only use an entry whose stamp still matches, so writes made by
+    other workers are never served stale. ``max_bytes=0`` disables caching.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+
+    def get(self, session_id: str, stamp: tuple) -> list | None:
+        """Return a copy of the cached memory if it is still at ``stamp``."""
+        entry = self.entries.get(session_id)
+        if entry is None or entry["stamp"] != stamp:
+            HISTORY_CACHE_MISSES.add(1)
+            return None
+        self.entries.move_to_end(session_id)
+        HISTORY_CACHE_HITS.add(1)
+        return list(entry["memory"])
+
+    def put(self, session_id: str, stamp: tuple, memory: list, owner: tuple):
+        """Cache ``memory`` at ``stamp``. ``owner`` is ``(case_id, patient_id)``."""
+        self.discard(session_id)
+        size = _size(memory)
+        if size > self.max_bytes:
+            return
+        self.entries[session_id] = {
+            "stamp": stamp,
+            "memory": list(memory),
+            "owner": owner,
+            "size": size,
+        }
+        self.size += size
+        self._evict()
+
+    def append(self, session_id: str, previous: tuple, stamp: tuple, turns: list):
+        """
+        Write new turns through to a cached session.
+
+        The entry is extended only if it is at ``previous``, the stamp just
+        before this write; otherwise another write got in between and the
+        entry is dropped.
+        """
+        entry = self.entries.get(session_id)
+        if entry is None:
+            return
+        if entry["stamp"] != previous:
+            self.discard(session_id)
+            return
+        size = _size(turns)
+        entry["memory"].extend(turns)
+        entry["stamp"] = stamp
+        entry["size"] += size
+        self.size += size
+        self.entries.move_to_end(session_id)
+        self._evict()
+
+    def discard(self, session_id: str):
+        entry = self.entries.pop(session_id, None)
+        if entry is not None:
+            self.size -= entry["size"]
+            HISTORY_CACHE_BYTES.set(self.size)
+
+    def discard_where(self, case_id: str = None, patient_id: str = None):
+        """Drop every cached session of a case or patient."""
+        for session_id, entry in list(self.entries.items()):
+            entry_case_id, entry_patient_id = entry["owner"]
+            if entry_case_id == case_id or entry_patient_id == patient_id:
+                self.discard(session_id)
+
+    def _evict(self):
+        while self.size > self.max_bytes and self.entries:
+            _, entry = self.entries.popitem(last=False)
+            self.size -= entry["size"]
+        HISTORY_CACHE_BYTES.set(self.size)
@@ -0,0 +1,15 @@
+import re
+import unicodedata
+
+NON_WORD = re.compile(r"[^\w]+")
+
+
+def normalize_name(name: str) -> str:
+    """
+    Lowercase ``name`` without accents or punctuation, words single-spaced:
+    ``"  O'Brien-Núñez "`` -> ``"obrien nunez"``.
+    """
+    name = unicodedata.normalize("NFKD", name or "")
+    name = "".join(char for char in name if not unicodedata.combining(char))
+    name = name.casefold().replace("'", "").replace("\u2019", "")
+    return " ".join(NON_WORD.sub(" ", name).replace("_", " ").split())
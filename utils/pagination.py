@@ -0,0 +1,62 @@
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from utils.state import State
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def select_fields(model, fields: str, allowed: list, key: str) -> list:
+    """
+    Resolve a comma-separated ``fields=`` parameter to model columns.
+
+    ``key`` (the pagination key) is always included so the page can be
+    continued. Without ``fields`` every allowed column is returned.
+
+    Returns:
+        List[Column]: The columns to select.
+    """
+    names = [name.strip() for name in (fields or "").split(",") if name.strip()]
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        State.logger.error(f"Unknown fields requested: {unknown}")
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(allowed)}",
+        )
+    names = names or allowed
+    if key not in names:
+        names = [key, *names]
+    return [getattr(model, name) for name in names]
+
+
+async def keyset_page(
+    db: AsyncSession,
+    columns: list,
+    key,
+    filters: list = (),
+    limit: int = DEFAULT_PAGE_SIZE,
+    after: str = None,
+):
+    """
+    Fetch one page of rows ordered by ``key``, starting after the ``after`` key.
+
+    Only ``columns`` are selected, and the query reads one row past ``limit``
+    to know whether another page exists.
+
+    Returns:
+        tuple: ``(rows, next_after)`` where ``rows`` are dicts and ``next_after``
+        is the cursor for the following page, or ``None`` on the last page.
+    """
+    query = select(*columns).where(*filters)
+    if after is not None:
+        query = query.where(key > after)
+    result = await db.execute(query.order_by(key).limit(limit + 1))
+    rows = [dict(row._mapping) for row in result]
+    next_after = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_after = rows[-1][key.key]
+    return rows, next_after
@@ -4,7 +4,8 @@ from fastapi import HTTPException, status
 from jose import jwt
 from jwt import InvalidTokenError
 from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from utils.state import State
 from models.token import Token
 
@@ -19,8 +20,8 @@ def verify_password(password: str, hashed_pass: str) -> bool:
     return password_context.verify(password, hashed_pass)
 
 
-def verify_token(token: str, db: Session):
-    token_record = db.query(Token).filter(Token.access_token == token).first()
+async def verify_token(token: str, db: AsyncSession):
+    token_record = await db.scalar(select(Token).where(Token.access_token == token))
     if not token_record or not token_record.status:
         State.logger.error("Invalid or expired token")
         raise HTTPException(
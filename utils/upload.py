@@ -0,0 +1,197 @@
+import hashlib
+import os
+
+from fastapi import HTTPException, Request, UploadFile
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import FormData, Headers
+from starlette.formparsers import MultiPartException, MultiPartParser
+
+from utils.state import State
+
+MAX_UPLOAD_FILE_BYTES = int(os.getenv("MAX_UPLOAD_FILE_BYTES", str(25 * 1024 * 1024)))
+MAX_UPLOAD_REQUEST_BYTES = int(
+    os.getenv("MAX_UPLOAD_REQUEST_BYTES", str(100 * 1024 * 1024))
+)
+# Bulk imports are spooled to disk and inserted chunk by chunk by a background
+# job, so their request bodies get a separate, larger cap.
+MAX_IMPORT_REQUEST_BYTES = int(
+    os.getenv("MAX_IMPORT_REQUEST_BYTES", str(2 * 1024 * 1024 * 1024))
+)
+IMPORT_PATH_PREFIX = "/api/v1/imports"
+# Uploads larger than this roll over from memory to a temporary file on disk.
+UPLOAD_SPOOL_MAX_MEMORY = int(os.getenv("UPLOAD_SPOOL_MAX_MEMORY", str(1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+
+class SpoolingMultiPartParser(MultiPartParser):
+    """Starlette's multipart parser, spooling files past ``UPLOAD_SPOOL_MAX_MEMORY``."""
+
+    max_file_size = UPLOAD_SPOOL_MAX_MEMORY
+
+
+class UploadRequest(Request):
+    """Request whose multipart form is parsed by ``SpoolingMultiPartParser``."""
+
+    async def _get_form(self, *, max_files=1000, max_fields=1000) -> FormData:
+        content_type = self.headers.get("content-type", "").partition(";")[0].lower()
+        if self._form is None and content_type.strip() == "multipart/form-data":
+            parser = SpoolingMultiPartParser(
+                self.headers, self.stream(), max_files=max_files, max_fields=max_fields
+            )
+            try:
+                self._form = await parser.parse()
+            except MultiPartException as exc:
+                raise HTTPException(status_code=400, detail=exc.message)
+        return await super()._get_form(max_files=max_files, max_fields=max_fields)
+
+
+class UploadRoute(APIRoute):
+    """
+    Route class for routers that take file uploads (``route_class`` of the
+    router); their forms are parsed as an ``UploadRequest``.
+    """
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def upload_handler(request: Request):
+            return await handler(UploadRequest(request.scope, request.receive))
+
+        return upload_handler
+
+
+class UploadBudget:
+    """Tracks the bytes ingested by a single request against the request limit."""
+
+    def __init__(self, max_request_bytes: int = None, max_file_bytes: int = None):
+        self.max_request_bytes = max_request_bytes or MAX_UPLOAD_REQUEST_BYTES
+        self.max_file_bytes = max_file_bytes or MAX_UPLOAD_FILE_BYTES
+        self.used = 0
+
+    def consume(self, size: int):
+        self.used += size
+        if self.used > self.max_request_bytes:
+            State.logger.error("Upload exceeds the per-request size limit")
+            raise HTTPException(
+                status_code=413,
+                detail=f"Uploads exceed the per-request limit of {self.max_request_bytes} bytes",
+            )
+
+
+async def hash_upload(file: UploadFile, budget: UploadBudget):
+    """
+    Check an upload against the size limits and hash it.
+
+    Starlette has already spooled the multipart body (in memory up to
+    ``UPLOAD_SPOOL_MAX_MEMORY``, on disk beyond that), so the digest is read
+    from that spool rather than from another copy.
+
+    Returns:
+        tuple: ``(fileobj, sha256_hexdigest, size)``. ``fileobj`` is Starlette's
+        spool rewound to the start; the form closes it after the request.
+    """
+    size = file.size
+    if size is None:
+        size = await run_in_threadpool(_seek_end, file.file)
+    if size > budget.max_file_bytes:
+        State.logger.error(f"Upload {file.filename} exceeds the per-file size limit")
+        raise HTTPException(
+            status_code=413,
+            detail=f"File {file.filename} exceeds the per-file limit of {budget.max_file_bytes} bytes",
+        )
+    budget.consume(size)
+    digest = await run_in_threadpool(_hash_file, file.file)
+    return file.file, digest, size
+
+
+def _seek_end(fileobj) -> int:
+    size = fileobj.seek(0, os.SEEK_END)
+    fileobj.seek(0)
+    return size
+
+
+def _hash_file(fileobj) -> str:
+    fileobj.seek(0)
+    digest = hashlib.sha256()
+    while chunk := fileobj.read(UPLOAD_CHUNK_SIZE):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+class UploadTooLarge(Exception):
+    """Raised from ``receive`` once a request body passes the request limit."""
+
+
+class UploadLimitMiddleware:
+    """Reject request bodies larger than ``MAX_UPLOAD_REQUEST_BYTES`` with 413.
+
+    Bulk imports under ``IMPORT_PATH_PREFIX`` are held to
+    ``MAX_IMPORT_REQUEST_BYTES`` instead.
+
+    The check runs before FastAPI parses the form, so an oversized upload is
+    refused from its ``Content-Length`` without being spooled to disk. Bodies
+    without a length (chunked) are counted as they arrive and cut off at the
+    limit.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        limit = self._limit(scope)
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > limit:
+            await self._reject(scope, receive, send, limit)
+            return
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    raise UploadTooLarge()
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            # Whatever the app makes of the aborted body is replaced by the 413.
+            if exceeded:
+                return
+            response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not exceeded:
+                raise
+        if exceeded and not response_started:
+            await self._reject(scope, receive, send, limit)
+
+    @staticmethod
+    def _limit(scope) -> int:
+        if scope["path"].startswith(IMPORT_PATH_PREFIX):
+            return MAX_IMPORT_REQUEST_BYTES
+        return MAX_UPLOAD_REQUEST_BYTES
+
+    async def _reject(self, scope, receive, send, limit: int):
+        State.logger.error("Upload exceeds the per-request size limit")
+        response = JSONResponse(
+            status_code=413,
+            content={
+                "detail": f"Uploads exceed the per-request limit of {limit} bytes"
+            },
+        )
+        await response(scope, receive, send)
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import time
+
+import logfire
+from sqlalchemy import bindparam, select, update
+
+logger = logging.getLogger("app.write_behind")
+
+WRITE_BEHIND_DEPTH = logfire.metric_gauge(
+    "write_behind.queue_depth",
+    description="Rows with pending updates waiting to be flushed",
+)
+WRITE_BEHIND_FLUSH_LATENCY = logfire.metric_histogram(
+    "write_behind.flush_latency",
+    unit="ms",
+    description="Time taken to flush one batch of pending updates",
+)
+WRITE_BEHIND_FLUSHED = logfire.metric_counter(
+    "write_behind.flushed_rows",
+    description="Rows updated by write-behind flushes",
+)
+WRITE_BEHIND_DROPPED = logfire.metric_counter(
+    "write_behind.dropped_rows",
+    description="Pending updates dropped because their row no longer exists",
+)
+WRITE_BEHIND_FAILURES = logfire.metric_counter(
+    "write_behind.flush_failures",
+    description="Write-behind flushes that failed and were requeued",
+)
+
+
+class WriteBehindQueue:
+    """Buffers small column updates and writes them in batched UPDATEs.
+
+    ``submit`` only records the new values, merged per row, so repeated
+    updates to the same row cost one write. A background worker flushes the
+    buffer every ``flush_interval`` seconds, or as soon as ``max_batch`` rows
+    are pending. Updates to rows that no longer exist (deleted or archived
+    since they were queued) are dropped, logged and counted in
+    ``write_behind.dropped_rows``.
+
+    ``before_flush(db, batch)``, if given, is awaited inside each flush's
+    transaction before the updates are written, with ``batch`` mapping keys to
+    their pending values.
+
+    Call ``start`` and ``drain`` from the application lifespan; ``drain``
+    stops the worker and flushes whatever is still pending.
+    """
+
+    def __init__(
+        self,
+        model,
+        key: str,
+        session_factory,
+        max_batch: int = 100,
+        flush_interval: float = 0.5,
+        before_flush=None,
+    ):
+        self.table = model.__table__
+        self.key = key
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.before_flush = before_flush
+        self.pending = {}
+        self._wake = None
+        self._worker = None
+
+    def submit(self, key_value, **values):
+        """Queue ``values`` for the row ``key_value``; later values win."""
+        self.pending.setdefault(key_value, {}).update(values)
+        WRITE_BEHIND_DEPTH.set(len(self.pending))
+        if self._wake and len(self.pending) >= self.max_batch:
+            self._wake.set()
+
+    def pending_values(self, key_value) -> dict:
+        """Updates for ``key_value`` that are not written yet (read-your-writes)."""
+        return self.pending.get(key_value, {})
+
+    async def flush(self) -> int:
+        """
+        Write all pending updates, one executemany UPDATE per set of columns.
+
+        On failure the batch is merged back under any newer updates and
+        retried on the next flush.
+
+        Returns:
+            int: Number of rows in the flushed batch.
+        """
+        if not self.pending:
+            return 0
+        batch, self.pending = self.pending, {}
+        start = time.perf_counter()
+        key = self.table.c[self.key]
+        try:
+            async with self.session_factory() as db:
+                found = set(await db.scalars(select(key).where(key.in_(list(batch)))))
+                live = {k: v for k, v in batch.items() if k in found}
+                dropped = [key_value for key_value in batch if key_value not in found]
+                groups = {}
+                for key_value, values in live.items():
+                    groups.setdefault(tuple(sorted(values)), []).append(
+                        {"_key": key_value, **{f"_{k}": v for k, v in values.items()}}
+                    )
+                if self.before_flush:
+                    await self.before_flush(db, live)
+                for columns, rows in groups.items():
+                    statement = (
+                        update(self.table)
+                        .where(key == bindparam("_key"))
+                        .values({column: bindparam(f"_{column}") for column in columns})
+                    )
+                    await db.execute(statement, rows)
+                await db.commit()
+        except BaseException as e:
+            for key_value, values in batch.items():
+                self.pending[key_value] = {**values, **self.pending.get(key_value, {})}
+            WRITE_BEHIND_DEPTH.set(len(self.pending))
+            if isinstance(e, Exception):
+                WRITE_BEHIND_FAILURES.add(1)
+                logger.error("Write-behind flush of %d rows failed: %s", len(batch), e)
+                return 0
+            raise
+        WRITE_BEHIND_FLUSH_LATENCY.record((time.perf_counter() - start) * 1000)
+        WRITE_BEHIND_FLUSHED.add(len(live))
+        if dropped:
+            WRITE_BEHIND_DROPPED.add(len(dropped))
+            logger.warning(
+                "Write-behind flush dropped updates to %d missing %s rows: %s",
+                len(dropped),
+                self.table.name,
+                ", ".join(map(str, dropped[:10])),
+            )
+        WRITE_BEHIND_DEPTH.set(len(self.pending))
+        return len(batch)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    def start(self):
+        """Start the background flush worker on the running event loop."""
+        self._wake = asyncio.Event()
+        self._worker = asyncio.create_task(self._run())
+
+    async def drain(self):
+        """Stop the worker and flush everything that is still pending."""
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+            self._wake = None
+        await self.flush()